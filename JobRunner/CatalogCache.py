@@ -12,6 +12,7 @@ class CatalogCache(object):
         # TODO CODE add a method to SDK clients to get the token, then use that here
         self.has_admin_token = bool(token)
         self.module_cache = dict()
+        self.image_cache = dict()
 
     def get_volume_mounts(self, module, method, cgroup):
         if not self.has_admin_token:
@@ -45,3 +46,18 @@ class CatalogCache(object):
             module_info["cached"] = True
 
         return module_info
+
+    def get_image_name(self, module, version):
+        """
+        Look up the docker image for a module version without touching the module cache,
+        so that the lookup doesn't count as a use of the module.
+        """
+        key = (module, version)
+        if key not in self.image_cache:
+            if module in self.module_cache:
+                return self.module_cache[module]["docker_img_name"]
+            req = {"module_name": module}
+            if version is not None:
+                req["version"] = version
+            self.image_cache[key] = self.catalog.get_module_version(req)["docker_img_name"]
+        return self.image_cache[key]
@@ -0,0 +1,139 @@
+import logging
+from collections import OrderedDict
+from threading import Event, Lock, Thread
+from time import sleep as _sleep
+from time import time as _time
+
+
+class ContainerState(object):
+    """
+    The lifecycle state of a container as reported by docker events.
+    """
+
+    def __init__(self):
+        self.exited = Event()
+        self.oom_killed = False
+        self.exit_code = None
+        # Called from the watcher thread when the container exits
+        self.on_exit = None
+
+
+class DockerEventWatcher(object):
+    """
+    Watches the docker event stream for container exits so that containers don't have to be
+    polled individually.
+
+    A single subscription serves every container started by a DockerRunner. die, oom and
+    destroy events are recorded against the container's state; callers wait on
+    ContainerState.exited to learn that a container has stopped.
+    """
+
+    _ACTIONS = ["die", "oom", "destroy"]
+    # The number of events for containers that haven't been registered yet to keep. A
+    # container can exit before DockerRunner registers it, and other processes may be
+    # running containers on the same host.
+    _MAX_UNREGISTERED = 1000
+
+    def __init__(self, client, reconnect_delay: float = 1.0):
+        """
+        client - the docker client.
+        reconnect_delay - the wait in seconds before resubscribing after the stream fails.
+        """
+        self.client = client
+        self.reconnect_delay = reconnect_delay
+        self._states = dict()
+        self._unregistered = OrderedDict()
+        self._lock = Lock()
+        self._connected = Event()
+        self._stop = False
+        self._stream = None
+        self._thread = None
+
+    @property
+    def connected(self) -> bool:
+        """
+        True if the watcher is currently subscribed to the event stream.
+        """
+        return self._connected.is_set()
+
+    def start(self, timeout: float = 5.0):
+        """
+        Start watching events, if not already started, and wait for the subscription.
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self._stop = False
+            self._thread = Thread(target=self._watch, daemon=True)
+            self._thread.start()
+        self._connected.wait(timeout)
+
+    def stop(self):
+        self._stop = True
+        stream = self._stream
+        if stream is not None:
+            try:
+                stream.close()
+            except Exception:
+                pass
+
+    def register(self, container_id: str) -> ContainerState:
+        """
+        Start tracking a container and get its state object.
+        """
+        with self._lock:
+            state = self._unregistered.pop(container_id, None) or ContainerState()
+            self._states[container_id] = state
+            return state
+
+    def unregister(self, container_id: str):
+        with self._lock:
+            self._states.pop(container_id, None)
+
+    def _get_state(self, container_id: str) -> ContainerState:
+        # Must be called with the lock held.
+        state = self._states.get(container_id)
+        if state is None:
+            state = self._unregistered.get(container_id)
+            if state is None:
+                state = self._unregistered[container_id] = ContainerState()
+                if len(self._unregistered) > self._MAX_UNREGISTERED:
+                    self._unregistered.popitem(last=False)
+        return state
+
+    def _handle(self, event: dict):
+        action = event.get("Action") or event.get("status")
+        actor = event.get("Actor", {})
+        container_id = actor.get("ID") or event.get("id")
+        if not container_id or action not in self._ACTIONS:
+            return
+        with self._lock:
+            state = self._get_state(container_id)
+            if action == "oom":
+                state.oom_killed = True
+            else:
+                exit_code = actor.get("Attributes", {}).get("exitCode")
+                if exit_code is not None:
+                    state.exit_code = int(exit_code)
+                state.exited.set()
+        if action != "oom" and state.on_exit is not None:
+            state.on_exit()
+
+    def _watch(self):
+        since = _time()
+        while not self._stop:
+            try:
+                self._stream = self.client.events(
+                    since=int(since),
+                    decode=True,
+                    filters={"type": "container", "event": self._ACTIONS},
+                )
+                self._connected.set()
+                for event in self._stream:
+                    since = event.get("time", since)
+                    self._handle(event)
+            except Exception as e:
+                if not self._stop:
+                    logging.warning(f"Docker event stream failed, resubscribing: {e}")
+            finally:
+                self._connected.clear()
+            if not self._stop:
+                _sleep(self.reconnect_delay)
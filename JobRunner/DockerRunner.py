@@ -1,14 +1,51 @@
 import atexit
+import calendar
+from functools import lru_cache
+import heapq
+from itertools import islice
 import logging
+import os
+from operator import itemgetter
 from threading import Thread
 from time import sleep as _sleep
+from time import strptime as _strptime
 from time import time as _time
 import docker
 from docker.errors import ImageNotFound
 from requests.exceptions import ReadTimeout
 
+from .DockerEventWatcher import DockerEventWatcher
+from .ImagePuller import ImagePuller
+from .metrics import ContainerStats
+from .WarmPool import WarmPool
+from .supervisor import Offload, Supervisor, run_blocking
+
 logging.basicConfig(level=logging.INFO)
 
+# The maximum number of lines of polled container output to pass to the logger at once
+_LOG_BATCH_LINES = 1000
+
+
+@lru_cache(maxsize=1024)
+def _docker_seconds_to_epoch(seconds: bytes):
+    return calendar.timegm(_strptime(seconds.decode("ascii"), "%Y-%m-%dT%H:%M:%S"))
+
+
+def _docker_ts_to_ns(ts: bytes):
+    """
+    Convert a docker RFC3339Nano UTC timestamp, e.g. 2019-07-08T23:21:32.5086965Z, to
+    nanoseconds since the epoch. Returns None if the timestamp can't be parsed.
+    """
+    try:
+        ns = _docker_seconds_to_epoch(ts[:19]) * 1000000000
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if ts[19:20] == b".":
+        frac = ts[20:].rstrip(b"Z")
+        if frac.isdigit():
+            ns += int(frac[:9].ljust(9, b"0"))
+    return ns
+
 
 class DockerRunner:
     """
@@ -26,143 +63,360 @@ class DockerRunner:
 
         for container in self.containers:
             self.remove(container)
+        if self.pool is not None:
+            self.pool.close()
 
-    def __init__(self, logger=None, debug=False):
+    def __init__(
+            self,
+            logger=None,
+            debug=False,
+            follow_logs=False,
+            use_events=False,
+            warm_pool_dir=None,
+            warm_pool_size=1,
+            warm_pool_max=4,
+            warm_pool_idle=600,
+    ):
         """
         Inputs: config dictionary, Job ID, and optional logger
+        follow_logs - if True, stream container output over a single follow connection per
+            container rather than polling for it every log_interval seconds.
+        use_events - if True, detect container exits, including OOM kills, from a single
+            docker event stream rather than reloading each container every log_interval
+            seconds.
+        warm_pool_dir - if set, keep pre-created containers for recently used subjob images,
+            with their work directories in this directory. See WarmPool for the other
+            warm_pool_* settings.
         """
         self.timeout = 300
         self.docker = docker.from_env(timeout=self.timeout)
         self.logger = logger
         self.containers = []  # type: List[Container]
         self.threads = []  # type: List[Thread]
+        self.supervisor = Supervisor(name="docker-supervisor")
         self.log_interval = 1
+        self.follow_logs = follow_logs
+        self.events = DockerEventWatcher(self.docker) if use_events else None
+        self.pool = None
+        if warm_pool_dir:
+            self.pool = WarmPool(
+                self.docker,
+                warm_pool_dir,
+                size=warm_pool_size,
+                max_size=warm_pool_max,
+                idle_timeout=warm_pool_idle,
+            )
         self.debug = debug
         atexit.register(self._cleanup_docker_containers)
-        self.pulled = dict()
+        self.stats = ContainerStats()
+        self.images = ImagePuller(self.docker, logger=logger, stats=self.stats)
 
     @staticmethod
-    def _sort_lines_by_time(sout, serr):
+    def _iter_log_spans(blob):
+        """
+        Lazily find the lines of timestamped docker log output without decoding or splitting
+        the whole blob.
+        :return: An iterator of (timestamp in ns, start of text, end of text) tuples. Lines
+            without a parseable timestamp get the previous line's, or 0 if there is none.
+        """
+        start = 0
+        end = len(blob)
+        last_ns = 0
+        while start < end:
+            nl = blob.find(b"\n", start)
+            if nl < 0:
+                nl = end
+            if nl > start:
+                sp = blob.find(b" ", start, nl)
+                if sp < 0:
+                    sp = nl
+                ns = _docker_ts_to_ns(blob[start:sp])
+                # keep unparseable lines in place rather than sorting them to the front
+                last_ns = ns = ns if ns is not None else last_ns
+                yield ns, sp + 1, nl
+            start = nl + 1
+
+    @classmethod
+    def _iter_log_lines(cls, blob, ierr):
         """
-        This is an internal function to sort and interlace output for NJS.
-        This is not fully implemented yet and sould be rethought.
+        Lazily parse timestamped docker log output into (timestamp in ns, is_error, text)
+        tuples.
         """
-        lines_by_time = dict()
-        ierr = 0
-        for stream in [sout, serr]:
-            if len(sout) == 0 and len(serr) == 0:
+        for ns, start, end in cls._iter_log_spans(blob):
+            yield ns, ierr, blob[start:end].decode("utf-8", errors="replace")
+
+    @classmethod
+    def _in_order(cls, blob) -> bool:
+        """
+        Check that the lines of docker log output are in timestamp order, without decoding
+        them.
+        """
+        last = 0
+        for ns, _, _ in cls._iter_log_spans(blob):
+            if ns < last:
+                return False
+            last = ns
+        return True
+
+    @staticmethod
+    def _log_line(ns, ierr, txt):
+        line = {"line": txt, "is_error": ierr}
+        if ns:
+            line["ts"] = ns // 1000000
+        return line
+
+    @classmethod
+    def _sort_lines_by_time(cls, sout, serr):
+        """
+        Lazily interlace stdout and stderr output by timestamp. The streams are merged as they
+        are parsed. Docker normally returns each stream in order, so a stream is only sorted
+        if a first pass over its timestamps finds it isn't. Lines with the same timestamp keep
+        their order within a stream, and stdout comes first between streams.
+        :return: An iterator of log lines.
+        """
+        streams = []
+        for ierr, blob in enumerate([sout, serr]):
+            if not blob:
                 continue
-            for line in stream.decode("utf-8").split("\n"):
-                if len(line) > 0:
-                    elements = line.split(maxsplit=1)
-                    if len(elements) == 2:
-                        (ts, txt) = elements
-                    else:
-                        ts = elements[0]
-                        txt = ""
-                    if ts not in lines_by_time:
-                        lines_by_time[ts] = []
-                    lines_by_time[ts].append({"line": txt, "is_error": ierr})
-            ierr += 1
-        nlines = []
-        for ts in sorted(lines_by_time.keys()):
-            nlines.extend(lines_by_time[ts])
-        return nlines
-
-    def _shepherd_logs(self, c, now, last):
+            if cls._in_order(blob):
+                streams.append(cls._iter_log_lines(blob, ierr))
+            else:
+                streams.append(sorted(cls._iter_log_lines(blob, ierr), key=itemgetter(0)))
+        return (
+            cls._log_line(ns, ierr, txt)
+            for ns, ierr, txt in heapq.merge(*streams, key=itemgetter(0))
+        )
+
+    def _shepherd_logs(self, c, job_id, now, last):
         sout = c.logs(stdout=True, stderr=False, since=last, until=now, timestamps=True)
         serr = c.logs(stdout=False, stderr=True, since=last, until=now, timestamps=True)
+        if self.logger is None:
+            return
+        # Hand the merged lines to the logger in batches rather than all at once
         lines = self._sort_lines_by_time(sout, serr)
-        if self.logger is not None:
-            self.logger.log_lines(lines)
+        while batch := list(islice(lines, _LOG_BATCH_LINES)):
+            self.logger.log_lines(batch, source=job_id)
+
+    @classmethod
+    def _parse_log_line(cls, raw, ierr):
+        """
+        Convert a timestamped line of docker log output into a log line.
+        """
+        for ns, ierr, txt in cls._iter_log_lines(raw, ierr):
+            return cls._log_line(ns, ierr, txt)
+
+    def _follow_logs(self, c, job_id):
+        """
+        Stream the container's stdout and stderr over a single follow connection, passing
+        lines to the logger as they arrive. Returns when the container exits or the
+        connection is lost.
+        """
+        api = self.docker.api
+        # Container.logs() drops the stream ID of each multiplexed frame, so use the lower
+        # level API to get stdout and stderr demultiplexed from one connection.
+        params = {"follow": 1, "stdout": 1, "stderr": 1, "timestamps": 1}
+        res = api._get(api._url("/containers/{0}/logs", c.id), params=params, stream=True)
+        api._disable_socket_timeout(api._get_raw_response_socket(res))
+        partial = [b"", b""]
+        try:
+            for frame in api._read_from_socket(res, stream=True, tty=False, demux=True):
+                lines = []
+                for ierr, data in enumerate(frame):
+                    if not data:
+                        continue
+                    *complete, partial[ierr] = (partial[ierr] + data).split(b"\n")
+                    lines.extend(self._parse_log_line(raw, ierr) for raw in complete if raw)
+                if lines and self.logger is not None:
+                    self.logger.log_lines(lines, source=job_id)
+        finally:
+            res.close()
+        lines = [self._parse_log_line(raw, ierr) for ierr, raw in enumerate(partial) if raw]
+        if lines and self.logger is not None:
+            self.logger.log_lines(lines, source=job_id)
 
-    def _shepherd(self, c, job_id, queues):
-        last = 1
+    def _wait_for_exit(self, c, state):
+        """
+        Wait up to log_interval seconds for the container to exit. Runs under the supervisor.
+        :return: True if the container has exited.
+        """
+        if state is not None and self.events.connected:
+            if not state.exited.is_set():
+                yield self.log_interval
+            return state.exited.is_set()
+        yield self.log_interval
+        try:
+            yield Offload(c.reload)
+            return c.status not in ["created", "running"]
+        except Exception:
+            return True
+
+    def _poll_logs(self, c, job_id, state=None, last=1):
+        """
+        Fetch new container output every log_interval seconds until the container exits.
+        Runs under the supervisor. The docker and ee2 calls run on its workers.
+        """
+        error = None
         try:
             dolast = False
             while True:
                 now = int(_time())
-                self._shepherd_logs(c, now, last)
+                yield Offload(self._shepherd_logs, c, job_id, now, last)
                 last = now
                 if dolast:
                     break
-                _sleep(self.log_interval)
-                try:
-                    c.reload()
-                    if c.status not in ["created", "running"]:
-                        dolast = True
-                except Exception:
-                    dolast = True
+                dolast = yield from self._wait_for_exit(c, state)
         except Exception as e:
-            if self.logger is not None:
-                self.logger.error(f"Unexpected failure in docker logging. {e}")
+            error = e
+        # Capture the last few seconds of logs
+        try:
+            now = int(_time())
+            yield Offload(self._shepherd_logs, c, job_id, now, last)
+        except Exception:
+            pass
+        if error is not None:
+            raise error
+
+    def _report_exit(self, c, job_id, state):
+        if state is None:
+            return
+        if state.oom_killed and self.logger is not None:
+            self.logger.error(
+                f"Container {c.id} for job {job_id} was killed because it ran out of memory")
+        if state.exit_code:
+            logging.info(f"Container {c.id} for job {job_id} exited with code {state.exit_code}")
+
+    def _logging_failed(self, c, e):
+        if self.logger is not None:
+            self.logger.error(f"Unexpected failure in docker logging. {e}")
+        else:
+            print(f"Exception in docker logging for {c.id}")
+            raise e
+
+    def _finish(self, c, job_id, queues, state):
+        try:
+            if self.debug is True:
+                msg = (
+                    f"Not going to delete container {c.id} because debug mode is on"
+                )
+                self.logger.log(msg)
+                logging.info(msg)
             else:
-                print(f"Exception in docker logging for {c.id}")
-                raise e
-        finally:
+                c.remove()
+                self.containers.remove(c)
+        except Exception:
+            # Maybe something already cleaned it up.  Move on.
+            pass
+        if state is not None:
+            self.events.unregister(c.id)
+        self.stats.record_exit()
+        for q in queues:
+            q.put(["finished", job_id, None])
 
-            # Capture the last few seconds of logs
+    def _monitor(self, c, job_id, queues, state=None, last=1):
+        """
+        Capture the container's output until it exits and then clean up. Runs under the
+        supervisor.
+        """
+        error = None
+        try:
+            yield from self._poll_logs(c, job_id, state=state, last=last)
+            yield Offload(self._report_exit, c, job_id, state)
+        except Exception as e:
             try:
-                now = int(_time())
-                self._shepherd_logs(c, now, last)
-            except Exception:
-                pass
+                yield Offload(self._logging_failed, c, e)
+            except Exception as failed:
+                error = failed
+        yield Offload(self._finish, c, job_id, queues, state)
+        if error is not None:
+            raise error
 
-            try:
-                if self.debug is True:
-                    msg = (
-                        f"Not going to delete container {c.id} because debug mode is on"
-                    )
-                    self.logger.log(msg)
-                    logging.info(msg)
-                else:
-                    c.remove()
-                    self.containers.remove(c)
-            except Exception:
-                # Maybe something already cleaned it up.  Move on.
-                pass
-            for q in queues:
-                q.put(["finished", job_id, None])
-
-    def _pull_and_run(self, image, env, labels, vols, cgroup_parent=None):
+    def _supervise(self, c, job_id, queues, state=None, last=1):
+        task = self.supervisor.spawn(self._monitor(c, job_id, queues, state=state, last=last))
+        if state is not None:
+            state.on_exit = task.wake
+            if state.exited.is_set():
+                task.wake()
+
+    def _shepherd(self, c, job_id, queues, state=None):
+        """
+        Capture the container's output on the current thread until it exits and then clean up.
+        """
+        if not self.follow_logs:
+            run_blocking(self._monitor(c, job_id, queues, state=state))
+            return
+        supervised = False
+        try:
+            self._follow_logs(c, job_id)
+            # The stream also ends if the connection to the daemon drops
+            if state is None or not state.exited.is_set():
+                c.reload()
+                if c.status in ["created", "running"]:
+                    logging.warning(f"Log stream for {c.id} ended early, falling back to polling")
+                    self._supervise(c, job_id, queues, state=state, last=int(_time()))
+                    supervised = True
+                    return
+            self._report_exit(c, job_id, state)
+        except Exception as e:
+            self._logging_failed(c, e)
+        finally:
+            if not supervised:
+                self._finish(c, job_id, queues, state)
+
+    def _pull_and_run(
+            self, image, env, labels, vols, cgroup_parent=None, command="async", ports=None):
         """
         Pull an image and then attempt to run it
         :param image: Image to pull
         :param env: Env for the docker container
         :param labels: Labels for the docker container
         :param vols: Vols for the docker container
+        :param command: The container command, or None for the image's default
+        :param ports: Ports to publish, as for docker's containers.run
         :return: Container ID
         """
-        image_id = None
-
-        try:
-            # See if the image exists
-            image_id = self.docker.images.get(name=image).id
-            self.pulled[image] = image_id
-        except docker.errors.ImageNotFound as e:
-            self.logger.log(f"Image not found locally, will attempt to pull. Error was:\n{e}")
-
-        try:
-            # If no tag is specified, will return a list
-            if not self.pulled.get(image):
-                image_id = self.docker.images.pull(image).id
-                self.pulled[image] = image_id
-        except docker.errors.ImageNotFound as e:
-            self.logger.error(f"{e}")
+        image_id = self.images.get(image)
 
         if image_id is None:
             raise Exception(f"Couldn't find image for {image}")
 
         return self.docker.containers.run(
             image,
-            "async",
+            command,
             environment=env,
             detach=True,
             labels=labels,
             volumes=vols,
             cgroup_parent=cgroup_parent,
+            ports=ports,
         )
 
+    def _run_pooled(self, job_id, image, env, vols, labels, cgroup=None):
+        """
+        Start a subjob in a container from the warm pool, and refill the pool.
+        :return: The container, or None if no pooled container was available.
+        """
+        job_dirs = [h for h, v in vols.items() if v["bind"] == "/kb/module/work"]
+        if len(job_dirs) != 1:
+            return None
+        other_vols = {h: v for h, v in vols.items() if h != job_dirs[0]}
+        key = WarmPool.key(image, env, other_vols, labels, cgroup)
+        c = self.pool.acquire(key, job_dirs[0])
+        self.pool.fill(key, image, env, other_vols, labels, cgroup)
+        if c is None:
+            return None
+        try:
+            c.start()
+        except Exception as e:
+            logging.warning(f"Failed to start pooled container {c.id} for {job_id}: {e}")
+            self.remove(c)
+            # Undo the binding so the job can run in a fresh container
+            pool_dir = os.readlink(job_dirs[0])
+            os.unlink(job_dirs[0])
+            os.rename(pool_dir, job_dirs[0])
+            return None
+        self.logger.log(f"Running {job_id} in pre-created container {c.id}")
+        return c
+
     def run(self, job_id, image, env, vols, labels, queues, cgroup=None):
         """
         Start a docker container for the main job or subjobs
@@ -177,10 +431,16 @@ class DockerRunner:
         :return: Container ID
         """
         logging.info(f"About to run {job_id} {image}")
+        if self.events is not None:
+            self.events.start()
+        c = None
+        if self.pool is not None and labels.get("subjob") == "True":
+            c = self._run_pooled(job_id, image, env, vols, labels, cgroup=cgroup)
         try:
-            c = self._pull_and_run(
-                image=image, env=env, labels=labels, vols=vols, cgroup_parent=cgroup
-            )
+            if c is None:
+                c = self._pull_and_run(
+                    image=image, env=env, labels=labels, vols=vols, cgroup_parent=cgroup
+                )
         except ImageNotFound:
             _sleep(5)
             c = self._pull_and_run(
@@ -192,12 +452,62 @@ class DockerRunner:
             raise
 
         self.containers.append(c)
-        # Start a thread to monitor output and handle finished containers
-        t = Thread(target=self._shepherd, args=[c, job_id, queues])
-        self.threads.append(t)
-        t.start()
+        self.stats.record_start()
+        state = self.events.register(c.id) if self.events is not None else None
+        if self.follow_logs:
+            # A follow stream blocks, so it needs its own thread
+            self.threads = [t for t in self.threads if t.is_alive()]
+            t = Thread(target=self._shepherd, args=[c, job_id, queues, state])
+            self.threads.append(t)
+            t.start()
+        else:
+            self._supervise(c, job_id, queues, state=state)
         return c
 
+    def run_server(self, name, image, env, vols, labels, port, cgroup=None):
+        """
+        Start a long running container with the image's default command, serving on a port.
+        The port is published on the loopback interface, unless the job runner is itself
+        running in a container (IN_CONTAINER is set). The host's loopback interface isn't
+        reachable from there, so the server is reached at its address on the container
+        network instead. Its output is shipped to the job log as coming from name.
+        :param name: The name to log the container's output under.
+        :param image: The docker image name
+        :param env: Environment for the docker container
+        :param vols: Volumes for the docker container
+        :param labels: Labels for the docker container
+        :param port: The container port to serve on
+        :param cgroup: The optional cgroup to use as a cgroup parent
+        :return: The container and the URL of the server.
+        """
+        logging.info(f"About to run server {name} {image}")
+        in_container = bool(os.environ.get("IN_CONTAINER"))
+        if self.events is not None:
+            self.events.start()
+        c = self._pull_and_run(
+            image=image,
+            env=env,
+            labels=labels,
+            vols=vols,
+            cgroup_parent=cgroup,
+            command=None,
+            ports=None if in_container else {f"{port}/tcp": ("127.0.0.1", None)},
+        )
+        self.containers.append(c)
+        state = self.events.register(c.id) if self.events is not None else None
+        self._supervise(c, name, [], state=state)
+        c.reload()
+        if in_container:
+            networks = c.attrs.get("NetworkSettings", {}).get("Networks") or {}
+            ips = [n["IPAddress"] for n in networks.values() if n.get("IPAddress")]
+            if not ips:
+                self.remove(c)
+                raise Exception(
+                    f"Module server container {c.id} has no address on a container network")
+            return c, f"http://{ips[0]}:{port}"
+        host_port = c.ports[f"{port}/tcp"][0]["HostPort"]
+        return c, f"http://127.0.0.1:{host_port}"
+
     @staticmethod
     def remove(c):
         """
@@ -0,0 +1,99 @@
+from concurrent.futures import Future
+from threading import Lock
+from time import time as _time
+from typing import Dict
+
+from docker.errors import ImageNotFound
+
+
+class ImagePuller(object):
+    """
+    Resolves docker images to image IDs, pulling them if they aren't available locally.
+
+    Pulls are single flight: concurrent requests for the same image share one in-flight pull,
+    while different images are pulled in parallel by their callers' threads. Resolved images
+    are cached by name and by repo digest.
+    """
+
+    def __init__(self, client, logger=None, stats=None):
+        """
+        client - the docker client.
+        logger - an optional job logger to report pulls to.
+        stats - an optional ContainerStats to record pull durations in.
+        """
+        self.client = client
+        self.logger = logger
+        self.stats = stats
+        self._cache = dict()  # type: Dict[str, str]
+        self._inflight = dict()  # type: Dict[str, Future]
+        self._lock = Lock()
+
+    def cached(self, image: str) -> str:
+        """
+        Get the ID of an image that has already been resolved, or None.
+        """
+        with self._lock:
+            return self._cache.get(image)
+
+    def get(self, image: str) -> str:
+        """
+        Resolve an image to its ID, pulling it if needed. If another thread is already
+        resolving the image, wait for its result instead.
+        :param image: The image name.
+        :return: The image ID, or None if the image couldn't be found.
+        """
+        with self._lock:
+            if image in self._cache:
+                return self._cache[image]
+            future = self._inflight.get(image)
+            owner = future is None
+            if owner:
+                future = self._inflight[image] = Future()
+        if not owner:
+            return future.result()
+        try:
+            image_id = self._resolve(image)
+            future.set_result(image_id)
+            return image_id
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[image]
+
+    def _resolve(self, image: str) -> str:
+        try:
+            # See if the image exists
+            return self._cache_image(image, self.client.images.get(name=image))
+        except ImageNotFound as e:
+            self._log(f"Image not found locally, will attempt to pull. Error was:\n{e}")
+
+        start = _time()
+        try:
+            img = self.client.images.pull(image)
+        except ImageNotFound as e:
+            self._error(f"{e}")
+            return None
+        seconds = _time() - start
+        if self.stats is not None:
+            self.stats.record_pull(seconds)
+        size = img.attrs.get("Size", 0) if isinstance(img.attrs, dict) else 0
+        self._log(f"Pulled image {image} ({img.id}) in {seconds:.2f}s, {size} bytes")
+        return self._cache_image(image, img)
+
+    def _cache_image(self, image: str, img) -> str:
+        digests = img.attrs.get("RepoDigests") if isinstance(img.attrs, dict) else None
+        with self._lock:
+            self._cache[image] = img.id
+            for digest in digests or []:
+                self._cache[digest] = img.id
+        return img.id
+
+    def _log(self, line: str):
+        if self.logger is not None:
+            self.logger.log(line)
+
+    def _error(self, line: str):
+        if self.logger is not None:
+            self.logger.error(line)
@@ -10,16 +10,19 @@ from time import sleep as _sleep, time as _time
 import traceback
 
 from clients.authclient import KBaseAuth
+from clients.baseclient import RawJSON
 from clients.CatalogClient import Catalog
 from clients.execution_engine2Client import execution_engine2 as EE2
 
 from .CatalogCache import CatalogCache
+from .JobStore import SpilledOutput
 from .MethodRunner import MethodRunner
 from .SpecialRunner import SpecialRunner
 from .config import Config
-from .callback_server import start_callback_server
+from .callback_server import start_callback_server, start_callback_server_thread
 from .exceptions import CantRestartJob
 from .logger import Logger
+from .prefetch import SubjobHistory
 from .provenance import Provenance
 
 logging.basicConfig(format="%(created)s %(levelname)s: %(message)s",
@@ -52,7 +55,22 @@ class JobRunner(object):
         self.ee2 = None
         if config.ee2_url:
             self.ee2 = EE2(url=config.ee2_url, timeout=60)
-        self.logger = Logger(config.job_id, ee2=self.ee2)
+        self.logger = Logger(
+            config.job_id,
+            ee2=self.ee2,
+            buffered=config.log_buffered,
+            batch_lines=config.log_batch_lines,
+            batch_bytes=config.log_batch_bytes,
+            flush_interval=config.log_flush_interval,
+            spill_dir=config.workdir if config.log_spill else None,
+            spill_drain_timeout=config.log_spill_drain_timeout,
+            compact=config.log_compact,
+            max_bytes=config.log_max_bytes,
+            max_lines_per_sec=config.log_max_lines_per_sec,
+            container_max_bytes=config.log_container_max_bytes,
+            container_max_lines_per_sec=config.log_container_max_lines_per_sec,
+            max_line_bytes=config.log_max_line_bytes,
+        )
         self.token = config.token
         self.client_group = os.environ.get("CLIENTGROUP", "None")
         self.bypass_token = os.environ.get("BYPASS_TOKEN", True)
@@ -74,6 +92,11 @@ class JobRunner(object):
         self.sr = SpecialRunner(self.config, self.job_id, logger=self.logger)
         catalog = Catalog(config.catalog_url, token=self.admin_token)
         self.cc = CatalogCache(catalog, self.admin_token)
+        self.subjob_history = None
+        if config.prefetch_history:
+            self.subjob_history = SubjobHistory(
+                config.prefetch_history, max_modules=config.prefetch_max_modules)
+        self._subjob_modules = []
         self._shutdown_event = Event()
         self._stop = False
         self.cbs = None
@@ -141,11 +164,46 @@ class JobRunner(object):
             fin_q=[self.jr_queue],
         )
 
-    def _submit(self, config: dict, job_id: str, job_params: dict, subjob=True):
-        (module, method) = job_params["method"].split(".")
+    @staticmethod
+    def _get_service_ver(job_params: dict) -> str:
         service_ver = job_params.get("service_ver")
         if service_ver is None:
             service_ver = job_params.get("context", {"service_ver": "release"}).get("service_ver")
+        return service_ver
+
+    @staticmethod
+    def _get_app_id(job_params: dict) -> str:
+        return job_params.get("app_id") or job_params["method"]
+
+    def _prefetch_image(self, module: str, service_ver: str):
+        try:
+            image = self.cc.get_image_name(module, service_ver)
+            self.mr.prefetch_image(image)
+        except Exception as e:
+            logging.warning(f"Failed to prefetch the image for {module} {service_ver}: {e}")
+
+    def _prefetch_images(self, job_params: dict):
+        """
+        Start pulling the images the job is likely to need in the background: the main
+        module's image and the images of the modules the app recently ran as subjobs.
+        """
+        module = job_params["method"].split(".")[0]
+        modules = [(module, self._get_service_ver(job_params))]
+        if self.subjob_history is not None:
+            modules += self.subjob_history.get(self._get_app_id(job_params))
+        for module, service_ver in dict.fromkeys(modules):
+            if module == "special":
+                continue
+            logging.info(f"Prefetching the image for {module} {service_ver}")
+            threading.Thread(
+                target=self._prefetch_image, args=[module, service_ver], daemon=True
+            ).start()
+
+    def _submit(self, config: dict, job_id: str, job_params: dict, subjob=True):
+        (module, method) = job_params["method"].split(".")
+        service_ver = self._get_service_ver(job_params)
+        if subjob:
+            self._subjob_modules.append((module, service_ver))
 
         # TODO Fail gracefully if this step fails. For example, setting service_ver='fake'
         module_info = self.cc.get_module_info(module, service_ver)
@@ -191,7 +249,17 @@ class JobRunner(object):
         # hangs forever. Needs to be reworked so that doesn't happen, which seems like a big lift
         ct = 1
         exp_time = self._get_token_lifetime() - 600
+        stats_interval = self.config.log_stats_interval
+        next_stats = _time() + stats_interval
+        metrics_interval = self.config.metrics_interval
+        next_metrics = _time()
         while not self._stop:
+            if stats_interval and _time() > next_stats:
+                self._log_stats()
+                next_stats = _time() + stats_interval
+            if metrics_interval and _time() > next_metrics:
+                self._send_metrics()
+                next_metrics = _time() + metrics_interval
             try:
                 req = self.jr_queue.get(timeout=1)
                 if _time() > exp_time:
@@ -234,6 +302,7 @@ class JobRunner(object):
                     self.callback_queue.put(["prov", None, self.prov.get_prov()])
                 elif req[0] == "finished_special":
                     job_id = req[1]
+                    self.logger.end_source(job_id)
                     self.callback_queue.put(["output", job_id, req[2]])
                     ct -= 1
                 elif req[0] == "finished":
@@ -241,8 +310,12 @@ class JobRunner(object):
                     job_id = req[1]
                     if job_id == self.job_id:
                         subjob = False
-                    output = self.mr.get_output(job_id, subjob=subjob)
-                    self.callback_queue.put(["output", job_id, output])
+                    self.logger.end_source(job_id)
+                    # Large outputs are passed on by reference. The size saves the callback
+                    # server encoding the output to measure it
+                    output, size = self.mr.read_output(
+                        job_id, subjob=subjob, spill_size=self.config.output_spill_bytes)
+                    self.callback_queue.put(["output", job_id, output, size])
                     ct -= 1
                     if not subjob:
                         if ct > 0:
@@ -291,6 +364,25 @@ class JobRunner(object):
         self.prov.add_subaction(action)
         self.callback_queue.put(["prov", None, self.prov.get_prov()])
 
+    def _log_stats(self):
+        """
+        Write the log pipeline counters to the runner's own log.
+        """
+        for line in self.logger.stats.summary():
+            logging.info(line)
+
+    def _send_metrics(self):
+        """
+        Send the container and log pipeline counters to the callback server for its metrics.
+        """
+        log = self.logger.stats.snapshot()
+        metrics = {"log": {k: log[k] for k in ["lines", "shipped_lines", "spilled_lines"]}}
+        # Only the docker runner keeps container counters
+        stats = getattr(self.mr.runner, "stats", None)
+        if stats is not None:
+            metrics["containers"] = stats.snapshot()
+        self.callback_queue.put(["metrics", None, metrics])
+
     def _validate_token(self):
         # Validate token and get user name
         try:
@@ -337,6 +429,15 @@ class JobRunner(object):
         will not return until the job finishes or encounters and error.
         This method also handles starting up the callback server.
         """
+        try:
+            return self._run()
+        except Exception:
+            # Ship the lines logged so far, including the error, before the caller terminates
+            # the job and exits. Lines logged after this are shipped synchronously.
+            self.logger.close(timeout=self.config.log_close_timeout)
+            raise
+
+    def _run(self):
         running_msg = f"Running job {self.job_id} ({os.environ.get('CONDOR_ID')}) on {self.hostname} ({self.ip}) in {self.workdir}"
 
         self.logger.log(running_msg)
@@ -367,6 +468,9 @@ class JobRunner(object):
             self.logger.error("Failed to get job parameters. Exiting.")
             raise e
 
+        if self.config.prefetch_images:
+            self._prefetch_images(job_params)
+
         try:
             ee2_config = self.ee2.list_config()
         except Exception as e:
@@ -413,20 +517,7 @@ class JobRunner(object):
             self.bypass_token,
             self.cc,
         ]
-        self.cbs = Process(target=start_callback_server, args=cb_args)
-        self.cbs.start()
-        
-        # Check that the CBS at least started
-        # TODO CALLBACK improve this later - have the callback server send an event when it's up
-        # or something, or better yet refactor this whole thing to get rid of events
-        # give it a moment to crash if it's going to
-        _sleep(0.2)
-        if self.cbs.exitcode is not None and self.cbs.exitcode != 0:
-            # No good way to test this without a lot of hacks
-            # tested manually by removing an argument from the arg list
-            raise RuntimeError(
-                f"Callback server exited immediately with code {self.cbs.exitcode}"
-            )
+        self._start_callback_server(cb_args, self._callback_server_kwargs())
 
         # Submit the main job
         self.logger.log(f"Job is about to run {job_params.get('app_id')}")
@@ -437,20 +528,33 @@ class JobRunner(object):
             config=ee2_config, job_id=self.job_id, job_params=job_params, subjob=False
         )
         output = self._watch(ee2_config)
-        self.cbs.terminate()
+        self._stop_callback_server()
         self.logger.log("Job is done")
 
-        error = output.get("error")
+        if isinstance(output, SpilledOutput):
+            error = output.error
+        else:
+            error = output.get("error")
         if error:
             error_message = "Job output contains an error"
             self.logger.error(f"{error_message} {error}")
+        # Make sure all the job's log lines are in ee2 before the job is marked finished
+        self.logger.close()
+        self._log_stats()
+        if self.subjob_history is not None:
+            self.subjob_history.record(self._get_app_id(job_params), self._subjob_modules)
+        if error:
             self._retry_finish(
                 {"job_id": self.job_id, "error_message": error_message, "error": error},
                 success=False,
             )
         else:
+            job_output = output
+            if isinstance(output, SpilledOutput):
+                # Sent as is, without parsing it
+                job_output = RawJSON(output.read())
             self._retry_finish(
-                {"job_id": self.job_id, "job_output": output}, success=True
+                {"job_id": self.job_id, "job_output": job_output}, success=True
             )
 
         # TODO: Attempt to clean up any running docker containers
@@ -512,14 +616,66 @@ class JobRunner(object):
             self.bypass_token,
             self.cc,
         ]
-        kwargs = {"shutdown_event": self._shutdown_event, "max_tasks": self.config.max_tasks}
+        kwargs = self._callback_server_kwargs()
+        kwargs.update({
+            "shutdown_event": self._shutdown_event,
+            "max_tasks": self.config.max_tasks,
+        })
         if app_name:
             kwargs["app_name"] = app_name  # don't add if None
-        self.cbs = Process(target=start_callback_server, args=cb_args, kwargs=kwargs)
-        self.cbs.start()
+        self._start_callback_server(cb_args, kwargs)
         self._watch_thread = threading.Thread(target=self._watch, args=[config])
         self._watch_thread.start()
 
+    def _callback_server_kwargs(self):
+        return {
+            "workers": self.config.callback_workers,
+            "output_retention": self.config.output_retention or None,
+            "max_queued": self.config.callback_max_queued,
+        }
+
+    def _start_callback_server(self, cb_args, kwargs):
+        """
+        Start the callback server and wait until it's accepting connections.
+        """
+        if self.config.callback_in_process and kwargs.get("workers", 1) == 1:
+            kwargs = dict(kwargs)
+            kwargs.pop("workers", None)
+            kwargs["shutdown_event"] = self._shutdown_event
+            # The server gets a catalog cache of its own, as it does in its own process, so
+            # that its module lookups don't mark modules as used for _submit, and the caches
+            # aren't shared between threads
+            cb_args = [
+                CatalogCache(self.cc.catalog, self.admin_token) if a is self.cc else a
+                for a in cb_args
+            ]
+            self.cbs = start_callback_server_thread(*cb_args, **kwargs)
+            return
+        ready = Event()
+        kwargs = dict(kwargs, ready_event=ready)
+        self.cbs = Process(target=start_callback_server, args=cb_args, kwargs=kwargs)
+        self.cbs.start()
+        deadline = _time() + self.config.callback_start_timeout
+        while not ready.wait(0.05):
+            if self.cbs.exitcode is not None:
+                # No good way to test this without a lot of hacks
+                # tested manually by removing an argument from the arg list
+                raise RuntimeError(
+                    f"Callback server exited immediately with code {self.cbs.exitcode}"
+                )
+            if _time() > deadline:
+                self.cbs.terminate()
+                raise RuntimeError("Callback server didn't start in time")
+
+    def _stop_callback_server(self):
+        if self.cbs is None:
+            return
+        if isinstance(self.cbs, Process):
+            self.cbs.terminate()
+        else:
+            self._shutdown_event.set()
+            self.cbs.join()
+
     def stop(self):
         """
         Stop any running callback server and stop the job runner event loop.
@@ -529,6 +685,7 @@ class JobRunner(object):
         self._shutdown_event.set()
         self._stop = True
         self.wait_for_stop()
+        self.logger.close()
 
     def wait_for_stop(self):
         if self._watch_thread:
@@ -0,0 +1,348 @@
+import json
+from collections import Counter, OrderedDict
+from multiprocessing.managers import BaseManager
+from threading import Lock
+from time import time as _time
+from typing import Dict, Iterable, List, Tuple
+
+from .metrics import RPCStats
+
+# The results of JobStore.submit
+RUNNING = "running"
+QUEUED = "queued"
+
+
+class SpilledOutput(object):
+    """
+    A reference to a job's output that is left on disk, in place of the output itself, so that
+    large outputs aren't held in memory, pickled between processes or parsed.
+    """
+
+    def __init__(self, path: str, size: int, error=None):
+        """
+        path - the path to the output JSON file, which must hold a JSON object.
+        size - the size of the file in bytes.
+        error - the output's error, if it has one.
+        """
+        self.path = path
+        self.size = size
+        self.error = error
+
+    def read(self) -> bytes:
+        """
+        Read the output's JSON.
+        """
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def state_bytes(self) -> bytes:
+        """
+        Get the output's JSON as a finished job state, i.e. with "finished" set to 1, without
+        parsing it.
+        """
+        try:
+            body = self.read().rstrip()
+        except OSError as e:
+            return json.dumps({
+                "error": {
+                    "code": -32601,
+                    "name": "Output not found",
+                    "message": f"Couldn't read the job output: {e}",
+                },
+                "finished": 1,
+            }).encode()
+        # Replace the closing brace. A later duplicate key wins, as when the output is parsed
+        body = body[:-1].rstrip()
+        sep = b"" if body.endswith(b"{") else b", "
+        return body + sep + b'"finished": 1}'
+
+
+class _Queued(object):
+    def __init__(self, data: dict, share, priority: float):
+        self.data = data
+        self.share = share
+        self.priority = priority
+
+
+class JobStore(object):
+    """
+    The callback server's job state: the output of each submitted job, which jobs are still
+    running, which are queued waiting to run and the latest provenance.
+
+    Queued jobs are started fairly between shares, usually the jobs that submitted them: the
+    next job comes from the share with the fewest running jobs, then the highest priority,
+    then the earliest submitted.
+
+    Outputs may be SpilledOutputs, which callers load when they need the output. Once a finished
+    job's state has been returned, its output is kept for retention seconds and then discarded.
+
+    Every method is atomic, so a store can be shared by threads, or by the worker processes of
+    a multi-worker server through a JobStoreManager. Outputs are returned by value through a
+    manager, so callers must not rely on mutating them.
+    """
+
+    def __init__(self, retention: float = None):
+        """
+        retention - how long in seconds to keep an output after it's been returned, or None to
+            keep outputs for the life of the store.
+        """
+        self.retention = retention
+        self._lock = Lock()
+        self._outputs = dict()  # type: Dict[str, dict]
+        self._running = set()
+        # Queued job ID -> the queued job, first submitted first
+        self._queue = OrderedDict()  # type: Dict[str, _Queued]
+        # Running or queued job ID -> its share
+        self._shares = dict()
+        self._synced = set()
+        # Sync markers whose waiters gave up before the marker was seen
+        self._abandoned = set()
+        self._prov = []
+        # Job ID -> the size in bytes of its output
+        self._sizes = dict()  # type: Dict[str, int]
+        # The job runner's latest metrics
+        self._runner_metrics = dict()
+        # Job ID -> when its output was first returned, oldest first
+        self._delivered = OrderedDict()  # type: Dict[str, float]
+        # Job ID -> when its output was discarded, oldest first. Kept for another retention
+        # period so clients get a clear error, then forgotten
+        self._discarded = OrderedDict()  # type: Dict[str, float]
+
+    def submit(self, job_id: str, maxjobs: int) -> bool:
+        """
+        Record a submitted job if fewer than maxjobs jobs are running and none are queued.
+        :param job_id: The job ID.
+        :param maxjobs: The maximum number of running jobs.
+        :return: False if the job wasn't recorded because too many jobs are running.
+        """
+        return self.submit_or_queue(job_id, maxjobs) == RUNNING
+
+    def submit_or_queue(self, job_id: str, maxjobs: int, data: dict = None,
+                        maxqueued: int = 0, share=None, priority: float = 0):
+        """
+        Record a submitted job. It runs if fewer than maxjobs jobs are running and none are
+        queued, and otherwise is queued if fewer than maxqueued jobs are queued.
+        :param job_id: The job ID.
+        :param maxjobs: The maximum number of running jobs.
+        :param data: The job's parameters, returned by admit once a queued job may run.
+        :param maxqueued: The maximum number of queued jobs.
+        :param share: The fair share the job belongs to, usually the job that submitted it.
+        :param priority: The job's priority among queued jobs. Higher runs first.
+        :return: RUNNING if the job should be started now, QUEUED if it was queued, or None if
+            it wasn't recorded because too many jobs are running and queued.
+        """
+        with self._lock:
+            if len(self._running) < maxjobs and not self._queue:
+                # Don't clobber output that has already arrived for this ID
+                if job_id not in self._outputs:
+                    self._outputs[job_id] = {"finished": 0}
+                    self._running.add(job_id)
+                    self._shares[job_id] = share
+                return RUNNING
+            if len(self._queue) < maxqueued:
+                self._outputs[job_id] = {"finished": 0, "queued": 1}
+                self._queue[job_id] = _Queued(data, share, priority)
+                self._shares[job_id] = share
+                return QUEUED
+            return None
+
+    def full(self, maxjobs: int, maxqueued: int = 0) -> bool:
+        """
+        Check whether a submit would be refused because too many jobs are running and queued.
+        """
+        with self._lock:
+            return len(self._running) >= maxjobs and len(self._queue) >= maxqueued
+
+    def admit(self, maxjobs: int) -> List[Tuple[str, dict]]:
+        """
+        Move queued jobs to running, in fair share and priority order, while fewer than
+        maxjobs jobs are running.
+        :return: The job IDs and parameters of the jobs to start.
+        """
+        admitted = []
+        with self._lock:
+            running = Counter(self._shares.get(j) for j in self._running)
+            while self._queue and len(self._running) < maxjobs:
+                job_id = self._next_queued(running)
+                queued = self._queue.pop(job_id)
+                self._outputs[job_id] = {"finished": 0}
+                self._running.add(job_id)
+                running[queued.share] += 1
+                admitted.append((job_id, queued.data))
+        return admitted
+
+    def _next_queued(self, running: Counter) -> str:
+        # Must be called with the lock held. The queue is in submission order, and min returns
+        # the first of equal keys.
+        return min(
+            self._queue,
+            key=lambda j: (running[self._queue[j].share], -self._queue[j].priority),
+        )
+
+    def deliver(self, mtype: str, job_id: str, output, size: int = None):
+        """
+        Apply a message from the job runner.
+        :param mtype: "output" for a job's output, "prov" for the provenance, "metrics" for the
+            job runner's metrics or "sync" for a sync marker, which is only recorded as seen.
+        :param job_id: The job ID, or the sync ID for a sync marker.
+        :param output: The output, provenance or metrics.
+        :param size: The size in bytes of an output's JSON, if known, for metrics. The output
+            isn't encoded to find it. A SpilledOutput's own size is used.
+        """
+        if isinstance(output, SpilledOutput):
+            size = output.size
+        with self._lock:
+            self._discard_expired()
+            if mtype == "output":
+                self._running.discard(job_id)
+                self._queue.pop(job_id, None)
+                self._shares.pop(job_id, None)
+                self._outputs[job_id] = output
+                if size is None:
+                    self._sizes.pop(job_id, None)
+                else:
+                    self._sizes[job_id] = size
+                self._discarded.pop(job_id, None)
+            elif mtype == "prov":
+                self._prov = output
+            elif mtype == "metrics":
+                self._runner_metrics = output
+            elif mtype == "sync":
+                if job_id in self._abandoned:
+                    self._abandoned.discard(job_id)
+                else:
+                    self._synced.add(job_id)
+
+    def jobcount(self) -> int:
+        """
+        Get the number of running jobs.
+        """
+        with self._lock:
+            return len(self._running)
+
+    def queuedcount(self) -> int:
+        """
+        Get the number of queued jobs.
+        """
+        with self._lock:
+            return len(self._queue)
+
+    def has_job(self, job_id: str) -> bool:
+        with self._lock:
+            return job_id in self._outputs or job_id in self._discarded
+
+    def unknown(self, job_ids: Iterable[str]) -> List[str]:
+        """
+        Get the job IDs that aren't in the store.
+        """
+        with self._lock:
+            return [j for j in job_ids if j not in self._outputs and j not in self._discarded]
+
+    def job_state(self, job_id: str):
+        """
+        Get a job's state, which is its output with "finished" set to 1 once it has finished,
+        a SpilledOutput, or None if there's no such job. The state of a queued job has
+        "queued" set to 1.
+        """
+        with self._lock:
+            self._discard_expired()
+            if job_id in self._discarded:
+                return {
+                    "finished": 1,
+                    "error": {
+                        "code": -32000,
+                        "name": "CallbackServerError",
+                        "message": f"The output of job {job_id} was already returned and has "
+                                   + "been discarded",
+                    },
+                }
+            resp = self._outputs.get(job_id)
+            if resp is None or job_id in self._running or job_id in self._queue:
+                return resp
+            if not isinstance(resp, SpilledOutput):
+                resp["finished"] = 1
+            self._delivered.setdefault(job_id, _time())
+            return resp
+
+    def job_states(self, job_ids: Iterable[str]) -> Dict[str, dict]:
+        """
+        Get the states of several jobs at once, as job_state would.
+        """
+        return {job_id: self.job_state(job_id) for job_id in job_ids}
+
+    def _discard_expired(self):
+        # Must be called with the lock held
+        if self.retention is None:
+            return
+        now = _time()
+        cutoff = now - self.retention
+        while self._discarded:
+            job_id, discarded = next(iter(self._discarded.items()))
+            if discarded > cutoff:
+                break
+            del self._discarded[job_id]
+        while self._delivered:
+            job_id, delivered = next(iter(self._delivered.items()))
+            if delivered > cutoff:
+                return
+            del self._delivered[job_id]
+            self._outputs.pop(job_id, None)
+            self._sizes.pop(job_id, None)
+            self._discarded[job_id] = now
+
+    def stats(self) -> dict:
+        """
+        Get the store's counts for metrics: running and queued jobs, the bytes of outputs of
+        known size held in memory and on disk, and the job runner's latest metrics.
+        """
+        with self._lock:
+            self._discard_expired()
+            spilled = sum(
+                self._sizes.get(j, 0) for j, o in self._outputs.items()
+                if isinstance(o, SpilledOutput)
+            )
+            return {
+                "running": len(self._running),
+                "queued": len(self._queue),
+                "output_bytes": sum(self._sizes.values()) - spilled,
+                "spilled_output_bytes": spilled,
+                "runner": self._runner_metrics,
+            }
+
+    def get_prov(self):
+        with self._lock:
+            return self._prov
+
+    def done(self, job_ids: Iterable[str], sync_ids: Iterable[str]) -> List[str]:
+        """
+        Find which of a set of jobs have finished and which sync markers have been seen. Seen
+        sync markers are forgotten.
+        :return: The IDs of the finished jobs and seen sync markers.
+        """
+        with self._lock:
+            done = [j for j in job_ids if j not in self._running and j not in self._queue]
+            for sync_id in sync_ids:
+                if sync_id in self._synced:
+                    self._synced.discard(sync_id)
+                    done.append(sync_id)
+            return done
+
+    def abandon_sync(self, sync_id: str):
+        """
+        Forget a sync marker whose waiter gave up, whether or not it has been seen yet.
+        """
+        with self._lock:
+            if sync_id in self._synced:
+                self._synced.discard(sync_id)
+            else:
+                self._abandoned.add(sync_id)
+
+
+class JobStoreManager(BaseManager):
+    """
+    Serves a JobStore from a separate process, so that server worker processes can share it.
+    """
+
+
+JobStoreManager.register("JobStore", JobStore)
+JobStoreManager.register("RPCStats", RPCStats)
@@ -5,6 +5,9 @@ from configparser import ConfigParser
 from datetime import datetime, timezone
 
 from .DockerRunner import DockerRunner
+from .JobStore import SpilledOutput
+from .jsonscan import scan_object_file
+from .ModuleServers import ModuleServers
 from .ShifterRunner import ShifterRunner
 
 logging.basicConfig(level=logging.INFO)
@@ -44,9 +47,29 @@ class MethodRunner:
         if runtime == "shifter":
             self.runner = ShifterRunner(logger=logger)
         elif runtime == "docker":
-            self.runner = DockerRunner(logger=logger, debug=self.debug)
+            self.runner = DockerRunner(
+                logger=logger,
+                debug=self.debug,
+                follow_logs=config.docker_follow_logs,
+                use_events=config.docker_events,
+                warm_pool_dir=(
+                    os.path.join(self.workdir, "warm_pool") if config.warm_pool else None),
+                warm_pool_size=config.warm_pool_size,
+                warm_pool_max=config.warm_pool_max,
+                warm_pool_idle=config.warm_pool_idle,
+            )
         else:
             raise OSError("Unknown runtime")
+        self.module_servers = None
+        if config.module_servers and runtime == "docker":
+            self.module_servers = ModuleServers(
+                self.runner,
+                self.token,
+                logger=logger,
+                max_workers=config.max_tasks,
+                start_timeout=config.module_server_start_timeout,
+                call_timeout=config.module_server_call_timeout,
+            )
 
     def _init_workdir(self, config, job_dir, params):
         # Create all the directories
@@ -60,26 +83,7 @@ class MethodRunner:
         self.subjobdir = os.path.join(self.workdir, "subjobs")
         if not os.path.exists(self.subjobdir):
             os.mkdir(self.subjobdir)
-        # Create config.properties and inputs
-        conf_prop = ConfigParser()
-
-        conf_prop["global"] = {
-            "kbase_endpoint": config["kbase-endpoint"],
-            "workspace_url": config["workspace-url"],
-            "external_url": config["external-url"],
-            "shock_url": config["shock-url"],
-            "handle_url": config["handle-url"],
-            "srv_wiz_url": config["srv-wiz-url"],
-            "auth_service_url": config["auth-service-url"],
-            "auth_service_url-v2": config["auth-service-url-v2"],
-            "auth_service_url_allow_insecure": config[
-                "auth-service-url-allow-insecure"
-            ],
-            "scratch": config["scratch"],
-        }
-
-        with open(job_dir + "/config.properties", "w") as configfile:
-            conf_prop.write(configfile)
+        self._write_config(config, job_dir)
 
         # Create input.json
         nowutc = datetime.utcnow().replace(tzinfo=timezone.utc)
@@ -108,6 +112,31 @@ class MethodRunner:
         with open(ijson, "w") as f:
             f.write(json.dumps(job_input_json))
 
+    def _write_config(self, config, job_dir):
+        """
+        Write the files a module needs in its work directory regardless of the call:
+        config.properties, the token and the tmp directory.
+        """
+        conf_prop = ConfigParser()
+
+        conf_prop["global"] = {
+            "kbase_endpoint": config["kbase-endpoint"],
+            "workspace_url": config["workspace-url"],
+            "external_url": config["external-url"],
+            "shock_url": config["shock-url"],
+            "handle_url": config["handle-url"],
+            "srv_wiz_url": config["srv-wiz-url"],
+            "auth_service_url": config["auth-service-url"],
+            "auth_service_url-v2": config["auth-service-url-v2"],
+            "auth_service_url_allow_insecure": config[
+                "auth-service-url-allow-insecure"
+            ],
+            "scratch": config["scratch"],
+        }
+
+        with open(job_dir + "/config.properties", "w") as configfile:
+            conf_prop.write(configfile)
+
         # Create token file
         with open(job_dir + "/token", "w") as f:
             f.write(self.token)
@@ -221,6 +250,10 @@ class MethodRunner:
             "code_url": module_info["git_url"],
             "commit": module_info["git_commit_hash"],
         }
+        if self.module_servers is not None and subjob:
+            self._run_on_module_server(
+                config, module, module_info, params, job_id, env, vols, labels, fin_q)
+            return action
         # Do we need to do more for error handling?
         c = self.runner.run(job_id, image, env, vols, labels, [fin_q], cgroup=cgroup)
         if self.runtime == "docker":
@@ -229,9 +262,60 @@ class MethodRunner:
         self.containers.append(c)
         return action
 
-    def get_output(self, job_id, subjob=True, max_size=1024 * 1024 * 1024):
+    def _run_on_module_server(
+            self, config, module, module_info, params, job_id, env, vols, labels, fin_q):
+        """
+        Send a subjob to the module version's long running server rather than starting a
+        container for it.
+        """
+        commit = module_info["git_commit_hash"]
+        name = f"{module}-{commit[:7]}"
+        job_dir = self._get_job_dir(job_id, subjob=True)
+        # The server gets a work directory of its own without any call's input. Each call's
+        # input.json is read from, and its output.json written to, the call's own job_dir.
+        server_dir = os.path.join(self.workdir, "module_servers", name)
+        if not os.path.exists(server_dir):
+            os.makedirs(server_dir)
+            self._write_config(config, server_dir)
+        server_vols = {
+            (server_dir if k == job_dir else k): v for k, v in vols.items()
+        }
+        server_labels = dict(
+            labels, module_server="true", runner_job_id=name, job_dir=server_dir)
+        self.logger.log(f"Running subjob {job_id} on module server {name}")
+        self.module_servers.call(
+            f"{module}:{commit}",
+            name,
+            module_info["docker_img_name"],
+            env,
+            server_vols,
+            server_labels,
+            job_dir,
+            job_id,
+            fin_q,
+            cgroup=self.config.cgroup,
+        )
+
+    def prefetch_image(self, image):
+        """
+        Make sure an image is available locally, pulling it if needed. This is a blocking call.
+        Only docker images are prefetched.
+        """
+        if self.runtime == "docker":
+            self.runner.images.get(image)
+
+    def get_output(self, job_id, subjob=True, max_size=1024 * 1024 * 1024, spill_size=None):
+        return self.read_output(job_id, subjob, max_size, spill_size)[0]
+
+    def read_output(self, job_id, subjob=True, max_size=1024 * 1024 * 1024, spill_size=None):
+        """
+        Read a job's output file, along with its size.
+        :return: The output and the size in bytes of its JSON, or None if the output is an
+            error made up because the output file is missing or too large.
+        """
         # Attempt to read output file and see if it is well formed
         # Throw errors if not
+        # Outputs larger than spill_size are left on disk and returned as a SpilledOutput
         of = os.path.join(self._get_job_dir(job_id, subjob=subjob), "output.json")
         if os.path.exists(of):
             size = os.stat(of).st_size
@@ -242,7 +326,9 @@ class MethodRunner:
                     "message": "Method returned too much output "
                     + "({} > {})".format(size, max_size),
                 }
-                return {"error": e}
+                return {"error": e}, None
+            if spill_size and size > spill_size:
+                return self._spill_output(job_id, of, size), size
 
             with open(of) as json_file:
                 output = json.load(json_file)
@@ -256,22 +342,47 @@ class MethodRunner:
                 "message": "No output generated. Check logs for more details",
                 "error": "No output generated",
             }
-            return {"error": error, "result": error}
+            return {"error": error, "result": error}, None
 
         if "error" in output:
-            error = output.get("error")
-            error_msg = error.get("message")
-            error_code = error.get("code")
-            error_name = error.get("name")
-            error_error = error.get("error")
-            self.logger.error(
-                f"Job {job_id} ran, but {of} contained an error. Error in output job msg:{error_msg} code:{error_code} name:{error_name} error:{error_error}"
-            )
+            self._log_output_error(job_id, of, output.get("error"))
 
-        return output
+        return output, size
 
-    def cleanup_all(self, debug=False):
+    def _spill_output(self, job_id, of, size):
+        # Check the structure and find any error without parsing the result, which stays on
+        # disk and is passed on as is
+        try:
+            scan = scan_object_file(of, parse_keys=["error"])
+        except ValueError as e:
+            error = {
+                "code": -32601,
+                "name": "Invalid output",
+                "message": f"Method output is not a JSON object: {e}",
+            }
+            self.logger.error(f"Job {job_id} ran, but {of} is invalid: {e}")
+            return {"error": error, "result": error}
+        error = scan.values.get("error")
+        if "error" in scan and "error" not in scan.values:
+            error = {
+                "code": -32601,
+                "name": "Method error",
+                "message": "Method returned an error too large to read",
+            }
+        if error is not None:
+            self._log_output_error(job_id, of, error)
+        return SpilledOutput(of, size, error=error)
+
+    def _log_output_error(self, job_id, of, error):
+        error_msg = error.get("message")
+        error_code = error.get("code")
+        error_name = error.get("name")
+        error_error = error.get("error")
+        self.logger.error(
+            f"Job {job_id} ran, but {of} contained an error. Error in output job msg:{error_msg} code:{error_code} name:{error_name} error:{error_error}"
+        )
 
+    def cleanup_all(self, debug=False):
         if debug is True:
             message = "Debug mode is on, will not delete containers"
             for c in self.containers:
@@ -284,4 +395,6 @@ class MethodRunner:
                 self.runner.remove(c)
             except OSError:
                 continue
+        if self.module_servers is not None:
+            self.module_servers.close()
         return True
@@ -0,0 +1,165 @@
+import json
+import logging
+import os
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock, Thread
+from time import sleep as _sleep
+from time import time as _time
+from typing import Dict
+
+import requests
+
+# The port SDK module servers listen on
+SERVER_PORT = 5000
+# How long in seconds to wait to connect to a module server for a call
+CONNECT_TIMEOUT = 30
+
+
+class ModuleServers(object):
+    """
+    Runs SDK module containers as long lived JSON-RPC servers, in the style of SDK dynamic
+    services, and dispatches subjob calls to them over HTTP.
+
+    Each module version gets one server, started by the first call to it. A call reads the
+    input.json written to the subjob's work directory, posts it to the server, writes the
+    response to output.json in the same directory and then puts a finished message on the
+    job runner's queue, just as if the subjob had run in its own container. At most
+    max_workers calls are in flight at once. A server that fails a call, or doesn't respond to
+    it within call_timeout seconds, is stopped and restarted on the next call.
+    """
+
+    def __init__(self, runner, token: str, logger=None, max_workers: int = 10,
+                 start_timeout: float = 300, call_timeout: float = 86400):
+        """
+        runner - the DockerRunner to start servers with.
+        token - the token to make calls with.
+        logger - the job logger.
+        max_workers - the maximum number of calls in flight.
+        start_timeout - how long in seconds to wait for a server to start accepting calls.
+        call_timeout - how long in seconds to wait for a server to respond to a call.
+        """
+        self.runner = runner
+        self.token = token
+        self.logger = logger
+        self.start_timeout = start_timeout
+        self.call_timeout = call_timeout
+        self._servers = dict()  # type: Dict[str, Future]
+        self._lock = Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def call(self, key: str, name: str, image: str, env: dict, vols: dict, labels: dict,
+             job_dir: str, job_id: str, fin_q, cgroup: str = None):
+        """
+        Run a subjob on a module server in the background, starting the server if needed.
+        :param key: Identifies the module version, e.g. the module name and commit.
+        :param name: The name of the server, used for its log lines.
+        :param image: The module's docker image.
+        :param env: The server container's environment.
+        :param vols: The server container's volumes.
+        :param labels: The server container's labels.
+        :param job_dir: The subjob's work directory, containing input.json.
+        :param job_id: The subjob ID.
+        :param fin_q: The queue to put the finished message on.
+        :param cgroup: The optional cgroup to use as a cgroup parent.
+        """
+        with self._lock:
+            server = self._servers.get(key)
+            if server is None:
+                server = self._servers[key] = Future()
+                Thread(
+                    target=self._start,
+                    args=[server, name, image, env, vols, labels, cgroup],
+                    daemon=True,
+                ).start()
+        self._executor.submit(self._call, key, server, job_dir, job_id, fin_q)
+
+    def _start(self, server: Future, name, image, env, vols, labels, cgroup):
+        try:
+            if self.logger is not None:
+                self.logger.log(f"Starting module server {name} for image {image}")
+            c, url = self.runner.run_server(
+                name, image, env, vols, labels, SERVER_PORT, cgroup=cgroup)
+            try:
+                self._wait_until_ready(c, url)
+            except Exception:
+                self.runner.remove(c)
+                raise
+            server.set_result((c, url))
+        except Exception as e:
+            server.set_exception(e)
+
+    def _wait_until_ready(self, c, url: str):
+        deadline = _time() + self.start_timeout
+        while True:
+            try:
+                # Any response means the server is up
+                requests.get(url, timeout=5)
+                return
+            except requests.exceptions.RequestException:
+                c.reload()
+                if c.status not in ["created", "running"]:
+                    raise Exception(f"Module server container {c.id} exited during startup")
+                if _time() > deadline:
+                    raise Exception(
+                        f"Module server container {c.id} didn't accept connections within "
+                        f"{self.start_timeout} sec")
+            _sleep(0.5)
+
+    def _call(self, key: str, server: Future, job_dir: str, job_id: str, fin_q):
+        try:
+            c, url = server.result()
+            with open(os.path.join(job_dir, "input.json")) as f:
+                req = f.read()
+            try:
+                resp = requests.post(
+                    url,
+                    data=req,
+                    headers={"Authorization": self.token},
+                    timeout=(CONNECT_TIMEOUT, self.call_timeout),
+                )
+            except requests.exceptions.ConnectTimeout:
+                raise Exception(
+                    f"Couldn't connect to the module server within {CONNECT_TIMEOUT} sec")
+            except requests.exceptions.ReadTimeout:
+                raise Exception(
+                    f"The module server didn't respond within {self.call_timeout} sec")
+            try:
+                output = resp.json()
+            except ValueError:
+                resp.raise_for_status()
+                raise
+        except Exception as e:
+            logging.exception(f"Module server call for {job_id} failed")
+            output = {
+                "error": {
+                    "code": -32601,
+                    "name": "Module server error",
+                    "message": str(e),
+                    "error": traceback.format_exc(),
+                }
+            }
+            self._discard(key, server)
+        with open(os.path.join(job_dir, "output.json"), "w") as f:
+            json.dump(output, f)
+        fin_q.put(["finished", job_id, None])
+
+    def _discard(self, key: str, server: Future):
+        with self._lock:
+            if self._servers.get(key) is not server:
+                return
+            del self._servers[key]
+        if server.done() and server.exception() is None:
+            self.runner.remove(server.result()[0])
+
+    def close(self):
+        """
+        Stop all the module servers.
+        """
+        with self._lock:
+            servers = list(self._servers.values())
+            self._servers.clear()
+        for server in servers:
+            if server.done() and server.exception() is None:
+                self.runner.remove(server.result()[0])
+        self._executor.shutdown(wait=False)
@@ -1,7 +1,7 @@
 import os
-from threading import Thread
 from subprocess import Popen, PIPE
-from select import select
+
+from .supervisor import Offload, Supervisor, capture_output
 
 
 class ShifterRunner:
@@ -16,31 +16,20 @@ class ShifterRunner:
         """
         self.logger = logger
         self.containers = []
-        self.threads = []
+        self.supervisor = Supervisor(name="shifter-supervisor")
+
+    def _log_lines(self, lines, job_id):
+        try:
+            self.logger.log_lines(lines, source=job_id)
+        except Exception as e:
+            print(e)
 
     def _readio(self, p, job_id, queues):
-        cont = True
-        last = False
-        while cont:
-            rlist = [p.stdout, p.stderr]
-            x = select(rlist, [], [], 1)[0]
-            for f in x:
-                if f == p.stderr:
-                    error = 1
-                else:
-                    error = 0
-                line = f.readline().decode('utf-8')
-                if len(line) > 0:
-                    try:
-                        self.logger.log_lines([{'line': line, 'is_error': error}])
-                    except Exception as e:
-                        print(e)
-                        continue
-            if last:
-                cont = False
-            if p.poll() is not None:
-                last = True
-        p.wait()
+        # Runs under the supervisor
+        yield from capture_output(p, lambda lines: self._log_lines(lines, job_id))
+        yield Offload(p.wait)
+        if p in self.containers:
+            self.containers.remove(p)
         for q in queues:
             q.put(['finished', job_id, None])
 
@@ -74,12 +63,18 @@ class ShifterRunner:
         for e in env.keys():
             newenv[e] = env[e]
         proc = Popen(cmd, bufsize=0, stdout=PIPE, stderr=PIPE, env=newenv)
-        out = Thread(target=self._readio, args=[proc, job_id, queues])
-        self.threads.append(out)
-        out.start()
         self.containers.append(proc)
+        self.supervisor.spawn(
+            self._readio(proc, job_id, queues), on_error=self._on_error(job_id, queues))
         return proc
 
+    def _on_error(self, job_id, queues):
+        # Report the job as finished if its monitor fails, so it doesn't wait forever
+        def report(e):
+            for q in queues:
+                q.put(['finished', job_id, None])
+        return report
+
     def remove(self, c):
         # Kill process
         c.kill()
@@ -1,8 +1,9 @@
 import os
-from threading import Thread
+import traceback
 from subprocess import Popen, PIPE
-from time import sleep, time
-from select import select
+from time import time
+
+from .supervisor import Offload, Supervisor, capture_output
 
 
 class SpecialRunner:
@@ -23,7 +24,7 @@ class SpecialRunner:
         self.workdir = config.workdir
         self.shareddir = os.path.join(self.workdir, "workdir/tmp")
         self.containers = []
-        self.threads = []
+        self.supervisor = Supervisor(name="special-supervisor")
         self.allowed_types = ["slurm", "wdl"]
 
     _BATCH_POLL = 10
@@ -58,30 +59,31 @@ class SpecialRunner:
         return stdout.decode("utf-8").rstrip()
 
     def _watch_batch(self, stype, job_id, slurm_jobid, outfile, errfile, queues):
-        self.logger.log("Watching Slurm Job ID %s" % (slurm_jobid))
+        # Runs under the supervisor. The batch system and ee2 calls run on its workers.
+        yield Offload(self.logger.log, "Watching Slurm Job ID %s" % (slurm_jobid))
         check = "%s_checkjob" % (stype)
         cont = True
         retry = 0
         # Wait for job to start out output file to appear
         while cont:
-            state = self._check_batch_job(check, slurm_jobid)
+            state = yield Offload(self._check_batch_job, check, slurm_jobid)
             if state == "Running":
-                self.logger.log("Running")
+                yield Offload(self.logger.log, "Running")
             elif state == "Pending":
-                self.logger.log("Pending")
+                yield Offload(self.logger.log, "Pending")
             elif state == "Finished":
                 cont = False
-                self.logger.log("Finished")
+                yield Offload(self.logger.log, "Finished")
             else:
                 if retry > self._MAX_RETRY:
                     cont = False
                 retry += 1
-                self.logger.log("Unknown")
+                yield Offload(self.logger.log, "Unknown")
 
             if os.path.exists(outfile):
                 cont = False
 
-            sleep(self._BATCH_POLL)
+            yield self._BATCH_POLL
 
         # Tail output
         rlist = []
@@ -91,12 +93,12 @@ class SpecialRunner:
             stdout = open(outfile)
             rlist.append(stdout)
         else:
-            self.logger.error("No output file generated")
+            yield Offload(self.logger.error, "No output file generated")
         if os.path.exists(errfile):
             stderr = open(errfile)
             rlist.append(stderr)
         else:
-            self.logger.error("No error file generated")
+            yield Offload(self.logger.error, "No error file generated")
 
         cont = True
         if len(rlist) == 0:
@@ -104,28 +106,31 @@ class SpecialRunner:
         next_check = 0
         while cont:
             if time() > next_check:
-                state = self._check_batch_job(check, slurm_jobid)
+                state = yield Offload(self._check_batch_job, check, slurm_jobid)
                 next_check = time() + self._BATCH_POLL
                 if state != "Running":
                     cont = False
-            r, w, e = select(rlist, [], [], 10)
-            for f in r:
-                for line in f:
-                    if f == stdout and self.logger:
-                        self.logger.log(line)
-                    elif f == stderr and self.logger:
-                        self.logger.error(line)
-            sleep(self._FILE_POLL)
+            # Regular files are always readable
+            yield Offload(self._tail, rlist, stdout, stderr)
+            yield self._FILE_POLL
         # TODO: Extract real exit code
         resp = {"exit_status": 0, "output_file": outfile, "error_file": errfile}
         result = {"result": [resp]}
         for q in queues:
             q.put(["finished_special", job_id, result])
 
+    def _tail(self, rlist, stdout, stderr):
+        for f in rlist:
+            for line in f:
+                if f == stdout and self.logger:
+                    self.logger.log(line)
+                elif f == stderr and self.logger:
+                    self.logger.error(line)
+
     def _batch_submit(self, stype, config, data, job_id, fin_q):
         """
         This subbmits the job to the batch system and starts
-        a thread to monitor the progress.
+        monitoring the progress under the supervisor.
 
         The assumptions are there is a submit script and the
         batch system will return a job id and log output to
@@ -145,45 +150,47 @@ class SpecialRunner:
         proc = Popen(cmd, stdout=PIPE, stderr=PIPE)
         stdout, stderr = proc.communicate()
         slurm_jobid = stdout.decode("utf-8").rstrip()
-        out = Thread(
-            target=self._watch_batch,
-            args=[stype, job_id, slurm_jobid, outfile, errfile, fin_q],
-        )
-        self.threads.append(out)
-        out.start()
         self.containers.append(proc)
+        self.supervisor.spawn(
+            self._watch_batch(stype, job_id, slurm_jobid, outfile, errfile, fin_q),
+            on_error=self._on_error(job_id, fin_q),
+        )
         return proc
 
+    def _on_error(self, job_id, queues):
+        """
+        Get a function that reports a job as finished with an error if its monitor fails, so
+        that the job doesn't wait forever.
+        """
+        def report(e):
+            result = {
+                "error": {
+                    "code": -32601,
+                    "name": "Special job error",
+                    "message": f"Monitoring the job failed: {e}",
+                    "error": "".join(traceback.format_exception(type(e), e, e.__traceback__)),
+                }
+            }
+            for q in queues:
+                q.put(["finished_special", job_id, result])
+        return report
+
     def _readio(self, p, job_id, queues):
-        cont = True
-        last = False
-        while cont:
-            rlist = [p.stdout, p.stderr]
-            x = select(rlist, [], [], 1)[0]
-            for f in x:
-                if f == p.stderr:
-                    error = 1
-                else:
-                    error = 0
-                lines = []
-                for line in f.read().decode("utf-8").split("\n"):
-                    lines.append({"line": line, "is_error": error})
-                if len(lines) > 0:
-                    self.logger.log_lines(lines)
-            if last:
-                cont = False
-            if p.poll() is not None:
-                last = True
+        # Runs under the supervisor
+        yield from capture_output(
+            p, lambda lines: self.logger.log_lines(lines, source=job_id))
+        yield Offload(p.wait)
         resp = {"exit_status": p.returncode, "output_file": None, "error_file": None}
         result = {"result": [resp]}
-        p.wait()
+        if p in self.containers:
+            self.containers.remove(p)
         for q in queues:
             q.put(["finished_special", job_id, result])
 
     def _wdl_run(self, stype, config, data, job_id, queues):
         """
         This submits the job to the batch system and starts
-        a thread to monitor the progress.
+        monitoring the progress under the supervisor.
 
         """
         params = data["params"][0]
@@ -201,8 +208,7 @@ class SpecialRunner:
             raise OSError("Inputs file not found at %s" % (inputs))
         cmd = ["wdl_run", inputs, wdl]
         proc = Popen(cmd, bufsize=0, stdout=PIPE, stderr=PIPE)
-        out = Thread(target=self._readio, args=[proc, job_id, queues])
-        self.threads.append(out)
-        out.start()
         self.containers.append(proc)
+        self.supervisor.spawn(
+            self._readio(proc, job_id, queues), on_error=self._on_error(job_id, queues))
         return proc
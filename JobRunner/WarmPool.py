@@ -0,0 +1,211 @@
+import json
+import logging
+import os
+import shutil
+import uuid
+from collections import OrderedDict, deque
+from threading import Lock, Thread
+from time import sleep as _sleep
+from time import time as _time
+from typing import Deque, Dict, Tuple
+
+# The labels that identify a particular subjob, which a pooled container can't have. Docker
+# labels can't be changed after a container is created.
+_JOB_LABELS = ["runner_job_id", "job_dir", "vols"]
+
+
+def _pool_labels(labels: dict) -> dict:
+    labels = {k: v for k, v in labels.items() if k not in _JOB_LABELS}
+    labels["warm_pool"] = "true"
+    return labels
+
+
+class _Entry(object):
+    def __init__(self, container, work_dir: str):
+        self.container = container
+        self.work_dir = work_dir
+        self.created = _time()
+
+
+class WarmPool(object):
+    """
+    Keeps created but not yet started docker containers for recently used images, so that
+    subjobs don't wait for container creation.
+
+    Containers are pooled per key, i.e. per image, environment, volumes other than the work
+    directory, labels other than the subjob specific ones and cgroup, so that a pooled container
+    carries the same job administration labels as a container created for the subjob. Each
+    pooled container has its own empty work directory, which is bound to a job by moving the
+    job's work directory into it. Pools are refilled in the background, limited to size
+    containers per key and max_size containers in total, with the least recently used key
+    evicted first. Containers idle for more than idle_timeout seconds are removed.
+    """
+
+    def __init__(self, client, pool_dir: str, size: int = 1, max_size: int = 4,
+                 idle_timeout: float = 600):
+        """
+        client - the docker client.
+        pool_dir - the directory for the pooled containers' work directories. It must be on the
+            same filesystem as the job work directories.
+        size - the maximum number of pooled containers per key.
+        max_size - the maximum number of pooled containers in total.
+        idle_timeout - how long in seconds a pooled container may wait for a job.
+        """
+        self.client = client
+        self.pool_dir = pool_dir
+        self.size = size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._idle = OrderedDict()  # type: Dict[str, Deque[_Entry]]
+        self._filling = set()
+        self._lock = Lock()
+        self._sweeper = None
+
+    @staticmethod
+    def key(image: str, env: dict, vols: dict, labels: dict, cgroup: str = None) -> str:
+        """
+        Get the pool key for a container configuration. vols must not include the work
+        directory.
+        """
+        return json.dumps([image, env, vols, _pool_labels(labels), cgroup], sort_keys=True)
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(q) for q in self._idle.values())
+
+    def acquire(self, key: str, job_dir: str):
+        """
+        Take a pooled container and bind it to a job's work directory. The job directory is
+        moved into the container's work directory and replaced with a symlink to it.
+        :param key: The pool key.
+        :param job_dir: The job's work directory.
+        :return: The container, not yet started, or None if none are pooled for the key.
+        """
+        with self._lock:
+            entries = self._idle.get(key)
+            if not entries:
+                return None
+            entry = entries.popleft()
+            self._idle.move_to_end(key)
+        try:
+            os.rmdir(entry.work_dir)
+            os.rename(job_dir, entry.work_dir)
+            os.symlink(entry.work_dir, job_dir)
+        except OSError as e:
+            logging.warning(f"Couldn't bind pooled container {entry.container.id}: {e}")
+            if not os.path.exists(job_dir) and os.path.isdir(entry.work_dir):
+                os.rename(entry.work_dir, job_dir)
+            self._remove(entry)
+            return None
+        return entry.container
+
+    def fill(self, key: str, image: str, env: dict, vols: dict, labels: dict,
+             cgroup: str = None):
+        """
+        Refill the pool for a key in the background.
+        """
+        with self._lock:
+            if key in self._filling:
+                return
+            self._filling.add(key)
+            self._idle.setdefault(key, deque())
+            self._idle.move_to_end(key)
+        Thread(
+            target=self._fill, args=[key, image, env, vols, labels, cgroup], daemon=True
+        ).start()
+        self._start_sweeper()
+
+    def _fill(self, key, image, env, vols, labels, cgroup):
+        labels = _pool_labels(labels)
+        try:
+            while True:
+                with self._lock:
+                    if len(self._idle.get(key, ())) >= self.size:
+                        return
+                    evict = self._evict_for_space(key)
+                    if evict is False:
+                        return
+                if evict is not None:
+                    self._remove(evict)
+                work_dir = os.path.join(self.pool_dir, uuid.uuid4().hex)
+                os.makedirs(work_dir)
+                pool_vols = dict(vols)
+                pool_vols[work_dir] = {"bind": "/kb/module/work", "mode": "rw"}
+                try:
+                    c = self.client.containers.create(
+                        image,
+                        "async",
+                        environment=env,
+                        labels=labels,
+                        volumes=pool_vols,
+                        cgroup_parent=cgroup,
+                    )
+                except Exception:
+                    shutil.rmtree(work_dir, ignore_errors=True)
+                    raise
+                with self._lock:
+                    self._idle.setdefault(key, deque()).append(_Entry(c, work_dir))
+        except Exception as e:
+            logging.warning(f"Failed to fill the warm container pool for {image}: {e}")
+        finally:
+            with self._lock:
+                self._filling.discard(key)
+
+    def _evict_for_space(self, key):
+        """
+        Make room for a container for a key. Must be called with the lock held.
+        :return: None if there is room, an entry to remove to make room, or False if there
+            is no room.
+        """
+        if sum(len(q) for q in self._idle.values()) < self.max_size:
+            return None
+        # The least recently used key is first
+        for k, entries in self._idle.items():
+            if k != key and entries:
+                return entries.popleft()
+        return False
+
+    def _start_sweeper(self):
+        with self._lock:
+            if self._sweeper is not None:
+                return
+            self._sweeper = Thread(target=self._sweep, daemon=True)
+        self._sweeper.start()
+
+    def _sweep(self):
+        while True:
+            _sleep(min(60, self.idle_timeout / 2))
+            self.evict_idle()
+
+    def evict_idle(self):
+        """
+        Remove containers that have been idle for longer than the idle timeout.
+        """
+        cutoff = _time() - self.idle_timeout
+        expired = []
+        with self._lock:
+            for key in list(self._idle):
+                entries = self._idle[key]
+                while entries and entries[0].created < cutoff:
+                    expired.append(entries.popleft())
+                if not entries and key not in self._filling:
+                    del self._idle[key]
+        for entry in expired:
+            self._remove(entry)
+
+    def _remove(self, entry: _Entry):
+        try:
+            entry.container.remove(force=True)
+        except Exception:
+            pass
+        shutil.rmtree(entry.work_dir, ignore_errors=True)
+
+    def close(self):
+        """
+        Remove all pooled containers.
+        """
+        with self._lock:
+            entries = [e for q in self._idle.values() for e in q]
+            self._idle.clear()
+        for entry in entries:
+            self._remove(entry)
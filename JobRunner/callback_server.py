@@ -1,7 +1,10 @@
 import asyncio
+import itertools
 import multiprocessing
 import os
 from queue import Empty
+import threading
+from time import time as _time
 import traceback
 import uuid
 
@@ -9,39 +12,89 @@ from sanic import Sanic
 from sanic.config import Config
 from sanic.exceptions import SanicException
 from sanic.log import logger
-from sanic.response import json
+from sanic.response import raw
 
+from clients import jsoncodec
 from clients.baseclient import ServerError
 from JobRunner.CatalogCache import CatalogCache
+from .JobStore import RUNNING, JobStore, JobStoreManager, SpilledOutput
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from .metrics import Metric, RPCStats, render
 from .provenance import Provenance
 
 Config.SANIC_REQUEST_TIMEOUT = 300
 
 # NOTES FOR FUTURE DEVS
 
-# Sanic is a single threaded async server, and the app.run() call below starts a single worker.
-# That means there's a single thread servicing all requests, which is fine, since an
-# instance of the callback server should not be getting more than a few requests a second.
+# By default Sanic runs a single worker, with a single thread servicing all requests, which is
+# fine, since an instance of the callback server should not be getting more than a few requests
+# a second. start_callback_server can also start several worker processes.
 
-# The only async sections of the code as of this writing are the root method itself and
-# the asyncio.sleep() call in the synchronous job checking code.
+# Job state, i.e. outputs, running jobs and provenance, lives in a JobStore, app.ctx.jobs, which
+# is atomic and so keeps the job count correct when requests race. With one worker the store is
+# local and messages from the JobRunner on in_q are read by a background thread in the worker.
+# With several workers the store is served by a manager process, messages are read in the
+# main server process, and each worker has a thread that waits for _Changes to the store.
+# Either way the thread wakes the worker's requests that are waiting on jobs.
 
-# What this means is that it's safe to keep a counter of the number of jobs running without
-# a synchronization block in the form of a lock or semaphore since it's impossible for the counter
-# to be incremented without a job being put on the queue or decremented without a job being
-# removed from the queue.
 
-# However if the Sanic configuration above changes, then you may have to rethink how job count
-# tracking works.
+# Guards _waiters
+_lock = threading.Lock()
+# Job or sync IDs mapped to the (loop, asyncio.Event) pairs of requests in this worker waiting
+# on them
+_waiters = dict()
+_sync_ids = itertools.count()
+_SYNC_PREFIX = "sync-"
 
+# The longest a _check_job call may wait for its job to finish, in seconds. Advertised to clients
+# in the CHECK_JOB_MAX_WAIT_HEADER header of every RPC response.
+CHECK_JOB_MAX_WAIT = 300
+CHECK_JOB_MAX_WAIT_HEADER = "X-Check-Job-Max-Wait"
+# The longest a request waits for the completion reader to catch up with the JobRunner's
+# messages, in seconds
+SYNC_TIMEOUT = 60
 
-# may need to put these in the app.config too?
-outputs = dict()
-prov = []
+# Marks where spilled outputs go in an encoded response
+_SPILLED_PLACEHOLDER = f"__spilled_output_{uuid.uuid4().hex}_"
 
 
-def create_app(app_name: str = "jobrunner", shutdown_event: multiprocessing.Event = None):
+def create_app(
+        app_name: str = "jobrunner",
+        shutdown_event: multiprocessing.Event = None,
+        ready_event: multiprocessing.Event = None,
+    ):
     app = Sanic(app_name)
+    app.ctx.jobs = JobStore()
+    app.ctx.rpc_stats = RPCStats()
+    # Set when the job state is shared between workers
+    app.ctx.changes = None
+
+    @app.after_server_start
+    async def start_completion_reader(app, _):
+        app.ctx.completion_reader = None
+        if app.config.get("in_q") is None:
+            return
+        stop = threading.Event()
+        # With several workers the main process reads in_q
+        target = _read_completions if app.ctx.changes is None else _watch_changes
+        reader = threading.Thread(
+            target=target, args=[app, stop], name="callback-completions", daemon=True)
+        reader.start()
+        app.ctx.completion_reader = (reader, stop)
+
+    @app.after_server_stop
+    async def stop_completion_reader(app, _):
+        if getattr(app.ctx, "completion_reader", None):
+            reader, stop = app.ctx.completion_reader
+            stop.set()
+            reader.join()
+            app.ctx.completion_reader = None
+
+    if ready_event:
+        # Registered after the reader so requests are served as soon as this is set
+        @app.after_server_start
+        async def ready_listener(app, _):
+            ready_event.set()
 
     if shutdown_event:
         @app.after_server_start
@@ -52,18 +105,38 @@ def create_app(app_name: str = "jobrunner", shutdown_event: multiprocessing.Even
 
     @app.route("/", methods=["GET", "POST"])
     async def root(request):
-        data = request.json
+        start = _time()
+        data = request.load_json(loads=jsoncodec.loads)
+        # Submits rewrite the method in data
+        method = data.get("method") if isinstance(data, dict) else None
         try:
             if request.method == "POST" and data is not None and "method" in data:
                 token = request.headers.get("Authorization")
-                response = await _process_rpc(request.app, data, token)
-                status = 500 if "error" in response else 200
-                return json(response, status=status)
-            return json([{}])
+                response = await _process_rpc(request.app, data, token, request.ip)
+                status = 500 if _has_error(response) else 200
+                _record_rpc(request.app, method, start, status == 500)
+                headers = {CHECK_JOB_MAX_WAIT_HEADER: str(CHECK_JOB_MAX_WAIT)}
+                body, spilled = _encode(response)
+                if spilled:
+                    loop = asyncio.get_running_loop()
+                    body = await loop.run_in_executor(None, _splice, body, spilled)
+                return _json_response(body, status=status, headers=headers)
+            return _json_response(jsoncodec.dumps([{}]))
         except Exception as e:
             stack = traceback.format_exc()
             print(f"Exception when processing jsonrpc: {e}\n: {stack}")
-            return json(_error("Unexpected error", trace=stack), status=500)
+            if method is not None:
+                _record_rpc(request.app, method, start, True)
+            return _json_response(
+                jsoncodec.dumps(_error("Unexpected error", trace=stack)), status=500)
+
+    @app.route("/metrics", methods=["GET"])
+    async def metrics(request):
+        # Getting the counts may mean calls to the manager process, so keep them off the loop
+        loop = asyncio.get_running_loop()
+        body = await loop.run_in_executor(None, _render_metrics, request.app)
+        return raw(body.encode(), content_type=METRICS_CONTENT_TYPE)
+
     return app
 
 
@@ -78,6 +151,139 @@ def start_callback_server(
         app_name: str = "jobrunner",
         shutdown_event: multiprocessing.Event = None,
         max_tasks: int = 10,
+        workers: int = 1,
+        ready_event: multiprocessing.Event = None,
+        output_retention: float = None,
+        max_queued: int = 0,
+    ):
+    """
+    Run the callback server until it's stopped. If ready_event is supplied, it's set once the
+    server is accepting connections. Job outputs are discarded output_retention seconds after
+    they're first returned, or kept for the life of the server if it's None. Up to max_queued
+    submits beyond max_tasks running jobs are queued rather than refused.
+    """
+    app = create_app(app_name=app_name, shutdown_event=shutdown_event, ready_event=ready_event)
+    _configure(app, out_queue, in_queue, token, bypass_token, cc, max_tasks, max_queued)
+    app.ctx.jobs = JobStore(retention=output_retention)
+    if workers > 1:
+        manager = JobStoreManager()
+        manager.start()
+        app.ctx.jobs = manager.JobStore(retention=output_retention)
+        app.ctx.rpc_stats = manager.RPCStats()
+        app.ctx.changes = _Changes()
+        # The workers are forked by app.run() and inherit the store proxy and _Changes
+        threading.Thread(
+            target=_read_completions,
+            args=[app, threading.Event()],
+            name="callback-completions",
+            daemon=True,
+        ).start()
+    if os.environ.get("IN_CONTAINER"):
+        ip = "0.0.0.0"
+    # With one worker app.run() serves in this process. start_callback_server_thread serves
+    # from a thread instead.
+    app.run(host=ip, port=port, debug=False, access_log=False, motd=False, workers=workers)
+
+
+def start_callback_server_thread(
+        ip,
+        port,
+        out_queue,
+        in_queue,
+        token,
+        bypass_token,
+        cc: CatalogCache,
+        app_name: str = "jobrunner",
+        shutdown_event: multiprocessing.Event = None,
+        max_tasks: int = 10,
+        start_timeout: float = 30,
+        output_retention: float = None,
+        max_queued: int = 0,
+    ) -> threading.Thread:
+    """
+    Run the callback server with a single worker on its own event loop in a thread of this
+    process, rather than in a process of its own. The server stops when shutdown_event is set.
+    :param start_timeout: How long to wait for the server to start, in seconds.
+    :param output_retention: As for start_callback_server.
+    :param max_queued: As for start_callback_server.
+    :return: The server thread, once the server is accepting connections.
+    """
+    ready = threading.Event()
+    app = create_app(app_name=app_name, ready_event=ready)
+    _configure(app, out_queue, in_queue, token, bypass_token, cc, max_tasks, max_queued)
+    app.ctx.jobs = JobStore(retention=output_retention)
+    if os.environ.get("IN_CONTAINER"):
+        ip = "0.0.0.0"
+    errors = []
+    thread = threading.Thread(
+        target=_serve_in_thread,
+        args=[app, ip, port, shutdown_event or threading.Event(), errors],
+        name="callback-server",
+        daemon=True,
+    )
+    thread.start()
+    while not ready.wait(0.05):
+        if not thread.is_alive():
+            raise RuntimeError(f"Callback server failed to start: {errors[0] if errors else ''}")
+        start_timeout -= 0.05
+        if start_timeout < 0:
+            raise RuntimeError("Callback server didn't start in time")
+    return thread
+
+
+def _serve_in_thread(app, ip, port, shutdown_event, errors: list):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    app.config.MOTD = False
+    try:
+        server = loop.run_until_complete(app.create_server(
+            host=ip, port=port, access_log=False, return_asyncio_server=True))
+        if server is None:
+            raise OSError(f"Couldn't listen on {ip}:{port}")
+        loop.run_until_complete(server.startup())
+        loop.run_until_complete(server.before_start())
+        loop.run_until_complete(server.after_start())
+        loop.run_until_complete(_wait_for_shutdown(shutdown_event))
+        loop.run_until_complete(server.before_stop())
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        # Drain connections as app.run() does
+        for conn in server.connections:
+            conn.close_if_idle()
+        graceful = app.config.GRACEFUL_SHUTDOWN_TIMEOUT
+        while server.connections and graceful > 0:
+            loop.run_until_complete(asyncio.sleep(0.1))
+            graceful -= 0.1
+        for conn in list(server.connections):
+            conn.abort()
+        loop.run_until_complete(server.after_stop())
+    except Exception as e:
+        errors.append(e)
+        logger.exception("Callback server failed")
+    finally:
+        tasks = asyncio.all_tasks(loop)
+        for task in tasks:
+            task.cancel()
+        loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        loop.close()
+        # Let the app name be reused by the next server in this process
+        Sanic._app_registry.pop(app.name, None)
+
+
+async def _wait_for_shutdown(shutdown_event):
+    while not shutdown_event.is_set():
+        await asyncio.sleep(0.1)
+
+
+def _configure(
+        app,
+        out_queue,
+        in_queue,
+        token,
+        bypass_token,
+        cc: CatalogCache,
+        max_tasks: int,
+        max_queued: int = 0,
     ):
     timeout = 3600
     max_size_bytes = 100000000000
@@ -91,37 +297,163 @@ def start_callback_server(
         "KEEP_ALIVE_TIMEOUT": timeout,
         "REQUEST_MAX_SIZE": max_size_bytes,
         "catcache": cc,
-        "jobcount": 0,
         "maxjobs": max_tasks,
+        "maxqueued": max_queued,
     }
-    app = create_app(app_name=app_name, shutdown_event=shutdown_event)
     app.config.update(conf)
-    if os.environ.get("IN_CONTAINER"):
-        ip = "0.0.0.0"
-    # JobRunner starts a new process to call this method, but app.run() also starts a new
-    # process. Might be redundant and a thread might work fine, since this blocks.
-    app.run(host=ip, port=port, debug=False, access_log=False, motd=False)
 
 
-def _check_finished(app, info=None):
-    global prov
-    logger.debug(info)
+class _Changes(object):
+    """
+    Tells server worker processes that the shared job state has changed.
+    """
+
+    def __init__(self):
+        self._cond = multiprocessing.Condition()
+        self._seq = multiprocessing.Value("L", 0, lock=False)
+
+    def notify(self):
+        with self._cond:
+            self._seq.value += 1
+            self._cond.notify_all()
+
+    def wait(self, seen, timeout: float) -> int:
+        """
+        Wait until the state changes.
+        :param seen: The value returned by the last call, or None.
+        :param timeout: The maximum time to wait in seconds.
+        :return: The current value.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq.value != seen, timeout)
+            return self._seq.value
+
+
+def _read_completions(app, stop: threading.Event):
+    """
+    Read messages from the JobRunner until stopped, updating the job state and waking the
+    requests waiting on it.
+    """
     in_q = app.config["in_q"]
+    while not stop.is_set():
+        try:
+            # Output messages may carry the size of the output's JSON as a fourth element
+            [mtype, fjob_id, output, *size] = in_q.get(timeout=0.1)
+        except Empty:
+            continue
+        # A bad message mustn't stop the reader, or every request would wait forever
+        try:
+            _read_completion(app, mtype, fjob_id, output, *size)
+        except Exception:
+            logger.exception(f"Failed to process {mtype} message for {fjob_id}")
+
+
+def _read_completion(app, mtype, fjob_id, output, size=None):
+    app.ctx.jobs.deliver(mtype, fjob_id, output, size)
+    if mtype == "output":
+        # A job finishing frees a slot for a queued job
+        for job_id, data in app.ctx.jobs.admit(app.config["maxjobs"]):
+            app.config["out_q"].put(["submit", job_id, data])
+    if app.ctx.changes is None:
+        _wake(app)
+    else:
+        app.ctx.changes.notify()
+
+
+def _watch_changes(app, stop: threading.Event):
+    """
+    Wake this worker's waiting requests whenever the shared job state changes, until stopped.
+    """
+    seen = None
+    while not stop.is_set():
+        seq = app.ctx.changes.wait(seen, 0.1)
+        if seq != seen:
+            seen = seq
+            _wake(app)
+
+
+def _wake(app):
+    with _lock:
+        if not _waiters:
+            return
+        job_ids = [k for k in _waiters if not k.startswith(_SYNC_PREFIX)]
+        sync_ids = [k for k in _waiters if k.startswith(_SYNC_PREFIX)]
+        for key in app.ctx.jobs.done(job_ids, sync_ids):
+            _notify(key)
+
+
+def _notify(key):
+    # Must be called with _lock held
+    for loop, event in _waiters.pop(key, []):
+        try:
+            loop.call_soon_threadsafe(event.set)
+        except RuntimeError:
+            pass  # the server stopped and the loop is closed
+
+
+def _add_waiter(key) -> asyncio.Event:
+    # Must be called with _lock held
+    event = asyncio.Event()
+    _waiters.setdefault(key, []).append((asyncio.get_running_loop(), event))
+    return event
+
+
+def _remove_waiter(key, event: asyncio.Event):
+    with _lock:
+        waiters = _waiters.get(key, [])
+        waiters[:] = [w for w in waiters if w[1] is not event]
+        if not waiters:
+            _waiters.pop(key, None)
+
+
+async def _check_finished(app, info=None) -> bool:
+    """
+    Wait until every message the JobRunner put on in_q before this call has been processed.
+    :return: False if that didn't happen within the sync timeout.
+    """
+    logger.debug(info)
+    if not getattr(app.ctx, "completion_reader", None):
+        return True
+    sync_id = f"{_SYNC_PREFIX}{os.getpid()}-{next(_sync_ids)}"
+    with _lock:
+        event = _add_waiter(sync_id)
+    # in_q is FIFO, so once the reader gets to this message it's processed everything before it
+    app.config["in_q"].put(["sync", sync_id, None])
     try:
-        # Flush the queue
-        while True:
-            [mtype, fjob_id, output] = in_q.get(block=False)
-            if mtype == "output":
-                outputs[fjob_id] = output
-                app.config["jobcount"] -= 1
-                if app.config["jobcount"] < 0:
-                    raise ValueError(  # should never happen
-                        "There's a programming error here, job count should never be < 0"
-                    )
-            elif mtype == "prov":
-                prov = output
-    except Empty:
-        pass
+        await asyncio.wait_for(event.wait(), app.config.get("sync_timeout", SYNC_TIMEOUT))
+        return True
+    except asyncio.TimeoutError:
+        logger.error(f"Timed out waiting for the job runner's messages: {info}")
+        return False
+    finally:
+        _remove_waiter(sync_id, event)
+        if not event.is_set():
+            # Timed out or cancelled, so nothing will collect the marker
+            app.ctx.jobs.abandon_sync(sync_id)
+
+
+def _sync_timeout_error():
+    return _error("Timed out waiting for the job runner to report job states")
+
+
+async def _wait_for_job(app, job_id, timeout: float = None) -> bool:
+    """
+    Wait until a job has output.
+    :param job_id: The job ID.
+    :param timeout: The maximum time to wait in seconds, or None to wait indefinitely.
+    :return: True if the job has output, False if the wait timed out.
+    """
+    with _lock:
+        if app.ctx.jobs.done([job_id], []):
+            return True
+        event = _add_waiter(job_id)
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        _remove_waiter(job_id, event)
 
 
 def _check_rpc_token(app, token):
@@ -134,9 +466,10 @@ def _check_rpc_token(app, token):
             raise SanicException(status_code=401)
 
 
-def _handle_get_provenance(app):
-    _check_finished(app, info="Handle get provenance")
-    return {"result": [prov]}
+async def _handle_get_provenance(app):
+    if not await _check_finished(app, info="Handle get provenance"):
+        return _sync_timeout_error()
+    return {"result": [app.ctx.jobs.get_prov()]}
 
 
 def _handle_set_provenance(app, data):
@@ -171,11 +504,52 @@ def _check_module_lookup(app, module, data):
     return None
 
 
-def _handle_submit(app, module, method, data, token):
-    if app.config["jobcount"] >= app.config["maxjobs"]:
+def _too_many_jobs(app):
+    if app.config.get("maxqueued"):
         return _error(
-            f"No more than {app.config['maxjobs']} concurrently running methods are allowed"
+            f"No more than {app.config['maxjobs']} concurrently running methods and "
+            + f"{app.config['maxqueued']} queued methods are allowed"
         )
+    return _error(
+        f"No more than {app.config['maxjobs']} concurrently running methods are allowed"
+    )
+
+
+def _scheduling(data, client=None):
+    """
+    Get the fair share and priority of a submitted job from its JSON-RPC context. The share is
+    the context's parent_job_id, or else the job ID in the last entry of its call_stack, or else
+    the address of the client that submitted the job. SDK clients don't send either, but each
+    job container has its own address. The priority is the context's priority, or else the depth
+    of the call stack, so that jobs deep in the stack, which the jobs above them are waiting on,
+    run first.
+    :param client: The address of the client that submitted the job.
+    :return: The share and the priority, which is None if the context's priority is invalid.
+    """
+    context = data.get("context")
+    if not isinstance(context, dict):
+        context = {}
+    call_stack = context.get("call_stack")
+    if not isinstance(call_stack, list):
+        call_stack = []
+    share = context.get("parent_job_id")
+    if share is None and call_stack and isinstance(call_stack[-1], dict):
+        share = call_stack[-1].get("job_id")
+    if share is None and client:
+        share = f"client:{client}"
+    priority = context.get("priority", len(call_stack))
+    if isinstance(priority, bool) or not isinstance(priority, (int, float)):
+        priority = None
+    return share, priority
+
+
+def _handle_submit(app, module, method, data, token, client=None):
+    maxjobs, maxqueued = app.config["maxjobs"], app.config.get("maxqueued", 0)
+    if app.ctx.jobs.full(maxjobs, maxqueued):
+        return _too_many_jobs(app)
+    share, priority = _scheduling(data, client)
+    if priority is None:
+        return _error(f"Invalid priority: {data['context']['priority']}")
     if module != "special":
         # "special" denotes the method call does something unusual. The module is not registered
         # in the catalog. Not clear how to reasonably test this case.
@@ -187,9 +561,13 @@ def _handle_submit(app, module, method, data, token):
     _check_rpc_token(app, token)
     job_id = str(uuid.uuid4())
     data["method"] = "%s.%s" % (module, method)
-    outputs[job_id] = {"finished": 0}
-    app.config["out_q"].put(["submit", job_id, data])
-    app.config["jobcount"] += 1
+    # Checks the counts again, atomically, in case of concurrent submits. Queued jobs are
+    # started by the completion reader as running jobs finish.
+    state = app.ctx.jobs.submit_or_queue(job_id, maxjobs, data, maxqueued, share, priority)
+    if state is None:
+        return _too_many_jobs(app)
+    if state == RUNNING:
+        app.config["out_q"].put(["submit", job_id, data])
     return {"result": [job_id]}
 
 
@@ -211,32 +589,213 @@ def _is_uuid(putative: str) -> bool:
     return True
 
 
-def _handle_checkjob(app, data):
+async def _handle_checkjob(app, data):
+    # The params are the job ID, optionally followed by an options dict. The only option is
+    # "wait", the number of seconds to hold the request open waiting for the job to finish.
+    # Clients only send options when the server advertises support with the
+    # CHECK_JOB_MAX_WAIT_HEADER response header.
     if (not data.get("params")
         or not isinstance(data["params"], list)
-        or len(data["params"]) != 1
+        or len(data["params"]) not in [1, 2]
         or not isinstance(data["params"][0], str)
+        or (len(data["params"]) == 2 and not isinstance(data["params"][1], dict))
     ):
         return _error("method params must be a list containing exactly one job ID string")
     job_id = data["params"][0]
     if not _is_uuid(job_id):
         return _error(f"Invalid job ID: {data['params'][0]}")
-    _check_finished(app, f"Checkjob for {job_id}")
-    if job_id not in outputs:
+    wait = data["params"][1].get("wait", 0) if len(data["params"]) == 2 else 0
+    if not _is_wait_time(wait):
+        return _error(f"Invalid wait time: {wait}")
+    if not await _check_finished(app, f"Checkjob for {job_id}"):
+        return _sync_timeout_error()
+    if not app.ctx.jobs.has_job(job_id):
         return _error(f"No such job ID: {job_id}")
+    if wait:
+        await _wait_for_job(app, job_id, min(wait, CHECK_JOB_MAX_WAIT))
 
-    resp = outputs[job_id]
-    if resp.get("finished") != 0:
-        resp["finished"] = 1
-        if "error" in resp:
-            return resp
+    resp = app.ctx.jobs.job_state(job_id)
+    finished = isinstance(resp, SpilledOutput) or resp.get("finished") == 1
+    if finished and _has_error(resp):
+        return resp
 
     return {"result": [resp]}
 
 
-async def _process_rpc(app, data, token):
+def _rpc_name(method) -> str:
+    """
+    Get the name to record an RPC under. Job submits and checks are grouped, rather than
+    recorded per app method.
+    """
+    parts = method.split(".") if isinstance(method, str) else []
+    if len(parts) != 2:
+        return "invalid"
+    module, method = parts
+    if method.startswith("_") and method.endswith("_submit"):
+        return "_submit"
+    if method.startswith("_check_job"):
+        return "_check_job"
+    if module == "CallbackServer":
+        return f"CallbackServer.{method}"
+    return "sync"
+
+
+def _record_rpc(app, method, start: float, error: bool):
+    app.ctx.rpc_stats.record(_rpc_name(method), _time() - start, error)
+
+
+def _queue_depth(q):
+    try:
+        return q.qsize()
+    except (AttributeError, NotImplementedError):
+        # e.g. multiprocessing queues on macOS
+        return None
+
+
+def _render_metrics(app) -> str:
+    """
+    Render the callback server's and the job runner's metrics in the Prometheus text format.
+    """
+    stats = app.ctx.jobs.stats()
+    requests = Metric("jobrunner_rpc_requests_total", "counter", "JSON-RPC requests by method")
+    errors = Metric(
+        "jobrunner_rpc_errors_total", "counter", "JSON-RPC requests that failed, by method")
+    latency = Metric(
+        "jobrunner_rpc_duration_seconds", "histogram", "JSON-RPC request latency by method")
+    for method, rpc in sorted(app.ctx.rpc_stats.snapshot().items()):
+        requests.add(rpc["requests"], method=method)
+        errors.add(rpc["errors"], method=method)
+        latency.add_histogram(rpc["latency"], method=method)
+    depth = Metric("jobrunner_queue_depth", "gauge", "Messages waiting on the job runner queues")
+    for name, key in [("in", "in_q"), ("out", "out_q")]:
+        n = _queue_depth(app.config.get(key))
+        if n is not None:
+            depth.add(n, queue=name)
+    metrics = [
+        requests,
+        errors,
+        latency,
+        Metric("jobrunner_jobs_running", "gauge", "Running subjobs").add(stats["running"]),
+        Metric("jobrunner_jobs_queued", "gauge", "Subjobs queued to run").add(stats["queued"]),
+        depth,
+        Metric("jobrunner_output_bytes", "gauge", "Bytes of job outputs held for clients")
+        .add(stats["output_bytes"], storage="memory")
+        .add(stats["spilled_output_bytes"], storage="disk"),
+    ]
+    runner = stats["runner"]
+    if "containers" in runner:
+        containers = runner["containers"]
+        metrics += [
+            Metric("jobrunner_container_starts_total", "counter", "Job containers started")
+            .add(containers["starts"]),
+            Metric("jobrunner_container_exits_total", "counter", "Job containers exited")
+            .add(containers["exits"]),
+            Metric("jobrunner_image_pull_duration_seconds", "histogram", "Image pull durations")
+            .add_histogram(containers["pulls"]),
+        ]
+    if "log" in runner:
+        metrics += [
+            Metric("jobrunner_log_lines_total", "counter", "Log lines produced by the job")
+            .add(runner["log"]["lines"]),
+            Metric("jobrunner_log_lines_shipped_total", "counter", "Log lines shipped to ee2")
+            .add(runner["log"]["shipped_lines"]),
+        ]
+    return render(metrics)
+
+
+def _json_response(body: bytes, status: int = 200, headers: dict = None):
+    return raw(body, status=status, headers=headers, content_type="application/json")
+
+
+def _has_error(resp) -> bool:
+    if isinstance(resp, SpilledOutput):
+        return resp.error is not None
+    return "error" in resp
+
+
+def _encode(response):
+    """
+    Encode a response as JSON, with a placeholder for each SpilledOutput in it.
+    :return: The JSON and the list of SpilledOutputs.
+    """
+    spilled = []
+
+    def placeholder(obj):
+        if isinstance(obj, SpilledOutput):
+            spilled.append(obj)
+            return f"{_SPILLED_PLACEHOLDER}{len(spilled) - 1}"
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+    return jsoncodec.dumps(response, default=placeholder), spilled
+
+
+def _splice(body: bytes, spilled: list) -> bytes:
+    """
+    Replace the placeholders in an encoded response with the spilled outputs, read from disk
+    as is.
+    """
+    pieces = body.split(b'"' + _SPILLED_PLACEHOLDER.encode())
+    out = [pieces[0]]
+    for piece in pieces[1:]:
+        index, rest = piece.split(b'"', 1)
+        out.append(spilled[int(index)].state_bytes())
+        out.append(rest)
+    return b"".join(out)
+
+
+def _is_wait_time(wait) -> bool:
+    return not isinstance(wait, bool) and isinstance(wait, (int, float)) and wait >= 0
+
+
+async def _handle_check_jobs(app, data):
+    """
+    Get the state of several jobs at once, optionally waiting for any or all of them to finish.
+    The params are a single dict with the keys:
+    job_ids - the list of job IDs.
+    wait - optional, the number of seconds to wait.
+    wait_for - optional, "all" (the default) to wait for all the jobs to finish or "any" to
+        wait for the first.
+    The result maps each job ID to its state, as returned by _check_job.
+    """
+    if (not data.get("params")
+        or not isinstance(data["params"], list)
+        or len(data["params"]) != 1
+        or not isinstance(data["params"][0], dict)
+        or not isinstance(data["params"][0].get("job_ids"), list)
+    ):
+        return _error("method params must be a list containing exactly one dict with a "
+                      + "job_ids list")
+    params = data["params"][0]
+    job_ids = params["job_ids"]
+    for job_id in job_ids:
+        if not isinstance(job_id, str) or not _is_uuid(job_id):
+            return _error(f"Invalid job ID: {job_id}")
+    wait = params.get("wait", 0)
+    if not _is_wait_time(wait):
+        return _error(f"Invalid wait time: {wait}")
+    wait_for = params.get("wait_for", "all")
+    if wait_for not in ["all", "any"]:
+        return _error(f"Invalid wait_for value: {wait_for}")
+    # One drain for the whole batch
+    if not await _check_finished(app, f"Check jobs for {len(job_ids)} jobs"):
+        return _sync_timeout_error()
+    unknown = app.ctx.jobs.unknown(job_ids)
+    if unknown:
+        return _error(f"No such job ID: {unknown[0]}")
+    if wait and job_ids:
+        tasks = [asyncio.ensure_future(_wait_for_job(app, j)) for j in set(job_ids)]
+        when = asyncio.FIRST_COMPLETED if wait_for == "any" else asyncio.ALL_COMPLETED
+        _, pending = await asyncio.wait(
+            tasks, timeout=min(wait, CHECK_JOB_MAX_WAIT), return_when=when)
+        for task in pending:
+            task.cancel()
+    return {"result": [app.ctx.jobs.job_states(job_ids)]}
+
+
+async def _process_rpc(app, data, token, client=None):
     """
     Handle KBase SDK App Client Requests
+    client - the address of the client making the request.
     """
 
     parts = data["method"].split(".")
@@ -246,33 +805,31 @@ async def _process_rpc(app, data, token):
     # async submit job
     if method.startswith("_") and method.endswith("_submit"):
         method = method[1:-7]
-        return _handle_submit(app, module, method, data, token)
+        return _handle_submit(app, module, method, data, token, client)
     # check job
     elif method.startswith("_check_job"):
-        return _handle_checkjob(app, data=data)
+        return await _handle_checkjob(app, data=data)
     # Provenance
     elif module == "CallbackServer":
         if method == "get_provenance":
-            return _handle_get_provenance(app)
+            return await _handle_get_provenance(app)
         if method == "set_provenance":
             return _handle_set_provenance(app, data)
+        if method == "check_jobs":
+            return await _handle_check_jobs(app, data)
         # https://www.jsonrpc.org/specification#error_object
         return _error(f"No such CallbackServer method: {method}", code=-32601)
     else:
         # Does this even happen any more?
         # Sync Job
-        ret = _handle_submit(app, module, method, data, token)
+        ret = _handle_submit(app, module, method, data, token, client)
         if "error" in ret:
             return ret
         job_id = ret["result"][0]
         try:
-            while True:
-                _check_finished(app, f'synk check for {data["method"]} for {job_id}')
-                if outputs[job_id].get("finished") != 0:
-                    resp = outputs[job_id]
-                    resp["finished"] = 1
-                    return resp
-                await asyncio.sleep(1)
+            logger.debug(f'sync wait for {data["method"]} for {job_id}')
+            await _wait_for_job(app, job_id)
+            return app.ctx.jobs.job_state(job_id)
         except Exception as e:
             # Attempt to log error, but this is not very effective..
             exception_message = f"Timeout or exception: {e} {type(e)}"
@@ -283,9 +840,9 @@ async def _process_rpc(app, data, token):
                 "message": exception_message,
                 "name": "CallbackServerError",
             }
-            outputs[job_id] = {
+            app.ctx.jobs.deliver("output", job_id, {
                 "result": exception_message,
                 "error": error_obj,
                 "finished": 1,
-            }
-            return outputs[job_id]
+            })
+            return app.ctx.jobs.job_state(job_id)
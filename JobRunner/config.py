@@ -71,7 +71,65 @@ class Config:
         self.auth2_url = f"{self.base_url}auth/api/V2/token"
 
         self.runtime = os.environ.get("RUNTIME", "docker")
+        # Stream docker container output rather than polling for it
+        self.docker_follow_logs = os.environ.get(
+            "JR_DOCKER_FOLLOW_LOGS", "false").lower() == "true"
+        # Detect docker container exits from the docker event stream rather than polling
+        self.docker_events = os.environ.get("JR_DOCKER_EVENTS", "false").lower() == "true"
+        # Pull the images a job is likely to need in the background when the job starts
+        self.prefetch_images = os.environ.get("JR_PREFETCH_IMAGES", "false").lower() == "true"
+        # A file recording the modules each app ran as subjobs, used to pick images to prefetch
+        self.prefetch_history = os.environ.get("JR_PREFETCH_HISTORY")
+        self.prefetch_max_modules = int(os.environ.get("JR_PREFETCH_MAX_MODULES", "5"))
+        # Keep pre-created containers for recently used subjob images
+        self.warm_pool = os.environ.get("JR_WARM_POOL", "false").lower() == "true"
+        self.warm_pool_size = int(os.environ.get("JR_WARM_POOL_SIZE", "1"))
+        self.warm_pool_max = int(os.environ.get("JR_WARM_POOL_MAX", "4"))
+        self.warm_pool_idle = float(os.environ.get("JR_WARM_POOL_IDLE", "600"))
+        # Run subjobs on long running module servers rather than one container per subjob
+        self.module_servers = os.environ.get("JR_MODULE_SERVERS", "false").lower() == "true"
+        self.module_server_start_timeout = float(
+            os.environ.get("JR_MODULE_SERVER_START_TIMEOUT", "300"))
+        self.module_server_call_timeout = float(
+            os.environ.get("JR_MODULE_SERVER_CALL_TIMEOUT", "86400"))
+        # The number of callback server worker processes
+        self.callback_workers = int(os.environ.get("JR_CALLBACK_WORKERS", "1"))
+        # Run a single worker callback server on a thread of the job runner process
+        self.callback_in_process = (
+            os.environ.get("JR_CALLBACK_IN_PROCESS", "false").lower() == "true")
+        self.callback_start_timeout = float(os.environ.get("JR_CALLBACK_START_TIMEOUT", "30"))
+        # Pass subjob outputs larger than this to the callback server by reference. 0 disables
+        self.output_spill_bytes = int(
+            os.environ.get("JR_OUTPUT_SPILL_BYTES", str(16 * 1024 * 1024)))
+        # Discard subjob outputs this many seconds after they're returned. 0 keeps them
+        self.output_retention = float(os.environ.get("JR_OUTPUT_RETENTION", "3600"))
         self.max_tasks = max_tasks or int(os.environ.get("JR_MAX_TASKS", "10"))
+        # Queue up to this many subjob submits beyond max_tasks rather than refusing them
+        self.callback_max_queued = int(os.environ.get("JR_CALLBACK_MAX_QUEUED", "0"))
+        # Ship job logs to ee2 in batches from a background thread
+        self.log_buffered = os.environ.get("JR_LOG_BUFFERED", "false").lower() == "true"
+        self.log_batch_lines = int(os.environ.get("JR_LOG_BATCH_LINES", "1000"))
+        self.log_batch_bytes = int(os.environ.get("JR_LOG_BATCH_BYTES", str(1024 * 1024)))
+        self.log_flush_interval = float(os.environ.get("JR_LOG_FLUSH_INTERVAL", "1.0"))
+        # How long to wait for buffered job logs to be shipped when a job fails
+        self.log_close_timeout = float(os.environ.get("JR_LOG_CLOSE_TIMEOUT", "60"))
+        # Spill undeliverable job logs to disk and replay them when ee2 recovers
+        self.log_spill = os.environ.get("JR_LOG_SPILL", "false").lower() == "true"
+        self.log_spill_drain_timeout = float(
+            os.environ.get("JR_LOG_SPILL_DRAIN_TIMEOUT", "300"))
+        # Fold repeated lines and progress bars in container output
+        self.log_compact = os.environ.get("JR_LOG_COMPACT", "false").lower() == "true"
+        # Limits on the volume of container output shipped to ee2. 0 is unlimited
+        self.log_max_bytes = int(os.environ.get("JR_LOG_MAX_BYTES", "0"))
+        self.log_max_lines_per_sec = int(os.environ.get("JR_LOG_MAX_LINES_PER_SEC", "0"))
+        self.log_container_max_bytes = int(os.environ.get("JR_LOG_CONTAINER_MAX_BYTES", "0"))
+        self.log_container_max_lines_per_sec = int(
+            os.environ.get("JR_LOG_CONTAINER_MAX_LINES_PER_SEC", "0"))
+        self.log_max_line_bytes = int(os.environ.get("JR_LOG_MAX_LINE_BYTES", "0"))
+        # How often to write log pipeline counters to the runner log while the job runs
+        self.log_stats_interval = float(os.environ.get("JR_LOG_STATS_INTERVAL", "300"))
+        # How often to send the runner's metrics to the callback server's /metrics endpoint
+        self.metrics_interval = float(os.environ.get("JR_METRICS_INTERVAL", "5"))
         self.token = _get_token()
         self.admin_token = _get_admin_token()
         if _DEBUG_ENVNAME in os.environ and os.environ[_DEBUG_ENVNAME].lower() == "true":
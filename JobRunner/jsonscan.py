@@ -0,0 +1,131 @@
+import json
+import mmap
+import re
+from typing import Dict, Iterable, Tuple
+
+_WS = re.compile(rb"\s*")
+# Matches the rest of a string after its opening quote
+_STRING_REST = re.compile(rb'(?:[^"\\]|\\.)*"', re.S)
+# Matches up to and including the next bracket outside a string, capturing the bracket
+_TO_BRACKET = re.compile(rb'[^"{}\[\]]*(?:"(?:[^"\\]|\\.)*"[^"{}\[\]]*)*([{}\[\]])', re.S)
+_SCALAR = re.compile(rb"[^,}\]\s]+")
+_CLOSERS = {ord("{"): ord("}"), ord("["): ord("]")}
+
+
+class ObjectScan(object):
+    """
+    The top level keys of a JSON object, with the byte spans of their values and the parsed
+    values of selected keys.
+    """
+
+    def __init__(self, spans: Dict[str, Tuple[int, int]], values: dict):
+        """
+        spans - the key mapped to the start and end byte offsets of its value.
+        values - the key mapped to its parsed value, for the keys that were parsed.
+        """
+        self.spans = spans
+        self.values = values
+
+    def __contains__(self, key):
+        return key in self.spans
+
+
+def scan_object_file(path: str, parse_keys: Iterable[str] = (),
+                     max_parse_bytes: int = 16 * 1024 * 1024) -> ObjectScan:
+    """
+    Check that a file holds a single JSON object and find its top level keys, without turning
+    the values into Python objects. The file is memory mapped rather than read.
+
+    Only the top level structure is fully checked. Nested values are checked for balanced
+    brackets and terminated strings, but not for valid scalars.
+    :param path: The path to the file.
+    :param parse_keys: The keys whose values should be parsed.
+    :param max_parse_bytes: Values of parse_keys larger than this are not parsed.
+    :return: The scan of the object.
+    :raises ValueError: if the file doesn't hold a JSON object.
+    """
+    with open(path, "rb") as f:
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise ValueError("Empty file")
+        with buf:
+            return scan_object(buf, parse_keys, max_parse_bytes)
+
+
+def scan_object(buf, parse_keys: Iterable[str] = (),
+                max_parse_bytes: int = 16 * 1024 * 1024) -> ObjectScan:
+    """
+    As scan_object_file, but for a bytes-like object.
+    """
+    parse_keys = set(parse_keys)
+    spans = dict()
+    values = dict()
+    pos = _skip_ws(buf, 0)
+    _expect(buf, pos, b"{")
+    pos = _skip_ws(buf, pos + 1)
+    if buf[pos:pos + 1] == b"}":
+        pos += 1
+    else:
+        while True:
+            _expect(buf, pos, b'"')
+            end = _skip_string(buf, pos)
+            key = json.loads(bytes(buf[pos:end]))
+            pos = _skip_ws(buf, end)
+            _expect(buf, pos, b":")
+            start = _skip_ws(buf, pos + 1)
+            end = _skip_value(buf, start)
+            spans[key] = (start, end)
+            if key in parse_keys and end - start <= max_parse_bytes:
+                values[key] = json.loads(bytes(buf[start:end]))
+            pos = _skip_ws(buf, end)
+            if buf[pos:pos + 1] == b"}":
+                pos += 1
+                break
+            _expect(buf, pos, b",")
+            pos = _skip_ws(buf, pos + 1)
+    if _skip_ws(buf, pos) != len(buf):
+        raise ValueError(f"Extra data at byte {pos}")
+    return ObjectScan(spans, values)
+
+
+def _skip_ws(buf, pos: int) -> int:
+    return _WS.match(buf, pos).end()
+
+
+def _expect(buf, pos: int, char: bytes):
+    if buf[pos:pos + 1] != char:
+        found = bytes(buf[pos:pos + 1]) or b"end of file"
+        raise ValueError(f"Expected {char.decode()} at byte {pos}, found {found.decode()}")
+
+
+def _skip_string(buf, pos: int) -> int:
+    # pos is the opening quote
+    m = _STRING_REST.match(buf, pos + 1)
+    if not m:
+        raise ValueError(f"Unterminated string at byte {pos}")
+    return m.end()
+
+
+def _skip_value(buf, pos: int) -> int:
+    first = buf[pos:pos + 1]
+    if first == b'"':
+        return _skip_string(buf, pos)
+    if first not in (b"{", b"["):
+        m = _SCALAR.match(buf, pos)
+        if not m:
+            raise ValueError(f"Expected a value at byte {pos}")
+        return m.end()
+    stack = []
+    while True:
+        m = _TO_BRACKET.match(buf, pos)
+        if not m:
+            raise ValueError(f"Unterminated {first.decode()} at byte {pos}")
+        pos = m.end()
+        c = buf[pos - 1]
+        if c in _CLOSERS:
+            stack.append(_CLOSERS[c])
+        elif not stack or stack.pop() != c:
+            raise ValueError(f"Unexpected {chr(c)} at byte {pos - 1}")
+        if not stack:
+            return pos
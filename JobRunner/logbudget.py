@@ -0,0 +1,159 @@
+from threading import Lock
+from time import time as _time
+from typing import Dict, List
+
+
+class _Usage(object):
+    """
+    Log volume accounting for the whole job or a single source.
+    """
+
+    def __init__(self):
+        self.bytes = 0
+        self.window_start = 0
+        self.window_lines = 0
+        self.exhausted = False
+        self.suppressed_lines = 0
+        self.suppressed_bytes = 0
+
+    def roll_window(self, now: float):
+        if now - self.window_start >= 1:
+            self.window_start = now
+            self.window_lines = 0
+
+
+class LogBudget(object):
+    """
+    Enforces per-job and per-source (e.g. per-container) limits on the volume of container
+    output shipped to ee2.
+
+    Lines beyond the lines per second or total byte limits are dropped and summarized by a
+    "N lines / M bytes suppressed" marker line in the source's output, and lines longer than the
+    maximum line size are truncated. Once the job or a source reaches its byte limit all its
+    further output is dropped. A limit of 0 means unlimited.
+    """
+
+    def __init__(
+            self,
+            max_bytes: int = 0,
+            max_lines_per_sec: int = 0,
+            source_max_bytes: int = 0,
+            source_max_lines_per_sec: int = 0,
+            max_line_bytes: int = 0,
+    ):
+        """
+        max_bytes - the maximum total bytes of output for the job.
+        max_lines_per_sec - the maximum lines per second of output for the job.
+        source_max_bytes - the maximum total bytes of output for a single source.
+        source_max_lines_per_sec - the maximum lines per second of output for a single source.
+        max_line_bytes - the maximum size of a single line. Longer lines are truncated.
+        """
+        self.max_bytes = max_bytes
+        self.max_lines_per_sec = max_lines_per_sec
+        self.source_max_bytes = source_max_bytes
+        self.source_max_lines_per_sec = source_max_lines_per_sec
+        self.max_line_bytes = max_line_bytes
+        self._job = _Usage()
+        self._sources = dict()  # type: Dict[str, _Usage]
+        self._lock = Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(
+            self.max_bytes or self.max_lines_per_sec or self.source_max_bytes
+            or self.source_max_lines_per_sec or self.max_line_bytes
+        )
+
+    def _truncate(self, line: dict):
+        """
+        Truncate a line to the maximum line size.
+        :return: The line and its size in bytes, not counting any truncation marker.
+        """
+        data = line["line"].encode("utf-8")
+        if not self.max_line_bytes or len(data) <= self.max_line_bytes:
+            return line, len(data)
+        text = data[:self.max_line_bytes].decode("utf-8", errors="ignore")
+        line = dict(line, line=f"{text} [truncated {len(data) - self.max_line_bytes} bytes]")
+        return line, self.max_line_bytes
+
+    @staticmethod
+    def _suppressed_marker(usage: _Usage) -> dict:
+        marker = {
+            "line": f"[{usage.suppressed_lines} lines / {usage.suppressed_bytes} bytes suppressed"
+                    " by the job log limits]",
+            "is_error": 1,
+        }
+        usage.suppressed_lines = 0
+        usage.suppressed_bytes = 0
+        return marker
+
+    def _over_limit(self, usage: _Usage, size: int, max_bytes: int, max_lines_per_sec: int,
+                    name: str, out: List[dict]) -> bool:
+        # Once the byte limit is reached nothing more gets through, even lines that would fit,
+        # as the marker says
+        if usage.exhausted:
+            return True
+        if max_bytes and usage.bytes + size > max_bytes:
+            if not usage.exhausted:
+                usage.exhausted = True
+                out.append({
+                    "line": f"[{name} log limit of {max_bytes} bytes reached, "
+                            "further output will be suppressed]",
+                    "is_error": 1,
+                })
+            return True
+        return bool(max_lines_per_sec and usage.window_lines >= max_lines_per_sec)
+
+    def apply(self, lines: List[dict], source: str = None) -> List[dict]:
+        """
+        Apply the limits to lines from a source.
+        :param lines: The log lines, as passed to Logger.log_lines.
+        :param source: The source of the lines, e.g. a container or job ID.
+        :return: The lines to ship, including any truncation and suppression markers.
+        """
+        out = []
+        with self._lock:
+            usage = self._sources.setdefault(source, _Usage())
+            for line in lines:
+                line, size = self._truncate(line)
+                now = _time()
+                self._job.roll_window(now)
+                usage.roll_window(now)
+                if (self._over_limit(self._job, size, self.max_bytes, self.max_lines_per_sec,
+                                     "Job", out)
+                        or self._over_limit(usage, size, self.source_max_bytes,
+                                            self.source_max_lines_per_sec, "Container", out)):
+                    usage.suppressed_lines += 1
+                    usage.suppressed_bytes += size
+                    continue
+                if usage.suppressed_lines:
+                    out.append(self._suppressed_marker(usage))
+                out.append(line)
+                for u in (self._job, usage):
+                    u.bytes += size
+                    u.window_lines += 1
+        return out
+
+    def end(self, source: str = None) -> List[dict]:
+        """
+        Forget a source that has finished.
+        :param source: The source.
+        :return: The source's suppression marker line to ship, if any lines were suppressed
+            since the last line that was let through.
+        """
+        with self._lock:
+            usage = self._sources.pop(source, None)
+            if usage is None or not usage.suppressed_lines:
+                return []
+            return [self._suppressed_marker(usage)]
+
+    def flush(self) -> List[dict]:
+        """
+        Summarize any lines suppressed since the last line that was let through.
+        :return: The suppression marker lines to ship.
+        """
+        with self._lock:
+            return [
+                self._suppressed_marker(usage)
+                for usage in self._sources.values() if usage.suppressed_lines
+            ]
@@ -0,0 +1,88 @@
+from threading import Lock
+from typing import Dict, List
+
+
+class LogCompactor(object):
+    """
+    Folds repetitive container output before it is shipped to ee2.
+
+    Lines overwritten with carriage returns, as progress bars do, are reduced to the first and
+    last update. Runs of consecutive identical lines are reduced to the first and last
+    occurrence, with the last annotated with the number of lines omitted. Runs are tracked
+    per source, e.g. per container, so interleaved output from different containers doesn't
+    break them up.
+    """
+
+    def __init__(self):
+        self._runs = dict()  # type: Dict[str, dict]
+        self._lock = Lock()
+
+    @staticmethod
+    def _split_carriage_returns(line: dict) -> List[dict]:
+        text = line["line"]
+        if "\r" not in text:
+            return [line]
+        segments = [s for s in text.split("\r") if s.strip()]
+        if len(segments) <= 2:
+            return [dict(line, line=s) for s in segments] or [dict(line, line="")]
+        omitted = len(segments) - 2
+        return [
+            dict(line, line=segments[0]),
+            dict(line, line=f"{segments[-1]} [{omitted} progress updates omitted]"),
+        ]
+
+    @staticmethod
+    def _end_run(run: dict) -> List[dict]:
+        count = run["count"]
+        if count == 1:
+            return []
+        if count == 2:
+            return [run["last"]]
+        last = run["last"]
+        return [dict(last, line=f"{last['line']} [repeated {count} times, {count - 2} omitted]")]
+
+    def compact(self, lines: List[dict], source: str = None) -> List[dict]:
+        """
+        Compact lines from a source. The last line of a run of identical lines is held back
+        until the run ends or flush() is called.
+        :param lines: The log lines, as passed to Logger.log_lines.
+        :param source: The source of the lines, e.g. a container or job ID.
+        :return: The lines to ship.
+        """
+        out = []
+        with self._lock:
+            for line in lines:
+                for split_line in self._split_carriage_returns(line):
+                    run = self._runs.get(source)
+                    if (run is not None and run["first"]["line"] == split_line["line"]
+                            and run["first"]["is_error"] == split_line["is_error"]):
+                        run["count"] += 1
+                        run["last"] = split_line
+                        continue
+                    if run is not None:
+                        out.extend(self._end_run(run))
+                    self._runs[source] = {"first": split_line, "last": split_line, "count": 1}
+                    out.append(split_line)
+        return out
+
+    def sources(self) -> List[str]:
+        """
+        Get the sources with runs in progress.
+        """
+        with self._lock:
+            return list(self._runs)
+
+    def flush(self, source: str = None) -> List[dict]:
+        """
+        End any runs in progress.
+        :param source: The source to flush, or None to flush all sources.
+        :return: The held back lines to ship.
+        """
+        out = []
+        with self._lock:
+            sources = list(self._runs) if source is None else [source]
+            for s in sources:
+                run = self._runs.pop(s, None)
+                if run is not None:
+                    out.extend(self._end_run(run))
+        return out
@@ -1,18 +1,59 @@
 import logging
 import os
 import sys
+from collections import deque
+from threading import Condition, Thread
 from typing import List
 
 from clients.execution_engine2Client import execution_engine2
 from time import sleep as _sleep
+from time import time as _time
 
-
-# TODO: Add a buffer  we may need some flush thread too.
+from .logbudget import LogBudget
+from .logcompact import LogCompactor
+from .logspill import LogSpillJournal
+from .logstats import LogStats
 
 
 class Logger(object):
     def __init__(self, job_id: str,
-                 ee2: execution_engine2 = None):
+                 ee2: execution_engine2 = None,
+                 buffered: bool = False,
+                 batch_lines: int = 1000,
+                 batch_bytes: int = 1024 * 1024,
+                 flush_interval: float = 1.0,
+                 max_buffer_lines: int = 100000,
+                 spill_dir: str = None,
+                 spill_drain_timeout: float = 300,
+                 compact: bool = False,
+                 max_bytes: int = 0,
+                 max_lines_per_sec: int = 0,
+                 container_max_bytes: int = 0,
+                 container_max_lines_per_sec: int = 0,
+                 max_line_bytes: int = 0):
+        """
+        job_id - the ee2 job ID the log lines belong to.
+        ee2 - the ee2 client used to ship the lines. If None, lines are not shipped.
+        buffered - if True, lines are queued in memory and shipped to ee2 in batches by a
+            background flush thread rather than on the calling thread.
+        batch_lines - the maximum number of lines in a single buffered add_job_logs call.
+        batch_bytes - the approximate maximum size of a single buffered add_job_logs call.
+        flush_interval - the maximum time in seconds a buffered line waits before being shipped.
+        max_buffer_lines - the maximum number of lines held in memory. Callers wait for the
+            flush thread to catch up if the buffer is full.
+        spill_dir - if provided, lines that can't be delivered to ee2 are written to a journal
+            file in this directory and replayed when ee2 recovers, rather than retried inline.
+        spill_drain_timeout - the maximum time in seconds close() waits for the journal to be
+            replayed.
+        compact - if True, repeated lines and carriage return overwritten progress bars in
+            container output are folded before they are shipped.
+        max_bytes - the maximum bytes of container output shipped for the job. 0 is unlimited.
+        max_lines_per_sec - the maximum lines per second of container output shipped for the
+            job. 0 is unlimited.
+        container_max_bytes - as max_bytes, but per container.
+        container_max_lines_per_sec - as max_lines_per_sec, but per container.
+        max_line_bytes - container output lines longer than this are truncated. 0 is unlimited.
+        """
         self.ee2 = ee2
 
         self.job_id = job_id
@@ -21,6 +62,49 @@ class Logger(object):
         self.jr_logger.info(f"Logger initialized for {job_id}")
         self.logging_retry = True
         self.logging_retry_attempts = 60
+        self.stats = LogStats()
+
+        self.buffered = buffered
+        self.batch_lines = batch_lines
+        self.batch_bytes = batch_bytes
+        self.flush_interval = flush_interval
+        self.max_buffer_lines = max_buffer_lines
+        self._buffer = deque()
+        self._cond = Condition()
+        self._in_flight = 0
+        self._flushing = False
+        self._closed = False
+        self._flush_thread = None
+        self.compactor = LogCompactor() if compact else None
+        self.budget = LogBudget(
+            max_bytes=max_bytes,
+            max_lines_per_sec=max_lines_per_sec,
+            source_max_bytes=container_max_bytes,
+            source_max_lines_per_sec=container_max_lines_per_sec,
+            max_line_bytes=max_line_bytes,
+        )
+        if not self.budget.enabled:
+            self.budget = None
+        self.spill = None
+        self.spill_drain_timeout = spill_drain_timeout
+        if spill_dir and self.ee2:
+            self.spill = LogSpillJournal(
+                os.path.join(spill_dir, f"ee2_log_spill_{job_id}.jsonl"),
+                self._send_job_logs,
+                batch_lines=batch_lines,
+            )
+        if self.buffered:
+            self._flush_thread = Thread(target=self._flush_loop, daemon=True)
+            self._flush_thread.start()
+
+    def _send_job_logs(self, lines: List):
+        start = _time()
+        try:
+            self.ee2.add_job_logs({"job_id": self.job_id}, lines)
+        except Exception:
+            self.stats.record_ee2_call(lines, _time() - start, success=False)
+            raise
+        self.stats.record_ee2_call(lines, _time() - start, success=True)
 
     def _add_job_logs(self, lines: List):
         """
@@ -28,30 +112,197 @@ class Logger(object):
         :param lines:
         :return:
         """
+        if self.spill:
+            self._add_job_logs_or_spill(lines)
+            return
         try:
             if self.ee2:
-                self.ee2.add_job_logs({"job_id": self.job_id}, lines)
+                self._send_job_logs(lines)
         except Exception:
             if self.logging_retry:
                 _sleep(1)
                 self.logging_retry_attempts -= 1
+                self.stats.record_retry()
                 if self.ee2:
-                    self.ee2.add_job_logs({"job_id": self.job_id}, lines)
+                    self._send_job_logs(lines)
                 if self.logging_retry_attempts == 0:
                     self.logging_retry = False
 
-    def log_lines(self, lines: List):
+    def _add_job_logs_or_spill(self, lines: List):
+        """
+        Send lines to ee2, or to the spill journal if ee2 is failing. Never blocks on retries.
+        """
+        if self.spill.pending:
+            # keep the lines in order behind the ones waiting to be replayed
+            self.spill.append(lines)
+            self.stats.record_spill(lines)
+            return
+        try:
+            self._send_job_logs(lines)
+        except Exception as e:
+            self.jr_logger.warning(
+                f"Failed to send {len(lines)} log lines to ee2, spilling to disk: {e}")
+            self.spill.append(lines)
+            self.stats.record_spill(lines)
+
+    def _next_batch(self) -> List:
+        """
+        Pop the next batch of lines off the buffer, bounded by line count and size.
+        Must be called with the condition held.
+        """
+        batch = []
+        size = 0
+        while self._buffer and len(batch) < self.batch_lines:
+            line_size = len(self._buffer[0]["line"])
+            if batch and size + line_size > self.batch_bytes:
+                break
+            batch.append(self._buffer.popleft())
+            size += line_size
+        return batch
+
+    def _flush_loop(self):
+        """
+        Ship buffered lines to ee2 until the logger is closed and the buffer is drained.
+        """
+        while True:
+            with self._cond:
+                deadline = _time() + self.flush_interval
+                while (not self._closed and not self._flushing
+                       and len(self._buffer) < self.batch_lines):
+                    remaining = deadline - _time()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._closed and not self._buffer:
+                    return
+                batch = self._next_batch()
+                if not self._buffer:
+                    self._flushing = False
+                self._in_flight = len(batch)
+                # wake up any producers waiting for buffer space
+                self._cond.notify_all()
+            try:
+                if batch:
+                    self._add_job_logs(batch)
+            except Exception as e:
+                self.jr_logger.error(f"Failed to ship {len(batch)} log lines to ee2: {e}")
+            finally:
+                with self._cond:
+                    self._in_flight = 0
+                    self._cond.notify_all()
+
+    def _ship(self, lines: List):
+        """
+        Send lines to ee2, either directly or via the flush thread in buffered mode.
+        """
+        if not self.buffered or self._closed:
+            self._add_job_logs(lines)
+            return
+        with self._cond:
+            for line in lines:
+                while len(self._buffer) >= self.max_buffer_lines and not self._closed:
+                    self._cond.wait()
+                self._buffer.append(line)
+            if len(self._buffer) >= self.batch_lines:
+                self._cond.notify_all()
+
+    def _flush_pipeline(self):
+        """
+        Ship any lines held back by the compaction and limit stages.
+        """
+        lines = []
+        if self.compactor:
+            for source in self.compactor.sources():
+                flushed = self.compactor.flush(source)
+                if self.budget:
+                    flushed = self.budget.apply(flushed, source=source)
+                lines.extend(flushed)
+        if self.budget:
+            lines.extend(self.budget.flush())
+        if lines:
+            self._ship(lines)
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Wait for all buffered lines to be shipped to ee2.
+        :param timeout: The maximum time to wait in seconds, or None to wait forever.
+        :return: True if the buffer was drained, False if the timeout expired.
+        """
+        self._flush_pipeline()
+        if not self.buffered:
+            return True
+        deadline = None if timeout is None else _time() + timeout
+        with self._cond:
+            self._flushing = True
+            self._cond.notify_all()
+            while self._buffer or self._in_flight:
+                if not self._flush_thread.is_alive():
+                    return False
+                if deadline is None:
+                    self._cond.wait(self.flush_interval)
+                else:
+                    remaining = deadline - _time()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(min(remaining, self.flush_interval))
+        return True
+
+    def close(self, timeout: float = None):
+        """
+        Flush any buffered lines, stop the flush thread and wait for any spilled lines to be
+        replayed to ee2. Lines logged after the logger is closed are shipped synchronously.
+        :param timeout: The maximum time to wait for the flush thread in seconds.
+        """
+        self._flush_pipeline()
+        if self.buffered and not self._closed:
+            self.flush(timeout=timeout)
+            with self._cond:
+                self._closed = True
+                self._cond.notify_all()
+            self._flush_thread.join(timeout)
+        if self.spill and self.spill.pending:
+            if not self.spill.drain(timeout=self.spill_drain_timeout):
+                self.jr_logger.error(
+                    f"Log lines for job {self.job_id} could not be delivered to ee2 and "
+                    f"remain in {self.spill.path}")
+
+    def log_lines(self, lines: List, source: str = None):
         """
         Wrapper for logging multiple logs at once, at various log levels
         :param lines: The lines to log
+        :param source: The job ID of the container that produced the lines, if any
         """
         if self.debug:  # pragma: no cover
             for line in lines:
                 if line["is_error"]:
-                    sys.stderr.write(line + "\n")
+                    sys.stderr.write(line["line"] + "\n")
                 else:
                     self.jr_logger.info(line["line"])
-        self._add_job_logs(lines)
+        start = _time()
+        shipped = lines
+        if self.compactor:
+            shipped = self.compactor.compact(shipped, source=source)
+        if self.budget:
+            shipped = self.budget.apply(shipped, source=source)
+        if shipped:
+            self._ship(shipped)
+        self.stats.record_lines(lines, source=source, seconds=_time() - start)
+
+    def end_source(self, source: str):
+        """
+        Ship any lines held back for a source that has finished, e.g. the last line of a run of
+        repeated lines, and forget the source's compaction and limit state.
+        :param source: The job ID of the container, as passed to log_lines
+        """
+        lines = []
+        if self.compactor:
+            lines = self.compactor.flush(source)
+            if self.budget:
+                lines = self.budget.apply(lines, source=source)
+        if self.budget:
+            lines.extend(self.budget.end(source))
+        if lines:
+            self._ship(lines)
 
     def log(self, line: str, ts=None):
         """
@@ -63,8 +314,9 @@ class Logger(object):
             self.jr_logger.info(line)
         log_line = {"line": line, "is_error": 0}
         if ts:
-            line["ts"] = ts
-        self._add_job_logs([log_line])
+            log_line["ts"] = ts
+        self._ship([log_line])
+        self.stats.record_lines([log_line])
 
     def error(self, line: str, ts=None):
         """
@@ -74,6 +326,7 @@ class Logger(object):
         """
         log_line = {"line": line, "is_error": 1}
         if ts:
-            line["ts"] = ts
+            log_line["ts"] = ts
         self.jr_logger.error(line)
-        self._add_job_logs([log_line])
+        self._ship([log_line])
+        self.stats.record_lines([log_line])
@@ -0,0 +1,146 @@
+import json
+import logging
+import os
+from threading import Event, Lock, Thread
+from time import time as _time
+from typing import Callable, List
+
+
+class LogSpillJournal(object):
+    """
+    An append-only file of log lines that could not be delivered to ee2.
+
+    Lines are appended while ee2 is unreachable and a replay thread sends them back to ee2, in
+    order, with exponential backoff between failed attempts. Once the journal is fully replayed
+    the file is truncated. Only one batch of lines is ever held in memory.
+    """
+
+    def __init__(
+            self,
+            path: str,
+            send: Callable[[List], None],
+            batch_lines: int = 1000,
+            initial_backoff: float = 1.0,
+            max_backoff: float = 60.0,
+    ):
+        """
+        path - the path to the journal file.
+        send - a function that delivers a list of log lines to ee2, raising on failure.
+        batch_lines - the maximum number of lines replayed in a single call to send.
+        initial_backoff - the wait in seconds after the first failed replay attempt.
+        max_backoff - the maximum wait in seconds between replay attempts.
+        """
+        self.path = path
+        self.send = send
+        self.batch_lines = batch_lines
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.jr_logger = logging.getLogger("jr")
+        self._lock = Lock()
+        self._offset = 0
+        self._pending = False
+        self._drained = Event()
+        self._drained.set()
+        self._wake = Event()
+        self._replay_thread = None
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            # left over from a previous runner process, e.g. after a crash
+            self._pending = True
+            self._drained.clear()
+            self._start_replay()
+
+    @property
+    def pending(self) -> bool:
+        """
+        True if the journal contains lines that haven't been delivered to ee2.
+        """
+        return self._pending
+
+    def append(self, lines: List):
+        """
+        Append lines to the journal and make sure the replay thread is running.
+        """
+        with self._lock:
+            with open(self.path, "a") as f:
+                for line in lines:
+                    f.write(json.dumps(line) + "\n")
+            if not self._pending:
+                self._pending = True
+                self._drained.clear()
+                self._start_replay()
+
+    def _start_replay(self):
+        # Must be called with the lock held, or from the constructor.
+        if self._replay_thread is None or not self._replay_thread.is_alive():
+            self._replay_thread = Thread(target=self._replay_loop, daemon=True)
+            self._replay_thread.start()
+
+    def _read_batch(self):
+        """
+        Read the next batch of lines from the journal.
+        :return: The lines and the file offset after the last line read.
+        """
+        lines = []
+        with open(self.path) as f:
+            f.seek(self._offset)
+            offset = self._offset
+            while len(lines) < self.batch_lines:
+                raw = f.readline()
+                if not raw.endswith("\n"):
+                    # empty or a partial write
+                    break
+                try:
+                    lines.append(json.loads(raw))
+                except ValueError:
+                    self.jr_logger.error(f"Skipping corrupt line in {self.path}: {raw!r}")
+                offset = f.tell()
+            return lines, offset
+
+    def _replay_loop(self):
+        backoff = self.initial_backoff
+        while True:
+            with self._lock:
+                lines, offset = self._read_batch()
+                if not lines and offset != self._offset:
+                    # only corrupt lines in this batch
+                    self._offset = offset
+                    continue
+                if not lines:
+                    # Everything has been delivered, start over with an empty journal
+                    with open(self.path, "w"):
+                        pass
+                    self._offset = 0
+                    self._pending = False
+                    self._drained.set()
+                    return
+            try:
+                self.send(lines)
+            except Exception as e:
+                self.jr_logger.warning(
+                    f"ee2 log replay failed, retrying in {backoff} seconds: {e}")
+                self._wake.wait(backoff)
+                self._wake.clear()
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+            backoff = self.initial_backoff
+            with self._lock:
+                self._offset = offset
+
+    def drain(self, timeout: float = None) -> bool:
+        """
+        Wait for the journal to be fully replayed to ee2. Any pending backoff is cut short so
+        replay is attempted immediately.
+        :param timeout: The maximum time to wait in seconds, or None to wait forever.
+        :return: True if the journal was drained, False if the timeout expired.
+        """
+        deadline = None if timeout is None else _time() + timeout
+        self._wake.set()
+        while not self._drained.is_set():
+            if self._replay_thread is None or not self._replay_thread.is_alive():
+                return not self._pending
+            wait = 1.0 if deadline is None else min(1.0, deadline - _time())
+            if wait <= 0:
+                return False
+            self._drained.wait(wait)
+        return True
@@ -0,0 +1,151 @@
+from bisect import bisect_left
+from threading import Lock
+from typing import Dict, List
+
+
+# Upper bounds, in seconds, of the ee2 call latency histogram buckets
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class LatencyHistogram(object):
+    """
+    A latency histogram with fixed buckets. Bucket counts are not cumulative, and the last
+    bucket counts observations above the largest bound.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate a quantile as the upper bound of the bucket it falls in.
+        """
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= target:
+                return bound
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            "buckets": list(self.buckets),
+            "counts": list(self.counts),
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+        }
+
+
+class LogStats(object):
+    """
+    Counters for the log pipeline: lines and bytes produced per job and per source
+    (e.g. per container), how long each source was blocked logging them, lines and bytes
+    delivered to ee2, and ee2 call latency, failures and retries.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.lines = 0
+        self.bytes = 0
+        self.sources = dict()  # type: Dict[str, dict]
+        self.blocked = dict()  # type: Dict[str, LatencyHistogram]
+        self.shipped_lines = 0
+        self.shipped_bytes = 0
+        self.ee2_calls = 0
+        self.ee2_failures = 0
+        self.ee2_retries = 0
+        self.spilled_lines = 0
+        self.latency = LatencyHistogram()
+
+    def record_lines(self, lines: List[dict], source: str = None, seconds: float = 0.0):
+        """
+        Record lines produced by the job or one of its containers, before any compaction
+        or limits are applied.
+        :param lines: The lines.
+        :param source: The source of the lines, e.g. a container's job ID.
+        :param seconds: How long the source was blocked logging the lines.
+        """
+        size = sum(len(line["line"]) for line in lines)
+        with self._lock:
+            self.lines += len(lines)
+            self.bytes += size
+            if source is not None:
+                counts = self.sources.setdefault(source, {"lines": 0, "bytes": 0})
+                counts["lines"] += len(lines)
+                counts["bytes"] += size
+                self.blocked.setdefault(source, LatencyHistogram()).observe(seconds)
+
+    def record_ee2_call(self, lines: List[dict], seconds: float, success: bool):
+        with self._lock:
+            self.ee2_calls += 1
+            self.latency.observe(seconds)
+            if success:
+                self.shipped_lines += len(lines)
+                self.shipped_bytes += sum(len(line["line"]) for line in lines)
+            else:
+                self.ee2_failures += 1
+
+    def record_retry(self):
+        with self._lock:
+            self.ee2_retries += 1
+
+    def record_spill(self, lines: List[dict]):
+        with self._lock:
+            self.spilled_lines += len(lines)
+
+    def snapshot(self) -> dict:
+        """
+        Get a copy of the current counters.
+        """
+        with self._lock:
+            return {
+                "lines": self.lines,
+                "bytes": self.bytes,
+                "sources": {
+                    s: dict(c, blocked=self.blocked[s].to_dict())
+                    for s, c in self.sources.items()
+                },
+                "shipped_lines": self.shipped_lines,
+                "shipped_bytes": self.shipped_bytes,
+                "ee2_calls": self.ee2_calls,
+                "ee2_failures": self.ee2_failures,
+                "ee2_retries": self.ee2_retries,
+                "spilled_lines": self.spilled_lines,
+                "ee2_latency": self.latency.to_dict(),
+            }
+
+    def summary(self) -> List[str]:
+        """
+        Get a human readable summary of the counters, one entry per line.
+        """
+        with self._lock:
+            lat = self.latency
+            mean = lat.sum / lat.count if lat.count else 0.0
+            out = [
+                f"Log lines: {self.lines} produced ({self.bytes} bytes), "
+                f"{self.shipped_lines} shipped to ee2 ({self.shipped_bytes} bytes), "
+                f"{self.spilled_lines} spilled to disk",
+                f"ee2 add_job_logs: {self.ee2_calls} calls, {self.ee2_failures} failures, "
+                f"{self.ee2_retries} retries, {lat.sum:.3f}s total, mean {mean:.3f}s, "
+                f"p50 <= {lat.quantile(0.5)}s, p95 <= {lat.quantile(0.95)}s, max {lat.max:.3f}s",
+            ]
+            for source, counts in sorted(self.sources.items()):
+                blocked = self.blocked[source]
+                out.append(
+                    f"Container {source}: {counts['lines']} lines ({counts['bytes']} bytes), "
+                    f"blocked {blocked.sum:.3f}s logging, max {blocked.max:.3f}s")
+        return out
@@ -0,0 +1,138 @@
+from threading import Lock
+from typing import Dict, Iterable, List, Tuple
+
+from .logstats import LatencyHistogram
+
+# Upper bounds, in seconds, of the image pull duration histogram buckets
+PULL_BUCKETS = (1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+# The Prometheus text exposition format content type
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class ContainerStats(object):
+    """
+    Counters for a container runner: containers started and exited, and image pull durations.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.starts = 0
+        self.exits = 0
+        self.pulls = LatencyHistogram(PULL_BUCKETS)
+
+    def record_start(self):
+        with self._lock:
+            self.starts += 1
+
+    def record_exit(self):
+        with self._lock:
+            self.exits += 1
+
+    def record_pull(self, seconds: float):
+        with self._lock:
+            self.pulls.observe(seconds)
+
+    def snapshot(self) -> dict:
+        """
+        Get a copy of the current counters.
+        """
+        with self._lock:
+            return {
+                "starts": self.starts,
+                "exits": self.exits,
+                "pulls": self.pulls.to_dict(),
+            }
+
+
+class RPCStats(object):
+    """
+    Counters for the callback server's JSON-RPC requests: requests and errors, and latency,
+    per method.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.requests = dict()  # type: Dict[str, int]
+        self.errors = dict()  # type: Dict[str, int]
+        self.latency = dict()  # type: Dict[str, LatencyHistogram]
+
+    def record(self, method: str, seconds: float, error: bool):
+        with self._lock:
+            self.requests[method] = self.requests.get(method, 0) + 1
+            if error:
+                self.errors[method] = self.errors.get(method, 0) + 1
+            self.latency.setdefault(method, LatencyHistogram()).observe(seconds)
+
+    def snapshot(self) -> dict:
+        """
+        Get a copy of the current counters.
+        """
+        with self._lock:
+            return {
+                method: {
+                    "requests": n,
+                    "errors": self.errors.get(method, 0),
+                    "latency": self.latency[method].to_dict(),
+                }
+                for method, n in self.requests.items()
+            }
+
+
+class Metric(object):
+    """
+    A metric to expose, with its samples.
+    """
+
+    def __init__(self, name: str, mtype: str, help_: str):
+        """
+        name - the metric name.
+        mtype - the Prometheus metric type, "counter", "gauge" or "histogram".
+        help_ - the metric's description.
+        """
+        self.name = name
+        self.mtype = mtype
+        self.help = help_
+        self.samples = []  # type: List[Tuple[str, dict, float]]
+
+    def add(self, value: float, **labels):
+        """
+        Add a sample of a counter or gauge.
+        """
+        self.samples.append((self.name, labels, value))
+        return self
+
+    def add_histogram(self, histogram: dict, **labels):
+        """
+        Add a histogram's samples.
+        :param histogram: The histogram, as from LatencyHistogram.to_dict.
+        """
+        # LatencyHistogram buckets aren't cumulative, and the last counts the overflow
+        seen = 0
+        for bound, n in zip(histogram["buckets"], histogram["counts"]):
+            seen += n
+            self.samples.append((self.name + "_bucket", dict(labels, le=repr(bound)), seen))
+        self.samples.append((self.name + "_bucket", dict(labels, le="+Inf"), histogram["count"]))
+        self.samples.append((self.name + "_sum", labels, histogram["sum"]))
+        self.samples.append((self.name + "_count", labels, histogram["count"]))
+        return self
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render(metrics: Iterable[Metric]) -> str:
+    """
+    Render metrics in the Prometheus text exposition format.
+    """
+    out = []
+    for m in metrics:
+        out.append(f"# HELP {m.name} {m.help}")
+        out.append(f"# TYPE {m.name} {m.mtype}")
+        for name, labels, value in m.samples:
+            if labels:
+                label_str = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+                name = f"{name}{{{label_str}}}"
+            out.append(f"{name} {value}")
+    return "\n".join(out) + "\n"
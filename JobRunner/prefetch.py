@@ -0,0 +1,71 @@
+import json
+import logging
+import os
+from threading import Lock
+from typing import List, Tuple
+
+
+class SubjobHistory(object):
+    """
+    Records the modules each app ran as subjobs, so their images can be prefetched the next
+    time the app runs.
+
+    The history is a JSON file mapping app IDs to lists of [module, service version] pairs,
+    most recently used first. It is shared between jobs on the same host and rewritten
+    atomically, so concurrent jobs may lose each other's updates but never corrupt the file.
+    """
+
+    def __init__(self, path: str, max_modules: int = 5):
+        """
+        path - the path of the history file.
+        max_modules - the maximum number of modules to remember per app.
+        """
+        self.path = path
+        self.max_modules = max_modules
+        self._lock = Lock()
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path) as f:
+                history = json.load(f)
+            return history if isinstance(history, dict) else {}
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logging.warning(f"Couldn't read subjob history {self.path}: {e}")
+            return {}
+
+    def get(self, app_id: str) -> List[Tuple[str, str]]:
+        """
+        Get the modules the app recently ran as subjobs.
+        :param app_id: The app ID.
+        :return: A list of (module, service version) pairs, most recently used first.
+        """
+        with self._lock:
+            entries = self._load().get(app_id, [])
+        return [tuple(e) for e in entries if isinstance(e, list) and len(e) == 2]
+
+    def record(self, app_id: str, modules: List[Tuple[str, str]]):
+        """
+        Add the modules a run of the app used as subjobs to the app's history.
+        :param app_id: The app ID.
+        :param modules: (module, service version) pairs, in the order they were used.
+        """
+        if not modules:
+            return
+        with self._lock:
+            history = self._load()
+            entries = [list(m) for m in reversed(modules)]
+            entries += history.get(app_id, [])
+            seen = set()
+            history[app_id] = [
+                e for e in entries if not (tuple(e) in seen or seen.add(tuple(e)))
+            ][:self.max_modules]
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                with open(tmp, "w") as f:
+                    json.dump(history, f)
+                os.replace(tmp, self.path)
+            except Exception as e:
+                logging.warning(f"Couldn't write subjob history {self.path}: {e}")
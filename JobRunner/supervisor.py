@@ -0,0 +1,304 @@
+import codecs
+import logging
+import os
+import selectors
+from concurrent.futures import ThreadPoolExecutor
+from math import inf
+from select import select
+from threading import Lock, Thread
+from time import monotonic as _monotonic
+from time import sleep as _sleep
+from typing import Generator, List
+
+
+def run_blocking(gen: Generator):
+    """
+    Run a monitor to completion on the current thread rather than under a supervisor.
+    """
+    try:
+        wait = next(gen)
+        while True:
+            if isinstance(wait, Offload):
+                try:
+                    result = wait()
+                except Exception as e:
+                    wait = gen.throw(e)
+                    continue
+                wait = gen.send(result)
+                continue
+            if isinstance(wait, tuple):
+                files, wait = wait
+                ready = select(files, [], [], wait)[0] or None
+            else:
+                _sleep(wait or 0)
+                ready = None
+            wait = gen.send(ready)
+    except StopIteration:
+        pass
+
+
+class Offload(object):
+    """
+    A blocking call, e.g. to the docker daemon or ee2, for a monitor to yield. The supervisor
+    runs it on a worker thread so other monitors aren't held up.
+    """
+
+    def __init__(self, fn, *args, **kwargs):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+
+    def __call__(self):
+        return self.fn(*self.args, **self.kwargs)
+
+
+class PipeReader(object):
+    """
+    Reads log lines from a subprocess pipe without blocking, for monitors. Can be yielded as a
+    file to wait for.
+    """
+
+    def __init__(self, f, is_error: int):
+        """
+        f - the pipe.
+        is_error - the is_error value of the lines read.
+        """
+        self.file = f
+        self.is_error = is_error
+        self.eof = False
+        os.set_blocking(f.fileno(), False)
+        # Reads may end inside a multibyte character or a line, so decode incrementally and
+        # carry the partial last line over to the next read
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._partial = ""
+
+    def fileno(self) -> int:
+        return self.file.fileno()
+
+    def read(self, size: int = 65536) -> List[dict]:
+        """
+        Read what's available.
+        :return: The complete lines read. The last line is returned at the end of the output
+            even if it isn't terminated.
+        """
+        try:
+            data = os.read(self.fileno(), size)
+        except BlockingIOError:
+            return []
+        if not data:
+            self.eof = True
+            return self.flush()
+        *complete, self._partial = (self._partial + self._decoder.decode(data)).split("\n")
+        return [{"line": line, "is_error": self.is_error} for line in complete]
+
+    def flush(self) -> List[dict]:
+        """
+        Get the unterminated last line, if any.
+        """
+        line, self._partial = self._partial + self._decoder.decode(b"", final=True), ""
+        return [{"line": line, "is_error": self.is_error}] if line else []
+
+
+def capture_output(p, log_lines):
+    """
+    Pass a subprocess's stdout and stderr lines to log_lines, on a worker thread, until the
+    process exits and its output is drained. For monitors to run with yield from.
+    :param p: The process, with piped stdout and stderr.
+    :param log_lines: A function to call with each batch of lines.
+    """
+    readers = [PipeReader(p.stdout, 0), PipeReader(p.stderr, 1)]
+    last = False
+    while not all(r.eof for r in readers):
+        ready = yield [r for r in readers if not r.eof], 1
+        # Only read what's available so other monitors aren't blocked
+        lines = [line for r in ready or [] for line in r.read()]
+        if lines:
+            yield Offload(log_lines, lines)
+        if last and not ready:
+            break
+        last = p.poll() is not None
+    lines = [line for r in readers for line in r.flush()]
+    if lines:
+        yield Offload(log_lines, lines)
+
+
+class Task(object):
+    """
+    A monitor running under a Supervisor.
+    """
+
+    def __init__(self, supervisor, gen: Generator, on_error=None):
+        self._supervisor = supervisor
+        self.gen = gen
+        self.on_error = on_error
+        self.due = 0.0
+        self.files = []
+        self.ready = []
+        self.future = None
+
+    def wake(self):
+        """
+        Resume the task as soon as possible rather than waiting for its timeout.
+        """
+        self._supervisor._wake(self)
+
+
+class Supervisor(object):
+    """
+    Runs container monitors, e.g. log capture and exit detection, for any number of containers
+    from a single thread.
+
+    A monitor is a generator. Each time it yields it is suspended until it is resumed by the
+    supervisor:
+    * yielding a number of seconds resumes it after that time, or sooner if Task.wake() is
+      called.
+    * yielding a (files, seconds) tuple also resumes it when any of the files is readable. The
+      readable files are sent back as the value of the yield.
+    * yielding an Offload resumes it when the call has been run on a worker thread. The
+      result is sent back as the value of the yield, or the exception raised there.
+    The monitor finishes by returning. If it raises instead, the on_error function it was
+    spawned with is called with the exception, so that its job can still be reported as
+    finished. The supervisor thread is started when a monitor is spawned and exits when no
+    monitors are left, so an idle supervisor costs nothing.
+
+    Monitors share the thread, so they must not block for long between yields. Blocking calls
+    should be yielded as an Offload.
+    """
+
+    def __init__(self, name: str = "supervisor", workers: int = 8):
+        """
+        name - the name of the supervisor thread.
+        workers - the maximum number of worker threads running offloaded calls.
+        """
+        self.name = name
+        self.workers = workers
+        self._pool = None
+        self._lock = Lock()
+        self._tasks = []  # type: List[Task]
+        self._new = []  # type: List[Task]
+        self._woken = set()
+        self._selector = None
+        self._wake_r = None
+        self._wake_w = None
+        self._thread = None
+
+    @property
+    def active(self) -> int:
+        """
+        The number of monitors that haven't finished.
+        """
+        with self._lock:
+            return len(self._tasks) + len(self._new)
+
+    def spawn(self, gen: Generator, on_error=None) -> Task:
+        """
+        Start running a monitor.
+        :param gen: The monitor generator.
+        :param on_error: A function to call with the exception if the monitor fails.
+        :return: The task running the monitor.
+        """
+        task = Task(self, gen, on_error)
+        with self._lock:
+            self._new.append(task)
+            if self._thread is None:
+                self._selector = selectors.DefaultSelector()
+                self._wake_r, self._wake_w = os.pipe()
+                os.set_blocking(self._wake_w, False)
+                self._selector.register(self._wake_r, selectors.EVENT_READ)
+                self._thread = Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+            else:
+                self._notify()
+        return task
+
+    def _notify(self):
+        # Must be called with the lock held.
+        try:
+            os.write(self._wake_w, b"x")
+        except BlockingIOError:
+            pass
+
+    def _wake(self, task: Task):
+        with self._lock:
+            if self._thread is not None:
+                self._woken.add(task)
+                self._notify()
+
+    def _step(self, task: Task, now: float) -> bool:
+        """
+        Resume a task.
+        :return: False if the task finished.
+        """
+        for f in task.files:
+            self._selector.unregister(f)
+        ready, task.files, task.ready = task.ready, [], []
+        future, task.future = task.future, None
+        try:
+            if future is None:
+                wait = task.gen.send(ready if ready else None)
+            elif future.exception() is not None:
+                wait = task.gen.throw(future.exception())
+            else:
+                wait = task.gen.send(future.result())
+        except StopIteration:
+            return False
+        except Exception as e:
+            logging.exception("Container monitor failed")
+            if task.on_error is not None:
+                try:
+                    task.on_error(e)
+                except Exception:
+                    logging.exception("Container monitor failure handler failed")
+            return False
+        if isinstance(wait, Offload):
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix=self.name)
+            task.future = self._pool.submit(wait)
+            task.future.add_done_callback(lambda _: self._wake(task))
+            task.due = inf
+            return True
+        if isinstance(wait, tuple):
+            files, wait = wait
+            for f in files:
+                self._selector.register(f, selectors.EVENT_READ, task)
+            task.files = list(files)
+        task.due = now + (wait or 0)
+        return True
+
+    @staticmethod
+    def _runnable(task: Task, now: float, woken: set) -> bool:
+        if task.future is not None:
+            return task.future.done()
+        return bool(task.ready) or task.due <= now or task in woken
+
+    def _run(self):
+        while True:
+            with self._lock:
+                self._tasks.extend(self._new)
+                self._new = []
+                woken, self._woken = self._woken, set()
+                if not self._tasks:
+                    # Clean up. A later spawn starts a new thread.
+                    self._selector.close()
+                    os.close(self._wake_r)
+                    os.close(self._wake_w)
+                    if self._pool is not None:
+                        self._pool.shutdown(wait=False)
+                        self._pool = None
+                    self._thread = None
+                    return
+            now = _monotonic()
+            self._tasks = [
+                t for t in self._tasks
+                if not self._runnable(t, now, woken) or self._step(t, now)
+            ]
+            if not self._tasks:
+                continue
+            due = min(t.due for t in self._tasks)
+            # Tasks waiting on offloaded calls are woken when the calls finish
+            timeout = None if due == inf else max(0.0, due - _monotonic())
+            for key, _ in self._selector.select(timeout):
+                if key.fileobj == self._wake_r:
+                    os.read(self._wake_r, 4096)
+                else:
+                    key.data.ready.append(key.fileobj)
@@ -15,6 +15,11 @@ import traceback as _traceback
 from requests.exceptions import ConnectionError
 from urllib3.exceptions import ProtocolError
 
+try:
+    from . import jsoncodec as _jsoncodec
+except ImportError:
+    import jsoncodec as _jsoncodec
+
 
 try:
     from configparser import ConfigParser as _ConfigParser  # py 3
@@ -31,6 +36,8 @@ _CT = "content-type"
 _AJ = "application/json"
 _URL_SCHEME = frozenset(["http", "https"])
 _CHECK_JOB_RETRYS = 3
+# Servers that support waiting in _check_job advertise the longest wait in this header
+_CHECK_JOB_MAX_WAIT_HEADER = "X-Check-Job-Max-Wait"
 
 
 def _get_token(user_id, password, auth_svc):
@@ -105,13 +112,45 @@ class ServerError(Exception):
         )
 
 
-class _JSONObjectEncoder(_json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, set):
-            return list(obj)
-        if isinstance(obj, frozenset):
-            return list(obj)
-        return _json.JSONEncoder.default(self, obj)
+class RawJSON(object):
+    """
+    Already encoded JSON, which is sent as is rather than being encoded again.
+    """
+
+    def __init__(self, data):
+        """
+        data - the JSON as bytes.
+        """
+        self.data = data
+
+
+# Marks where RawJSON values go in an encoded request
+_RAW_PLACEHOLDER = "__raw_json_%s_" % _random.getrandbits(64)
+
+
+def _encode(obj):
+    """
+    Encode an object as JSON, splicing in any RawJSON values.
+    """
+    raw_values = []
+
+    def placeholder(o):
+        # RawJSON values are replaced with placeholders and collected
+        if isinstance(o, RawJSON):
+            raw_values.append(o)
+            return _RAW_PLACEHOLDER + str(len(raw_values) - 1)
+        raise TypeError("Object of type %s is not JSON serializable" % type(o).__name__)
+
+    body = _jsoncodec.dumps(obj, default=placeholder)
+    if not raw_values:
+        return body
+    pieces = body.split(b'"' + _RAW_PLACEHOLDER.encode("utf-8"))
+    out = [pieces[0]]
+    for piece in pieces[1:]:
+        index, rest = piece.split(b'"', 1)
+        out.append(raw_values[int(index)].data)
+        out.append(rest)
+    return b"".join(out)
 
 
 class BaseClient(object):
@@ -167,6 +206,8 @@ class BaseClient(object):
         self.async_job_check_time = async_job_check_time_ms / 1000.0
         self.async_job_check_time_scale_percent = async_job_check_time_scale_percent
         self.async_job_check_max_time = async_job_check_max_time_ms / 1000.0
+        # Server url -> the longest _check_job wait it supports, in seconds
+        self._check_job_max_wait = dict()
         # token overrides user_id and password
         if token is not None:
             self._headers["AUTHORIZATION"] = token
@@ -201,7 +242,7 @@ class BaseClient(object):
                 raise ValueError("context is not type dict as required.")
             arg_hash["context"] = context
 
-        body = _json.dumps(arg_hash, cls=_JSONObjectEncoder)
+        body = _encode(arg_hash)
         ret = _requests.post(
             url,
             data=body,
@@ -210,9 +251,14 @@ class BaseClient(object):
             verify=not self.trust_all_ssl_certificates,
         )
         ret.encoding = "utf-8"
+        if _CHECK_JOB_MAX_WAIT_HEADER in ret.headers:
+            try:
+                self._check_job_max_wait[url] = float(ret.headers[_CHECK_JOB_MAX_WAIT_HEADER])
+            except ValueError:
+                pass
         if ret.status_code == 500:
             if ret.headers.get(_CT) == _AJ:
-                err = ret.json()
+                err = _jsoncodec.loads(ret.content)
                 if "error" in err:
                     raise ServerError(**err["error"])
                 else:
@@ -221,7 +267,7 @@ class BaseClient(object):
                 raise ServerError("Unknown", 0, ret.text)
         if not ret.ok:
             ret.raise_for_status()
-        resp = ret.json()
+        resp = _jsoncodec.loads(ret.content)
         if "result" not in resp:
             raise ServerError("Unknown", 0, "An unknown server error occurred")
         if not resp["result"]:
@@ -248,8 +294,11 @@ class BaseClient(object):
             context["service_ver"] = service_ver
         return context
 
-    def _check_job(self, service, job_id):
-        return self._call(self.url, service + "._check_job", [job_id])
+    def _check_job(self, service, job_id, wait=None):
+        params = [job_id]
+        if wait:
+            params.append({"wait": wait})
+        return self._call(self.url, service + "._check_job", params)
 
     def _submit_job(self, service_method, args, service_ver=None, context=None):
         context = self._set_up_context(service_ver, context)
@@ -272,15 +321,21 @@ class BaseClient(object):
         async_job_check_time = self.async_job_check_time
         check_job_failures = 0
         while check_job_failures < _CHECK_JOB_RETRYS:
-            time.sleep(async_job_check_time)
-            async_job_check_time = (
-                async_job_check_time * self.async_job_check_time_scale_percent / 100.0
-            )
-            if async_job_check_time > self.async_job_check_max_time:
-                async_job_check_time = self.async_job_check_max_time
+            # If the server supports it, have it hold the check open until the job finishes
+            # rather than polling
+            wait = self._check_job_max_wait.get(self.url)
+            if wait:
+                wait = min(wait, self.timeout / 2.0)
+            else:
+                time.sleep(async_job_check_time)
+                async_job_check_time = (
+                    async_job_check_time * self.async_job_check_time_scale_percent / 100.0
+                )
+                if async_job_check_time > self.async_job_check_max_time:
+                    async_job_check_time = self.async_job_check_max_time
 
             try:
-                job_state = self._check_job(mod, job_id)
+                job_state = self._check_job(mod, job_id, wait=wait)
             except (ConnectionError, ProtocolError):
                 _traceback.print_exc()
                 check_job_failures += 1
@@ -0,0 +1,112 @@
+"""
+The JSON codec for RPC request and response bodies, shared by the service clients and the
+callback server.
+
+The standard library json module is used by default. Setting the JR_JSON_CODEC environment
+variable to "orjson" opts in to orjson, which must be installed separately. Either way sets and
+frozensets are encoded as lists, NaN and infinite floats are encoded as the NaN, Infinity and
+-Infinity tokens the json module uses, and bodies are always bytes.
+"""
+import json as _json
+import math as _math
+import os as _os
+
+try:
+    import orjson as _orjson
+except ImportError:
+    _orjson = None
+
+CODECS = ("json", "orjson")
+
+
+def available():
+    """
+    Get the names of the codecs that can be used in this environment.
+    """
+    return [c for c in CODECS if c != "orjson" or _orjson is not None]
+
+
+def set_codec(name):
+    """
+    Pick the codec to use.
+    :param name: The name of the codec, one of CODECS.
+    :raises ValueError: if the codec is unknown or not installed.
+    """
+    global _codec
+    if name not in available():
+        raise ValueError("JSON codec %s is not available" % name)
+    _codec = name
+
+
+def get_codec():
+    """
+    Get the name of the codec in use.
+    """
+    return _codec
+
+
+def _default_encoder(default):
+    def encode(obj):
+        if isinstance(obj, (set, frozenset)):
+            return list(obj)
+        if default is not None:
+            return default(obj)
+        raise TypeError("Object of type %s is not JSON serializable" % type(obj).__name__)
+    return encode
+
+
+def _has_nonfinite(obj):
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if isinstance(o, float):
+            if not _math.isfinite(o):
+                return True
+        elif isinstance(o, dict):
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple)):
+            stack.extend(o)
+    return False
+
+
+def dumps(obj, default=None):
+    """
+    Encode an object as JSON.
+    :param obj: The object.
+    :param default: A function called with objects the codec can't encode, which returns an
+        encodable replacement or raises TypeError.
+    :return: The JSON as UTF-8 bytes.
+    """
+    encode = _default_encoder(default)
+    if _codec == "orjson":
+        try:
+            body = _orjson.dumps(obj, default=encode, option=_orjson.OPT_NON_STR_KEYS)
+            # orjson encodes NaN and infinite floats as null, so only look for them if there
+            # are nulls
+            if b"null" not in body or not _has_nonfinite(obj):
+                return body
+        except _orjson.JSONEncodeError:
+            # orjson is stricter, e.g. about integers over 64 bits, so let json have a go
+            pass
+    return _json.dumps(obj, default=encode).encode("utf-8")
+
+
+def loads(data):
+    """
+    Decode JSON.
+    :param data: The JSON as bytes or a string.
+    :return: The decoded object.
+    :raises ValueError: if the data isn't valid JSON.
+    """
+    if _codec == "orjson":
+        try:
+            return _orjson.loads(data)
+        except _orjson.JSONDecodeError:
+            # e.g. the NaN and Infinity tokens, which orjson rejects
+            pass
+    return _json.loads(data)
+
+
+_codec = _os.environ.get("JR_JSON_CODEC") or "json"
+if _codec not in available():
+    raise ValueError("JSON codec %s in JR_JSON_CODEC is not available" % _codec)
@@ -75,13 +75,15 @@ def terminate_job(jr: JobRunner, debug=False):
         jr_logger.info(e)
 
     try:
-        jr.cbs.kill()
+        jr._stop_callback_server()
     except Exception as e2:
         jr_logger.info(e2)
 
     jr.logger.error(
         f"An unhandled exception resulted in a premature exit of the app. Job id is {jr.job_id}"
     )
+    # Ship any buffered or spilled lines before the process exits and the flush thread dies
+    jr.logger.close(timeout=jr.config.log_close_timeout)
 
 
 def main():
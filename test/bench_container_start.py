@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""
+Container start latency benchmark.
+
+Runs bursts of subjobs through MethodRunner and DockerRunner against a fake docker SDK that
+injects configurable latencies, and reports p50/p95/p99 for:
+* submit to running - from the burst arriving until containers.run returns for the subjob.
+  Subjobs are submitted one after another, as JobRunner._watch does.
+* exit to output available - from the container exiting until its output has been read
+  with MethodRunner.get_output after the "finished" message.
+* the launch path phases - workdir init, catalog lookup, image resolution and container
+  creation.
+
+No docker daemon or network access is needed:
+
+    PYTHONPATH=.:test python test/bench_container_start.py --concurrency 1,10,100
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import threading
+from copy import deepcopy
+from queue import Queue
+from time import sleep as _sleep
+from time import time as _time
+from unittest.mock import patch
+
+from docker.errors import ImageNotFound
+
+from JobRunner.CatalogCache import CatalogCache
+from JobRunner.MethodRunner import MethodRunner
+from JobRunner.config import Config
+from mock_data import CATALOG_GET_MODULE_VERSION, EE2_LIST_CONFIG
+
+_PERCENTILES = (50, 95, 99)
+
+
+class Latencies(object):
+    """
+    The latencies, in seconds, injected by the fake docker SDK and catalog.
+    """
+
+    def __init__(self, catalog=0.05, image_get=0.01, pull=2.0, create=0.2, run=0.1):
+        self.catalog = catalog
+        self.image_get = image_get
+        self.pull = pull
+        self.create = create
+        self.run = run
+
+
+class FakeImage(object):
+    def __init__(self, name):
+        self.id = f"sha256:{name}"
+        self.attrs = {"Size": 1024 * 1024, "RepoDigests": []}
+
+
+class FakeImages(object):
+    def __init__(self, latencies, local=()):
+        self.latencies = latencies
+        self.local = set(local)
+
+    def get(self, name):
+        _sleep(self.latencies.image_get)
+        if name not in self.local:
+            raise ImageNotFound(f"No such image: {name}")
+        return FakeImage(name)
+
+    def pull(self, name):
+        _sleep(self.latencies.pull)
+        self.local.add(name)
+        return FakeImage(name)
+
+
+class FakeContainer(object):
+    """
+    A container that runs for a fixed time and then writes its output and exits.
+    """
+
+    def __init__(self, labels, runtime, exits):
+        self.id = labels["runner_job_id"]
+        self.job_dir = labels["job_dir"]
+        self.status = "running"
+        self._exits = exits
+        threading.Timer(runtime, self._exit).start()
+
+    def _exit(self):
+        with open(os.path.join(self.job_dir, "output.json"), "w") as f:
+            json.dump({"version": "1.1", "id": self.id, "result": [{}]}, f)
+        self._exits[self.id] = _time()
+        self.status = "exited"
+
+    def logs(self, **kwargs):
+        return b""
+
+    def reload(self):
+        pass
+
+    def kill(self):
+        pass
+
+    def remove(self):
+        pass
+
+
+class FakeContainers(object):
+    def __init__(self, latencies):
+        self.latencies = latencies
+        self.exits = dict()
+
+    def run(self, image, command, labels=None, **kwargs):
+        _sleep(self.latencies.create)
+        return FakeContainer(labels, self.latencies.run, self.exits)
+
+
+class FakeDocker(object):
+    def __init__(self, latencies, local_images=()):
+        self.images = FakeImages(latencies, local_images)
+        self.containers = FakeContainers(latencies)
+
+
+class FakeCatalog(object):
+    def __init__(self, latencies, image):
+        self.latencies = latencies
+        self.image = image
+
+    def get_module_version(self, req):
+        _sleep(self.latencies.catalog)
+        info = deepcopy(CATALOG_GET_MODULE_VERSION)
+        info["docker_img_name"] = self.image
+        return info
+
+
+class NullLogger(object):
+    def log_lines(self, lines, source=None):
+        pass
+
+    def log(self, line):
+        pass
+
+    def error(self, line):
+        pass
+
+
+class Timings(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = dict()
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.samples.setdefault(name, []).append(seconds)
+
+    def timed(self, name, fn):
+        def wrapper(*args, **kwargs):
+            start = _time()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.add(name, _time() - start)
+        return wrapper
+
+
+def percentile(samples, p):
+    """
+    The nearest rank percentile of the samples.
+    """
+    ordered = sorted(samples)
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+
+def run_burst(concurrency, latencies, cached_image=False, log_interval=1):
+    """
+    Run a burst of subjobs and collect their timings.
+    :param concurrency: The number of subjobs in the burst.
+    :param latencies: The latencies to inject.
+    :param cached_image: True if the module image is already available locally.
+    :param log_interval: The DockerRunner container polling interval.
+    :return: A Timings instance.
+    """
+    image = "kbase/bench:latest"
+    timings = Timings()
+    workdir = tempfile.mkdtemp()
+    try:
+        fake = FakeDocker(latencies, local_images=[image] if cached_image else [])
+        fake.containers.run = timings.timed("create", fake.containers.run)
+        config = Config(workdir=workdir, job_id="bench", use_ee2=False)
+        config.token = "bench"
+        with patch("JobRunner.DockerRunner.docker.from_env", return_value=fake):
+            mr = MethodRunner(config, logger=NullLogger())
+        mr.runner.log_interval = log_interval
+        mr.runner.images.get = timings.timed("image", mr.runner.images.get)
+        cc = CatalogCache(FakeCatalog(latencies, image))
+        cc.get_module_info = timings.timed("catalog", cc.get_module_info)
+
+        ee2_config = deepcopy(EE2_LIST_CONFIG)
+        ee2_config["ref_data_base"] = workdir
+        params = {"method": "bench.run", "params": [{}], "service_ver": "release"}
+        mr._init_workdir(ee2_config, mr.job_dir, params)
+        mr._init_workdir = timings.timed("workdir", mr._init_workdir)
+
+        fin_q = Queue()
+
+        def collect():
+            for _ in range(concurrency):
+                _, job_id, _ = fin_q.get()
+                mr.get_output(job_id, subjob=True)
+                timings.add("exit_to_output", _time() - fake.containers.exits[job_id])
+
+        collector = threading.Thread(target=collect)
+        collector.start()
+        start = _time()
+        for i in range(concurrency):
+            module_info = cc.get_module_info("bench", "release")
+            mr.run(ee2_config, module_info, params, f"sub{i}", fin_q=fin_q,
+                   callback="http://localhost:9999", subjob=True)
+            timings.add("submit_to_running", _time() - start)
+        collector.join()
+    finally:
+        shutil.rmtree(workdir)
+    return timings
+
+
+def report(results):
+    metrics = ["submit_to_running", "exit_to_output", "workdir", "catalog", "image", "create"]
+    print(f"{'concurrency':>11} {'metric':<18} {'n':>5} "
+          + " ".join(f"{'p' + str(p):>8}" for p in _PERCENTILES) + f" {'max':>8}")
+    for concurrency, timings in results:
+        for metric in metrics:
+            samples = timings.samples.get(metric, [])
+            if not samples:
+                continue
+            print(f"{concurrency:>11} {metric:<18} {len(samples):>5} "
+                  + " ".join(f"{percentile(samples, p):>8.3f}" for p in _PERCENTILES)
+                  + f" {max(samples):>8.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--concurrency", default="1,10,100",
+                        help="Comma separated burst sizes")
+    parser.add_argument("--rounds", type=int, default=1,
+                        help="Bursts to run at each concurrency")
+    parser.add_argument("--cached-image", action="store_true",
+                        help="The module image is already available locally")
+    parser.add_argument("--log-interval", type=float, default=1,
+                        help="DockerRunner container polling interval")
+    parser.add_argument("--json", help="Also write the raw samples to this file")
+    defaults = Latencies()
+    for name in ["catalog", "image_get", "pull", "create", "run"]:
+        parser.add_argument(f"--{name.replace('_', '-')}", type=float,
+                            default=getattr(defaults, name),
+                            help=f"Injected {name} latency in seconds")
+    args = parser.parse_args()
+    latencies = Latencies(args.catalog, args.image_get, args.pull, args.create, args.run)
+    results = []
+    for concurrency in [int(c) for c in args.concurrency.split(",")]:
+        merged = Timings()
+        for _ in range(args.rounds):
+            timings = run_burst(concurrency, latencies, cached_image=args.cached_image,
+                                log_interval=args.log_interval)
+            for metric, samples in timings.samples.items():
+                merged.samples.setdefault(metric, []).extend(samples)
+        results.append((concurrency, merged))
+    report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({str(c): t.samples for c, t in results}, f)
+
+
+if __name__ == "__main__":
+    main()
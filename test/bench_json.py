@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+JSON codec throughput benchmark.
+
+Encodes and decodes representative RPC bodies with each available codec in clients.jsoncodec
+and reports MB/s:
+* output - a check_job response holding a subjob's output.json, encoded as the callback
+  server does, at several output sizes.
+* logs - an add_job_logs request holding a batch of log lines, encoded as the ee2 client
+  does, at several batch sizes.
+
+No services are needed:
+
+    PYTHONPATH=.:test python test/bench_json.py --output-mb 1,16 --log-lines 100,1000,10000
+"""
+import argparse
+import json
+import random
+import string
+from time import perf_counter as _perf_counter
+
+from clients import jsoncodec
+from clients.baseclient import _encode as _encode_request
+from JobRunner.callback_server import _encode as _encode_response
+
+
+def _word(rand, n):
+    return "".join(rand.choice(string.ascii_letters) for _ in range(n))
+
+
+def make_output(size_mb, seed=0):
+    """
+    Make a check_job response with a genome-like output of about size_mb MB: a list of
+    feature dicts with strings, numbers, nested lists and nulls.
+    """
+    rand = random.Random(seed)
+    features = []
+    size = 0
+    while size < size_mb * 1024 * 1024:
+        feature = {
+            "id": f"{_word(rand, 8)}_{len(features)}",
+            "type": rand.choice(["gene", "CDS", "mRNA"]),
+            "location": [[_word(rand, 6), rand.randint(1, 10 ** 7), "+", rand.randint(1, 5000)]],
+            "function": " ".join(_word(rand, rand.randint(3, 10)) for _ in range(6)),
+            "protein_translation": _word(rand, 300),
+            "md5": "%032x" % rand.getrandbits(128),
+            "gc_content": rand.random(),
+            "aliases": [[_word(rand, 5), _word(rand, 12)] for _ in range(3)],
+            "note": None,
+        }
+        features.append(feature)
+        size += len(json.dumps(feature))
+    output = {
+        "version": "1.1",
+        "id": "12345",
+        "result": [{"genome": {"features": features}}],
+        "finished": 1,
+    }
+    return {"result": [output]}
+
+
+def make_log_request(lines, seed=0):
+    """
+    Make an add_job_logs request with a batch of log lines.
+    """
+    rand = random.Random(seed)
+    batch = [
+        {"line": " ".join(_word(rand, rand.randint(2, 12)) for _ in range(10)),
+         "is_error": rand.randint(0, 1), "ts": 1700000000000 + i}
+        for i in range(lines)
+    ]
+    return {
+        "method": "execution_engine2.add_job_logs",
+        "params": [{"job_id": "5e8d1b5c3a9a4c3e8f1b2c3d"}, batch],
+        "version": "1.1",
+        "id": "12345",
+    }
+
+
+def measure(encode, obj, min_time=0.5):
+    """
+    Time encoding and decoding an object with the current codec.
+    :return: The encoded size in bytes and the encode and decode throughput in MB/s.
+    """
+    body = encode(obj)
+    results = []
+    for fn, arg in [(encode, obj), (jsoncodec.loads, body)]:
+        runs = 0
+        start = _perf_counter()
+        while True:
+            fn(arg)
+            runs += 1
+            elapsed = _perf_counter() - start
+            if elapsed >= min_time:
+                break
+        results.append(len(body) * runs / elapsed / 1024 / 1024)
+    return len(body), results[0], results[1]
+
+
+def run(output_mb, log_lines, codecs, min_time=0.5):
+    """
+    Run the benchmark.
+    :param output_mb: The output sizes in MB.
+    :param log_lines: The log batch sizes in lines.
+    :param codecs: The codecs to compare.
+    :param min_time: The minimum time in seconds to spend on each measurement.
+    :return: A list of (case, codec, body size, encode MB/s, decode MB/s) tuples.
+    """
+    cases = [(f"output {mb:g}MB", lambda o: _encode_response(o)[0], make_output(mb))
+             for mb in output_mb]
+    cases += [(f"logs {n} lines", _encode_request, make_log_request(n)) for n in log_lines]
+    previous = jsoncodec.get_codec()
+    results = []
+    try:
+        for case, encode, obj in cases:
+            for codec in codecs:
+                jsoncodec.set_codec(codec)
+                results.append((case, codec) + measure(encode, obj, min_time))
+    finally:
+        jsoncodec.set_codec(previous)
+    return results
+
+
+def report(results):
+    print(f"{'case':<18} {'codec':<8} {'bytes':>10} {'enc MB/s':>9} {'dec MB/s':>9}")
+    for case, codec, size, enc, dec in results:
+        print(f"{case:<18} {codec:<8} {size:>10} {enc:>9.1f} {dec:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--output-mb", default="1,16",
+                        help="Comma separated output.json sizes in MB")
+    parser.add_argument("--log-lines", default="100,1000,10000",
+                        help="Comma separated add_job_logs batch sizes")
+    parser.add_argument("--codecs", default=",".join(jsoncodec.available()),
+                        help="Comma separated codecs to compare")
+    parser.add_argument("--min-time", type=float, default=0.5,
+                        help="Minimum seconds to spend on each measurement")
+    args = parser.parse_args()
+    results = run(
+        [float(s) for s in args.output_mb.split(",")],
+        [int(n) for n in args.log_lines.split(",")],
+        args.codecs.split(","),
+        args.min_time,
+    )
+    report(results)
+
+
+if __name__ == "__main__":
+    main()
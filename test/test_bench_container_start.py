@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from bench_container_start import Latencies, percentile, run_burst
+
+
+class BenchContainerStartTest(unittest.TestCase):
+
+    def test_percentile(self):
+        samples = list(range(1, 101))
+        self.assertEqual(percentile(samples, 50), 50)
+        self.assertEqual(percentile(samples, 99), 99)
+        self.assertEqual(percentile([3.0], 95), 3.0)
+
+    def test_burst(self):
+        latencies = Latencies(catalog=0.01, image_get=0, pull=0.05, create=0.01, run=0.05)
+        timings = run_burst(3, latencies, log_interval=0.05)
+        for metric in ["submit_to_running", "exit_to_output", "workdir", "image", "create"]:
+            self.assertEqual(len(timings.samples[metric]), 3, metric)
+        # Only the first subjob pays for the pull
+        self.assertGreaterEqual(timings.samples["image"][0], 0.05)
+        self.assertLess(max(timings.samples["image"][1:]), 0.05)
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+import json
+import unittest
+
+from bench_json import make_log_request, make_output, run
+
+
+class BenchJsonTest(unittest.TestCase):
+
+    def test_cases(self):
+        output = make_output(0.1)
+        self.assertGreater(len(json.dumps(output)), 0.1 * 1024 * 1024)
+        self.assertEqual(output["result"][0]["finished"], 1)
+        self.assertEqual(len(make_log_request(10)["params"][1]), 10)
+
+    def test_run(self):
+        results = run([0.01], [10], ["json"], min_time=0.01)
+        self.assertEqual(
+            [r[:2] for r in results], [("output 0.01MB", "json"), ("logs 10 lines", "json")])
+        for _, _, size, enc, dec in results:
+            self.assertGreater(size, 0)
+            self.assertGreater(enc, 0)
+            self.assertGreater(dec, 0)
@@ -1,12 +1,28 @@
 # Import the Sanic app, usually created with Sanic(__name__)
 
 import json
+import multiprocessing
 import pytest
+import requests
+import socket
+import threading
+import time
+import urllib3
+from concurrent.futures import ThreadPoolExecutor
 from queue import Queue
 from unittest.mock import patch, create_autospec
 
-from JobRunner.callback_server import create_app
+from clients.baseclient import BaseClient
+from JobRunner.callback_server import (
+    _scheduling,
+    create_app,
+    start_callback_server,
+    start_callback_server_thread,
+)
 from JobRunner.CatalogCache import CatalogCache
+from JobRunner.JobStore import JobStore, SpilledOutput
+from JobRunner.logstats import LatencyHistogram
+from JobRunner.metrics import RPCStats
 
 _TOKEN = "bogus"
 
@@ -97,3 +113,408 @@ def test_index_submit_sync(mock_uuid, app):
     assert "finished" in response.json
     assert "foo" in response.json
 
+
+
+def test_index_submit_sync_completes_promptly(app):
+    out_q = Queue()
+    in_q = Queue()
+    cc = create_autospec(CatalogCache, spec_set=True, instance=True)
+    conf = {
+        "token": _TOKEN,
+        "out_q": out_q,
+        "in_q": in_q,
+        "catcache": cc,
+        "jobcount": 0,
+        "maxjobs": 10,
+    }
+    app.config.update(conf)
+
+    def fake_runner():
+        _, job_id, _ = out_q.get()
+        time.sleep(0.2)
+        in_q.put(["output", job_id, {"foo": "baz"}])
+
+    runner = threading.Thread(target=fake_runner)
+    runner.start()
+    data = json.dumps({"method": "bogus.test"})
+    start = time.time()
+    response = _post(app, data)
+    elapsed = time.time() - start
+    runner.join()
+    assert response.json["foo"] == "baz"
+    assert response.json["finished"] == 1
+    # Previously the server polled for output once a second
+    assert elapsed < 0.9
+    assert app.ctx.jobs.jobcount() == 0
+
+
+def test_check_job_wait(app):
+    out_q = Queue()
+    in_q = Queue()
+    cc = create_autospec(CatalogCache, spec_set=True, instance=True)
+    conf = {
+        "token": _TOKEN,
+        "out_q": out_q,
+        "in_q": in_q,
+        "catcache": cc,
+        "jobcount": 0,
+        "maxjobs": 10,
+    }
+    app.config.update(conf)
+    response = _post(app, json.dumps({"method": "bogus._test_submit"}))
+    assert response.headers["X-Check-Job-Max-Wait"] == "300"
+    job_id = response.json["result"][0]
+    out_q.get()
+
+    # Times out
+    data = json.dumps({"method": "bogus._check_job", "params": [job_id, {"wait": 0.1}]})
+    response = _post(app, data)
+    assert response.json["result"][0]["finished"] == 0
+
+    # Returns as soon as the job finishes
+    timer = threading.Timer(0.3, in_q.put, args=[["output", job_id, {"foo": "bar"}]])
+    timer.start()
+    data = json.dumps({"method": "bogus._check_job", "params": [job_id, {"wait": 30}]})
+    start = time.time()
+    response = _post(app, data)
+    assert time.time() - start < 5
+    assert response.json["result"][0]["finished"] == 1
+    assert response.json["result"][0]["foo"] == "bar"
+
+    data = json.dumps({"method": "bogus._check_job", "params": [job_id, {"wait": "x"}]})
+    response = _post(app, data)
+    assert response.json["error"]["message"] == "Invalid wait time: x"
+
+
+def test_check_jobs(app):
+    out_q = Queue()
+    in_q = Queue()
+    cc = create_autospec(CatalogCache, spec_set=True, instance=True)
+    conf = {
+        "token": _TOKEN,
+        "out_q": out_q,
+        "in_q": in_q,
+        "catcache": cc,
+        "jobcount": 0,
+        "maxjobs": 10,
+    }
+    app.config.update(conf)
+    job_ids = []
+    for _ in range(3):
+        response = _post(app, json.dumps({"method": "bogus._test_submit"}))
+        job_ids.append(response.json["result"][0])
+
+    in_q.put(["output", job_ids[0], {"foo": "bar"}])
+    data = {"method": "CallbackServer.check_jobs", "params": [{"job_ids": job_ids}]}
+    response = _post(app, json.dumps(data))
+    states = response.json["result"][0]
+    assert states[job_ids[0]] == {"foo": "bar", "finished": 1}
+    assert states[job_ids[1]] == {"finished": 0}
+    assert states[job_ids[2]] == {"finished": 0}
+
+    # Wait for any
+    threading.Timer(0.3, in_q.put, args=[["output", job_ids[1], {"foo": "baz"}]]).start()
+    data["params"][0].update({"job_ids": job_ids[1:], "wait": 30, "wait_for": "any"})
+    response = _post(app, json.dumps(data))
+    states = response.json["result"][0]
+    assert states[job_ids[1]]["finished"] == 1
+    assert states[job_ids[2]] == {"finished": 0}
+
+    # Wait for all, timing out
+    data["params"][0].update({"wait": 0.1, "wait_for": "all"})
+    response = _post(app, json.dumps(data))
+    assert response.json["result"][0][job_ids[2]] == {"finished": 0}
+
+    for params, err in [
+        ([{}], "method params must be a list containing exactly one dict with a job_ids list"),
+        ([{"job_ids": ["foo"]}], "Invalid job ID: foo"),
+        ([{"job_ids": job_ids, "wait": -1}], "Invalid wait time: -1"),
+        ([{"job_ids": job_ids, "wait_for": "some"}], "Invalid wait_for value: some"),
+    ]:
+        data = {"method": "CallbackServer.check_jobs", "params": params}
+        response = _post(app, json.dumps(data))
+        assert response.json["error"]["message"] == err
+
+
+def test_sync_timeout(app):
+    in_q = Queue()
+    cc = create_autospec(CatalogCache, spec_set=True, instance=True)
+    conf = {
+        "token": _TOKEN,
+        "out_q": Queue(),
+        "in_q": in_q,
+        "catcache": cc,
+        "maxjobs": 10,
+        "sync_timeout": 0.2,
+    }
+    app.config.update(conf)
+    app.ctx.jobs = JobStore()
+    deliver = app.ctx.jobs.deliver
+
+    def bad_deliver(mtype, job_id, output):
+        if mtype == "sync":
+            raise ValueError("oops")
+        deliver(mtype, job_id, output)
+
+    data = json.dumps({"method": "CallbackServer.get_provenance"})
+    with patch.object(app.ctx.jobs, "deliver", side_effect=bad_deliver):
+        response = _post(app, data)
+    assert response.json["error"]["message"] == (
+        "Timed out waiting for the job runner to report job states")
+    # The reader carries on after a message fails
+    in_q.put(["prov", None, ["p"]])
+    response = _post(app, data)
+    assert response.json == {"result": [["p"]]}
+    assert app.ctx.jobs._synced == set()
+    del app.config["sync_timeout"]
+
+
+def test_submit_queue(app):
+    out_q = Queue()
+    in_q = Queue()
+    cc = create_autospec(CatalogCache, spec_set=True, instance=True)
+    conf = {
+        "token": _TOKEN,
+        "out_q": out_q,
+        "in_q": in_q,
+        "catcache": cc,
+        "maxjobs": 1,
+        "maxqueued": 1,
+    }
+    app.config.update(conf)
+    # Jobs left running by earlier tests would take the slot
+    app.ctx.jobs = JobStore()
+    try:
+        job_ids = []
+        for _ in range(2):
+            response = _post(app, json.dumps({"method": "bogus._test_submit"}))
+            job_ids.append(response.json["result"][0])
+        assert out_q.get(timeout=1)[1] == job_ids[0]
+        assert out_q.empty()
+        data = json.dumps({"method": "bogus._check_job", "params": [job_ids[1]]})
+        assert _post(app, data).json["result"][0] == {"finished": 0, "queued": 1}
+        response = _post(app, json.dumps({"method": "bogus._test_submit"}))
+        assert response.json["error"]["message"] == (
+            "No more than 1 concurrently running methods and 1 queued methods are allowed")
+
+        # The queued job starts when the running job finishes
+        in_q.put(["output", job_ids[0], {"foo": "bar"}])
+        data = json.dumps({"method": "bogus._check_job", "params": [job_ids[0]]})
+        assert _post(app, data).json["result"][0]["finished"] == 1
+        _, job_id, params = out_q.get(timeout=1)
+        assert job_id == job_ids[1]
+        assert params["method"] == "bogus.test"
+        data = json.dumps({"method": "bogus._check_job", "params": [job_ids[1]]})
+        assert _post(app, data).json["result"][0] == {"finished": 0}
+    finally:
+        app.config.update({"maxjobs": 10, "maxqueued": 0})
+
+
+def test_submit_scheduling(app):
+    assert _scheduling({}) == (None, 0)
+    call_stack = [{"job_id": "main"}, {"job_id": "sub"}]
+    assert _scheduling({"context": {"call_stack": call_stack}}) == ("sub", 2)
+    context = {"call_stack": call_stack, "parent_job_id": "p", "priority": -1.5}
+    assert _scheduling({"context": context}) == ("p", -1.5)
+    assert _scheduling({"context": {"priority": "high"}}) == (None, None)
+    assert _scheduling({}, "10.0.0.2") == ("client:10.0.0.2", 0)
+    assert _scheduling({"context": context}, "10.0.0.2") == ("p", -1.5)
+
+    cc = create_autospec(CatalogCache, spec_set=True, instance=True)
+    app.config.update({"token": _TOKEN, "out_q": Queue(), "in_q": Queue(), "catcache": cc})
+    data = json.dumps({"method": "bogus._test_submit", "context": {"priority": True}})
+    assert _post(app, data).json["error"]["message"] == "Invalid priority: True"
+
+
+def test_metrics(app):
+    out_q = Queue()
+    in_q = Queue()
+    cc = create_autospec(CatalogCache, spec_set=True, instance=True)
+    conf = {
+        "token": _TOKEN,
+        "out_q": out_q,
+        "in_q": in_q,
+        "catcache": cc,
+        "maxjobs": 10,
+        "maxqueued": 0,
+    }
+    app.config.update(conf)
+    app.ctx.jobs = JobStore()
+    app.ctx.rpc_stats = RPCStats()
+    _post(app, json.dumps({"method": "bogus._test_submit"}))
+    _post(app, json.dumps({"method": "CallbackServer.nope"}))
+    in_q.put(["metrics", None, {
+        "containers": {"starts": 3, "exits": 2, "pulls": LatencyHistogram().to_dict()},
+        "log": {"lines": 20, "shipped_lines": 10, "spilled_lines": 0},
+    }])
+    # The runner sends the size of an output it read from a file
+    in_q.put(["output", "finished_job", {"result": []}, 42])
+    # Wait for the reader to pick up the metrics
+    _post(app, json.dumps({"method": "CallbackServer.get_provenance"}))
+
+    _, response = app.test_client.get("/metrics")
+    assert response.status == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    lines = response.text.splitlines()
+    for line in [
+        'jobrunner_rpc_requests_total{method="_submit"} 1',
+        'jobrunner_rpc_errors_total{method="_submit"} 0',
+        'jobrunner_rpc_errors_total{method="CallbackServer.nope"} 1',
+        'jobrunner_rpc_duration_seconds_count{method="_submit"} 1',
+        "jobrunner_jobs_running 1",
+        "jobrunner_jobs_queued 0",
+        'jobrunner_queue_depth{queue="out"} 1',
+        'jobrunner_output_bytes{storage="memory"} 42',
+        "jobrunner_container_starts_total 3",
+        "jobrunner_container_exits_total 2",
+        "jobrunner_image_pull_duration_seconds_count 0",
+        "jobrunner_log_lines_shipped_total 10",
+    ]:
+        assert line in lines
+
+
+def _free_port():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def test_multiple_workers():
+    port = _free_port()
+    out_q = multiprocessing.Queue()
+    in_q = multiprocessing.Queue()
+    shutdown = multiprocessing.Event()
+    ready = multiprocessing.Event()
+    cc = create_autospec(CatalogCache, spec_set=True, instance=True)
+    server = multiprocessing.Process(
+        target=start_callback_server,
+        args=["127.0.0.1", port, out_q, in_q, _TOKEN, False, cc],
+        kwargs={"shutdown_event": shutdown, "max_tasks": 5, "workers": 3, "ready_event": ready},
+    )
+    server.start()
+    url = f"http://127.0.0.1:{port}"
+    headers = {"Authorization": _TOKEN}
+    try:
+        assert ready.wait(30)
+
+        # maxjobs holds across workers
+        def submit(_):
+            data = json.dumps({"method": "bogus._test_submit"})
+            return requests.post(url, data=data, headers=headers).json()
+
+        with ThreadPoolExecutor(max_workers=20) as ex:
+            resps = list(ex.map(submit, range(20)))
+        job_ids = [r["result"][0] for r in resps if "result" in r]
+        assert len(job_ids) == 5
+
+        # Output is visible to, and wakes, every worker
+        for job_id in job_ids:
+            in_q.put(["output", job_id, {"id": job_id}])
+        for job_id in job_ids:
+            data = json.dumps({"method": "bogus._check_job", "params": [job_id, {"wait": 10}]})
+            resp = requests.post(url, data=data, headers=headers).json()
+            assert resp["result"][0] == {"id": job_id, "finished": 1}
+        assert "result" in submit(None)
+    finally:
+        shutdown.set()
+        server.join(10)
+        if server.is_alive():
+            server.kill()
+    assert server.exitcode == 0
+
+
+def test_callback_server_thread():
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}"
+    cc = create_autospec(CatalogCache, spec_set=True, instance=True)
+    # The app name can be reused once the previous server stops
+    for _ in range(2):
+        in_q = Queue()
+        shutdown = threading.Event()
+        server = start_callback_server_thread(
+            "127.0.0.1", port, Queue(), in_q, _TOKEN, False, cc, shutdown_event=shutdown)
+        try:
+            # Accepting connections as soon as it returns
+            data = json.dumps({"method": "bogus._test_submit"})
+            job_id = requests.post(url, data=data, headers={"Authorization": _TOKEN}).json()
+            job_id = job_id["result"][0]
+            in_q.put(["output", job_id, {"foo": "bar"}])
+            data = json.dumps({"method": "bogus._check_job", "params": [job_id]})
+            resp = requests.post(url, data=data, headers={"Authorization": _TOKEN}).json()
+            assert resp["result"][0] == {"foo": "bar", "finished": 1}
+        finally:
+            shutdown.set()
+            server.join(10)
+        assert not server.is_alive()
+
+    busy = socket.socket()
+    busy.bind(("127.0.0.1", 0))
+    busy.listen()
+    try:
+        with pytest.raises(RuntimeError, match="Callback server failed to start"):
+            start_callback_server_thread(
+                "127.0.0.1", busy.getsockname()[1], Queue(), Queue(), _TOKEN, False, cc)
+    finally:
+        busy.close()
+
+
+def _from_address(address):
+    # Makes the HTTP requests made in the context come from the given local address
+    create_connection = urllib3.util.connection.create_connection
+
+    def create(*args, **kwargs):
+        kwargs["source_address"] = (address, 0)
+        return create_connection(*args, **kwargs)
+    return patch("urllib3.util.connection.create_connection", create)
+
+
+def test_fair_share_by_client():
+    # The SDK clients send no call stack, so submitters are told apart by their address
+    port = _free_port()
+    out_q = Queue()
+    in_q = Queue()
+    cc = create_autospec(CatalogCache, spec_set=True, instance=True)
+    shutdown = threading.Event()
+    server = start_callback_server_thread(
+        "127.0.0.1", port, out_q, in_q, _TOKEN, False, cc, shutdown_event=shutdown,
+        max_tasks=2, max_queued=10)
+    try:
+        client = BaseClient(f"http://127.0.0.1:{port}", token=_TOKEN)
+        busy_jobs = [client._submit_job("bogus.test", []) for _ in range(4)]
+        with _from_address("127.0.0.2"):
+            other_job = client._submit_job("bogus.test", [])
+        assert [out_q.get(timeout=1)[1] for _ in range(2)] == busy_jobs[:2]
+        # The other client has no running jobs, so its job goes ahead of the busy client's
+        # earlier ones
+        in_q.put(["output", busy_jobs[0], {"foo": "bar"}])
+        assert out_q.get(timeout=5)[1] == other_job
+        in_q.put(["output", other_job, {"foo": "bar"}])
+        assert out_q.get(timeout=5)[1] == busy_jobs[2]
+    finally:
+        shutdown.set()
+        server.join(10)
+
+
+def test_check_job_spilled_output(app, tmp_path):
+    out_q = Queue()
+    in_q = Queue()
+    cc = create_autospec(CatalogCache, spec_set=True, instance=True)
+    conf = {
+        "token": _TOKEN,
+        "out_q": out_q,
+        "in_q": in_q,
+        "catcache": cc,
+        "jobcount": 0,
+        "maxjobs": 10,
+    }
+    app.config.update(conf)
+    response = _post(app, json.dumps({"method": "bogus._test_submit"}))
+    job_id = response.json["result"][0]
+    path = tmp_path / "output.json"
+    path.write_text(json.dumps({"result": [{"big": "output"}]}))
+    in_q.put(["output", job_id, SpilledOutput(str(path), path.stat().st_size)])
+    data = json.dumps({"method": "bogus._check_job", "params": [job_id]})
+    response = _post(app, data)
+    assert response.json["result"][0] == {"result": [{"big": "output"}], "finished": 1}
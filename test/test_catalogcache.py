@@ -53,3 +53,15 @@ class CatalogCacheTest(unittest.TestCase):
         out = cc.get_volume_mounts("bogus", "method", "upload")
         self.assertTrue(len(out) > 0)
         self.assertIn("host_dir", out[0])
+
+    def test_image_name(self):
+        cc, catalog = self.get_mocks()
+        catalog.get_module_version.return_value = CATALOG_GET_MODULE_VERSION
+        image = CATALOG_GET_MODULE_VERSION["docker_img_name"]
+        self.assertEqual(cc.get_image_name("bogus", "release"), image)
+        self.assertEqual(cc.get_image_name("bogus", "release"), image)
+        catalog.get_module_version.assert_called_once_with(
+            {"module_name": "bogus", "version": "release"})
+        # The lookup doesn't count as a use of the module
+        out = cc.get_module_info("bogus", "release")
+        self.assertFalse(out["cached"])
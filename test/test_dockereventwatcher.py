@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+import unittest
+from queue import Queue
+from unittest.mock import MagicMock
+
+from JobRunner.DockerEventWatcher import DockerEventWatcher
+
+
+class FakeEventStream(object):
+    """
+    A blocking docker event stream fed from a queue.
+    """
+
+    def __init__(self):
+        self.q = Queue()
+
+    def __iter__(self):
+        while True:
+            event = self.q.get()
+            if event is None:
+                return
+            yield event
+
+    def close(self):
+        self.q.put(None)
+
+
+def _event(action, cid, **attrs):
+    return {
+        "Type": "container",
+        "Action": action,
+        "Actor": {"ID": cid, "Attributes": attrs},
+        "time": 1000,
+    }
+
+
+class DockerEventWatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stream = FakeEventStream()
+        self.client = MagicMock()
+        self.client.events.return_value = self.stream
+        self.watcher = DockerEventWatcher(self.client, reconnect_delay=0.01)
+
+    def tearDown(self):
+        self.watcher.stop()
+
+    def test_die_and_oom(self):
+        self.watcher.start()
+        self.assertTrue(self.watcher.connected)
+        kwargs = self.client.events.call_args[1]
+        self.assertEqual(kwargs["filters"]["type"], "container")
+        state = self.watcher.register("c1")
+        other = self.watcher.register("c2")
+        self.stream.q.put(_event("oom", "c1"))
+        self.stream.q.put(_event("die", "c1", exitCode="137"))
+        self.assertTrue(state.exited.wait(5))
+        self.assertTrue(state.oom_killed)
+        self.assertEqual(state.exit_code, 137)
+        self.assertFalse(other.exited.is_set())
+        self.assertFalse(other.oom_killed)
+
+    def test_exit_before_register(self):
+        self.watcher.start()
+        self.stream.q.put(_event("die", "c1", exitCode="0"))
+        self.stream.q.put(_event("start", "c2"))
+        # Wait for the events to be handled
+        done = self.watcher.register("done")
+        self.stream.q.put(_event("destroy", "done"))
+        self.assertTrue(done.exited.wait(5))
+        state = self.watcher.register("c1")
+        self.assertTrue(state.exited.is_set())
+        self.assertEqual(state.exit_code, 0)
+        self.assertFalse(self.watcher.register("c2").exited.is_set())
+
+    def test_resubscribe(self):
+        streams = [FakeEventStream(), self.stream]
+        self.client.events.side_effect = streams
+        self.watcher.start()
+        streams[0].close()
+        state = self.watcher.register("c1")
+        self.stream.q.put(_event("die", "c1", exitCode="1"))
+        self.assertTrue(state.exited.wait(5))
+        self.assertEqual(self.client.events.call_count, 2)
+        first, second = self.client.events.call_args_list
+        self.assertEqual(first[1]["since"], second[1]["since"])
@@ -2,9 +2,14 @@
 import os
 import unittest
 from JobRunner.DockerRunner import DockerRunner
+from JobRunner.WarmPool import WarmPool, _Entry
 import json
 from time import sleep as _sleep
 from queue import Queue
+from collections import deque
+import shutil
+import tempfile
+from unittest.mock import patch, MagicMock
 
 
 class MockLogger(object):
@@ -13,7 +18,7 @@ class MockLogger(object):
         self.errors = []
         self.all = []
 
-    def log_lines(self, lines):
+    def log_lines(self, lines, source=None):
         self.all.extend(lines)
 
     def log(self, line):
@@ -75,7 +80,7 @@ class DockerRunnerTest(unittest.TestCase):
         sout += u"2019-07-08T23:21:32.508896500Z 4\n"
         serr = u"2019-07-08T23:21:32.508797700Z 3\n"
         serr += u"2019-07-08T23:21:32.508797600Z 2\n"
-        lines = dr._sort_lines_by_time(sout.encode("utf-8"), serr.encode("utf-8"))
+        lines = list(dr._sort_lines_by_time(sout.encode("utf-8"), serr.encode("utf-8")))
         self.assertEqual(lines[0]["line"], "1")
         self.assertEqual(lines[1]["line"], "2")
         self.assertEqual(lines[2]["line"], "3")
@@ -86,7 +91,7 @@ class DockerRunnerTest(unittest.TestCase):
         dr = DockerRunner()
         sout = u"2019-07-08T23:21:32.508696500Z \n"
         serr = u"2019-07-08T23:21:32.508797700Z \n"
-        lines = dr._sort_lines_by_time(sout.encode("utf-8"), serr.encode("utf-8"))
+        lines = list(dr._sort_lines_by_time(sout.encode("utf-8"), serr.encode("utf-8")))
         self.assertEqual(lines[0]["line"], "")
         self.assertEqual(lines[1]["line"], "")
         self.assertEqual(lines[1]["is_error"], 1)
@@ -104,3 +109,124 @@ class DockerRunnerTest(unittest.TestCase):
         result = q.get()
         expected = ['finished', '1234', None]
         self.assertEqual(expected, result)
+
+    @patch("JobRunner.DockerRunner.docker", autospec=True)
+    def test_follow_logs(self, mock_docker):
+        mlog = MockLogger()
+        dr = DockerRunner(logger=mlog, follow_logs=True)
+        api = dr.docker.api
+        api._read_from_socket.return_value = iter([
+            (b"2019-07-08T23:21:32.508696500Z 1\n2019-07-08T23:21:32.508", None),
+            (b"896500Z 2\n", b"2019-07-08T23:21:32.508797700Z 3\n"),
+            (None, b"2019-07-08T23:21:32.508797800Z 4"),
+        ])
+        c = MockDocker()
+        q = Queue()
+        dr._shepherd(c, "1234", [q])
+        self.assertEqual(q.get(), ["finished", "1234", None])
+        self.assertEqual(
+            [(line["line"], line["is_error"]) for line in mlog.all],
+            [("1", 0), ("2", 0), ("3", 1), ("4", 1)],
+        )
+        self.assertEqual(mlog.all[0]["ts"], 1562628092508)
+        params = api._get.call_args[1]["params"]
+        self.assertEqual(params, {"follow": 1, "stdout": 1, "stderr": 1, "timestamps": 1})
+        api._get.return_value.close.assert_called_once()
+
+    @patch("JobRunner.DockerRunner.docker", autospec=True)
+    def test_events_oom(self, mock_docker):
+        mlog = MockLogger()
+        dr = DockerRunner(logger=mlog, use_events=True)
+        dr.log_interval = 60
+        dr.events._connected.set()
+        c = MockDocker()
+        c.status = "running"
+        dr.events._handle({"Action": "oom", "Actor": {"ID": c.id}})
+        dr.events._handle(
+            {"Action": "die", "Actor": {"ID": c.id, "Attributes": {"exitCode": "137"}}})
+        q = Queue()
+        dr._supervise(c, "1234", [q], state=dr.events.register(c.id))
+        self.assertEqual(q.get(timeout=5), ["finished", "1234", None])
+        self.assertEqual(len(mlog.errors), 1)
+        self.assertIn("ran out of memory", mlog.errors[0])
+        self.assertNotIn(c.id, dr.events._states)
+
+    @patch("JobRunner.DockerRunner.docker", autospec=True)
+    def test_run_pooled(self, mock_docker):
+        workdir = tempfile.mkdtemp()
+        try:
+            dr = DockerRunner(logger=MockLogger(), warm_pool_dir=os.path.join(workdir, "pool"))
+            dr.pool.fill = MagicMock()
+            job_dir = os.path.join(workdir, "subjob")
+            os.mkdir(job_dir)
+            vols = {
+                job_dir: {"bind": "/kb/module/work", "mode": "rw"},
+                "/data": {"bind": "/data", "mode": "ro"},
+            }
+            env = {"SDK_CALLBACK_URL": "http://localhost"}
+            # Nothing pooled yet
+            self.assertIsNone(dr._run_pooled("1", "mod:1", env, vols, {}))
+            key = WarmPool.key("mod:1", env, {"/data": {"bind": "/data", "mode": "ro"}}, {})
+            dr.pool.fill.assert_called_once_with(
+                key, "mod:1", env, {"/data": {"bind": "/data", "mode": "ro"}}, {}, None)
+            pooled = MagicMock()
+            pooled_dir = os.path.join(workdir, "pool", "x")
+            os.makedirs(pooled_dir)
+            dr.pool._idle[key] = deque([_Entry(pooled, pooled_dir)])
+            c = dr._run_pooled("1", "mod:1", env, vols, {})
+            self.assertIs(c, pooled)
+            pooled.start.assert_called_once()
+            self.assertEqual(os.readlink(job_dir), pooled_dir)
+        finally:
+            shutil.rmtree(workdir)
+
+    @patch.dict(os.environ, {"IN_CONTAINER": "1"})
+    @patch("JobRunner.DockerRunner.docker", autospec=True)
+    def test_run_server_in_container(self, mock_docker):
+        # The host's loopback interface isn't reachable, so use the container network
+        dr = DockerRunner(logger=MockLogger())
+        dr.events = None
+        dr._supervise = MagicMock()
+        c = MagicMock()
+        c.attrs = {"NetworkSettings": {"Networks": {"bridge": {"IPAddress": "172.17.0.5"}}}}
+        dr._pull_and_run = MagicMock(return_value=c)
+        self.assertEqual(
+            dr.run_server("srv", "mod:1", {}, {}, {}, 5000), (c, "http://172.17.0.5:5000"))
+        self.assertIsNone(dr._pull_and_run.call_args[1]["ports"])
+
+        c.attrs = {"NetworkSettings": {"Networks": {}}}
+        with self.assertRaisesRegex(Exception, "no address on a container network"):
+            dr.run_server("srv", "mod:1", {}, {}, {}, 5000)
+        c.remove.assert_called_once()
+
+    def test_sort_timestamps(self):
+        sout = b"2019-07-08T23:21:32.5Z a\n2019-07-08T23:21:32.5Z b\n2019-07-08T23:21:33Z   e\n"
+        serr = b"2019-07-08T23:21:32.5Z c\n2019-07-08T23:21:32.500000001Z d\n"
+        lines = list(DockerRunner._sort_lines_by_time(sout, serr))
+        self.assertEqual([line["line"] for line in lines], ["a", "b", "c", "d", "  e"])
+        self.assertEqual([line["is_error"] for line in lines], [0, 0, 1, 1, 0])
+        self.assertEqual(lines[0]["ts"], 1562628092500)
+        self.assertEqual(lines[4]["ts"], 1562628093000)
+
+    def test_sort_no_timestamp(self):
+        # Lines without a timestamp take the previous line's, and have none if they lead
+        sout = b"no timestamp\n2019-07-08T23:21:32.5Z a\nnor here\n"
+        lines = list(DockerRunner._sort_lines_by_time(sout, b""))
+        self.assertEqual([line["line"] for line in lines], ["timestamp", "a", "here"])
+        self.assertNotIn("ts", lines[0])
+        self.assertEqual(lines[1]["ts"], 1562628092500)
+        self.assertEqual(lines[2]["ts"], 1562628092500)
+
+    @patch("JobRunner.DockerRunner._LOG_BATCH_LINES", 2)
+    @patch("JobRunner.DockerRunner.docker", autospec=True)
+    def test_shepherd_logs_batches(self, mock_docker):
+        mlog = MagicMock()
+        dr = DockerRunner(logger=mlog)
+        c = MagicMock()
+        c.logs.side_effect = [
+            b"2019-07-08T23:21:32.5Z a\n2019-07-08T23:21:33.5Z c\n",
+            b"2019-07-08T23:21:33Z b\n",
+        ]
+        dr._shepherd_logs(c, "1", 2, 1)
+        batches = [[line["line"] for line in call[0][0]] for call in mlog.log_lines.call_args_list]
+        self.assertEqual(batches, [["a", "b"], ["c"]])
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+import unittest
+from threading import Event, Thread
+from unittest.mock import MagicMock
+
+from docker.errors import ImageNotFound
+
+from JobRunner.ImagePuller import ImagePuller
+from JobRunner.metrics import ContainerStats
+
+
+class MockImage(object):
+    def __init__(self, id, digests=None):
+        self.id = id
+        self.attrs = {"Size": 1024, "RepoDigests": digests or []}
+
+
+class ImagePullerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = MagicMock()
+        self.logger = MagicMock()
+        self.puller = ImagePuller(self.client, logger=self.logger)
+
+    def test_local_image(self):
+        self.client.images.get.return_value = MockImage("sha256:1", ["repo/mod@sha256:a"])
+        self.assertEqual(self.puller.get("repo/mod:latest"), "sha256:1")
+        self.assertEqual(self.puller.get("repo/mod:latest"), "sha256:1")
+        self.assertEqual(self.puller.cached("repo/mod@sha256:a"), "sha256:1")
+        self.client.images.get.assert_called_once_with(name="repo/mod:latest")
+        self.client.images.pull.assert_not_called()
+
+    def test_pull_reports(self):
+        self.client.images.get.side_effect = ImageNotFound("nope")
+        self.client.images.pull.return_value = MockImage("sha256:2")
+        self.assertEqual(self.puller.get("repo/mod:1"), "sha256:2")
+        msg = self.logger.log.call_args[0][0]
+        self.assertIn("Pulled image repo/mod:1 (sha256:2)", msg)
+        self.assertIn("1024 bytes", msg)
+
+    def test_pull_stats(self):
+        stats = ContainerStats()
+        puller = ImagePuller(self.client, stats=stats)
+        self.client.images.get.side_effect = ImageNotFound("nope")
+        self.client.images.pull.return_value = MockImage("sha256:2")
+        puller.get("repo/mod:1")
+        self.assertEqual(stats.snapshot()["pulls"]["count"], 1)
+
+    def test_pull_not_found(self):
+        self.client.images.get.side_effect = ImageNotFound("nope")
+        self.client.images.pull.side_effect = ImageNotFound("still nope")
+        self.assertIsNone(self.puller.get("repo/mod:1"))
+        self.logger.error.assert_called_once()
+        # Failures aren't cached
+        self.assertIsNone(self.puller.cached("repo/mod:1"))
+
+    def test_single_flight(self):
+        started = Event()
+        release = Event()
+
+        def pull(image):
+            started.set()
+            release.wait(5)
+            return MockImage("sha256:3")
+
+        self.client.images.get.side_effect = ImageNotFound("nope")
+        self.client.images.pull.side_effect = pull
+        results = []
+        threads = [Thread(target=lambda: results.append(self.puller.get("repo/mod:1")))
+                   for _ in range(5)]
+        threads[0].start()
+        self.assertTrue(started.wait(5))
+        for t in threads[1:]:
+            t.start()
+        release.set()
+        for t in threads:
+            t.join(5)
+        self.assertEqual(results, ["sha256:3"] * 5)
+        self.client.images.pull.assert_called_once_with("repo/mod:1")
+
+    def test_error_shared(self):
+        self.client.images.get.side_effect = ValueError("daemon down")
+        with self.assertRaises(ValueError):
+            self.puller.get("repo/mod:1")
+        self.client.images.get.side_effect = None
+        self.client.images.get.return_value = MockImage("sha256:4")
+        self.assertEqual(self.puller.get("repo/mod:1"), "sha256:4")
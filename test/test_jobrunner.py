@@ -3,12 +3,14 @@ import os
 import pytest
 import unittest
 from copy import deepcopy
+from threading import Semaphore, Thread
 from time import time as _time
 from time import sleep
 from unittest.mock import patch, MagicMock
 
 from requests import ConnectionError
 
+from clients.baseclient import BaseClient
 from JobRunner.JobRunner import JobRunner
 from JobRunner.config import Config
 from mock_data import (
@@ -20,6 +22,7 @@ from mock_data import (
 )
 from docker.errors import NotFound
 from JobRunner.exceptions import CantRestartJob
+from JobRunner.logstats import LogStats
 
 
 # TODO TEST some tests are marked online but always fail
@@ -32,8 +35,9 @@ class MockLogger(object):
         self.lines = []
         self.errors = []
         self.all = []
+        self.stats = LogStats()
 
-    def log_lines(self, lines):
+    def log_lines(self, lines, source=None):
         self.all.extend(lines)
 
     def log(self, line):
@@ -44,6 +48,12 @@ class MockLogger(object):
         self.errors.append(line)
         self.all.append([line, 1])
 
+    def end_source(self, source):
+        pass
+
+    def close(self):
+        pass
+
 
 class MockAuth(object):
     def __init__(self, data):
@@ -120,6 +130,74 @@ class JobRunnerTest(unittest.TestCase):
         self.assertNotIn("error", out)
         sleep(1)
 
+    @patch("JobRunner.JobRunner.KBaseAuth", autospec=True)
+    @patch("JobRunner.JobRunner.EE2", autospec=True)
+    def test_prefetch_images(self, mock_ee2, mock_auth):
+        jr = JobRunner(self.config)
+        jr.subjob_history = MagicMock()
+        jr.subjob_history.get.return_value = [("mod2", "beta"), ("special", "release")]
+        jr.cc.get_image_name = MagicMock(side_effect=lambda m, v: f"kbase/{m}:{v}")
+        prefetched = Semaphore(0)
+        jr.mr.prefetch_image = MagicMock(side_effect=lambda image: prefetched.release())
+        params = {"method": "mod1.run", "app_id": "mod1/run", "service_ver": "dev"}
+        jr._prefetch_images(params)
+        # The images are pulled in threads
+        for _ in range(2):
+            self.assertTrue(prefetched.acquire(timeout=5))
+        jr.subjob_history.get.assert_called_once_with("mod1/run")
+        self.assertEqual(
+            sorted(c[0][0] for c in jr.mr.prefetch_image.call_args_list),
+            ["kbase/mod1:dev", "kbase/mod2:beta"],
+        )
+
+    @patch("JobRunner.JobRunner.KBaseAuth", autospec=True)
+    @patch("JobRunner.JobRunner.EE2", autospec=True)
+    def test_failed_run_ships_logs(self, mock_ee2, mock_auth):
+        config = deepcopy(self.config)
+        config.log_buffered = True
+        config.log_flush_interval = 3600
+        jr = JobRunner(config)
+        jr.ee2.check_job_canceled.return_value = {"finished": False}
+        jr.ee2.get_job_params.side_effect = ConnectionError("ee2 is down")
+        with self.assertRaises(ConnectionError):
+            jr.run()
+        # The buffered lines are shipped, and lines logged afterwards are shipped directly
+        jr.logger.error("An unhandled exception resulted in a premature exit of the app")
+        calls = jr.ee2.add_job_logs.call_args_list
+        lines = [line["line"] for c in calls for line in c[0][1]]
+        self.assertEqual(lines[-2:], [
+            "Failed to get job parameters. Exiting.",
+            "An unhandled exception resulted in a premature exit of the app",
+        ])
+
+    @patch("JobRunner.JobRunner.KBaseAuth", autospec=True)
+    @patch("JobRunner.JobRunner.EE2", autospec=True)
+    def test_in_process_callback_server(self, mock_ee2, mock_auth):
+        config = deepcopy(self.config)
+        config.callback_in_process = True
+        jr = JobRunner(config)
+        jr.logger = MockLogger()
+        jr.cc.catalog.get_module_version = MagicMock(
+            return_value=deepcopy(CATALOG_GET_MODULE_VERSION))
+        jr.cc.catalog.list_volume_mounts = MagicMock(return_value=[])
+        jr.cc.catalog.get_secure_config_params = MagicMock(return_value=None)
+        jr.mr = MagicMock()
+        jr._update_prov = MagicMock()
+        cb_args = [jr.ip, jr.port, jr.jr_queue, jr.callback_queue, jr.token, True, jr.cc]
+        jr._start_callback_server(cb_args, {})
+        try:
+            self.assertIsInstance(jr.cbs, Thread)
+            client = BaseClient(jr.callback_url, token=jr.token)
+            job_id = client._submit_job("mod2.run", [{}])
+            _, sub_id, job_params = jr.jr_queue.get(timeout=5)
+            self.assertEqual(sub_id, job_id)
+            jr._submit(config={}, job_id=sub_id, job_params=job_params)
+        finally:
+            jr._stop_callback_server()
+        # The server's module lookup doesn't count as a use of the module
+        self.assertEqual(jr.logger.errors, [])
+        jr.mr.run.assert_called_once()
+
     @pytest.mark.offline
     @patch("JobRunner.JobRunner.KBaseAuth", autospec=True)
     @patch("JobRunner.JobRunner.EE2", autospec=True)
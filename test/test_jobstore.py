@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+import json
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+from JobRunner.JobStore import QUEUED, RUNNING, JobStore, JobStoreManager, SpilledOutput
+
+
+class JobStoreTest(unittest.TestCase):
+
+    def test_submit_and_deliver(self):
+        store = JobStore()
+        self.assertTrue(store.submit("j1", 2))
+        self.assertTrue(store.submit("j2", 2))
+        self.assertFalse(store.submit("j3", 2))
+        self.assertEqual(store.jobcount(), 2)
+        self.assertEqual(store.job_state("j1"), {"finished": 0})
+        self.assertIsNone(store.job_state("j3"))
+        self.assertFalse(store.has_job("j3"))
+
+        store.deliver("output", "j1", {"result": [1]})
+        self.assertEqual(store.jobcount(), 1)
+        self.assertEqual(store.job_state("j1"), {"result": [1], "finished": 1})
+        self.assertEqual(
+            store.job_states(["j1", "j2"]),
+            {"j1": {"result": [1], "finished": 1}, "j2": {"finished": 0}},
+        )
+        store.deliver("prov", None, ["prov"])
+        self.assertEqual(store.get_prov(), ["prov"])
+
+    def test_early_output(self):
+        store = JobStore()
+        store.deliver("output", "j1", {"result": [1]})
+        self.assertTrue(store.submit("j1", 1))
+        self.assertEqual(store.jobcount(), 0)
+        self.assertEqual(store.job_state("j1"), {"result": [1], "finished": 1})
+
+    def test_done(self):
+        store = JobStore()
+        store.submit("j1", 5)
+        store.submit("j2", 5)
+        store.deliver("output", "j2", {})
+        store.deliver("sync", "s1", None)
+        self.assertEqual(store.done(["j1", "j2"], ["s1", "s2"]), ["j2", "s1"])
+        # Seen sync markers are forgotten
+        self.assertEqual(store.done([], ["s1"]), [])
+
+    def test_abandon_sync(self):
+        store = JobStore()
+        # Abandoned after the marker was seen
+        store.deliver("sync", "s1", None)
+        store.abandon_sync("s1")
+        # and before
+        store.abandon_sync("s2")
+        store.deliver("sync", "s2", None)
+        self.assertEqual(store.done([], ["s1", "s2"]), [])
+        self.assertEqual(store._synced, set())
+        self.assertEqual(store._abandoned, set())
+
+    def test_shared_maxjobs(self):
+        manager = JobStoreManager()
+        manager.start()
+        try:
+            store = manager.JobStore()
+            with ThreadPoolExecutor(max_workers=10) as ex:
+                accepted = list(ex.map(lambda i: store.submit(f"j{i}", 7), range(50)))
+            self.assertEqual(accepted.count(True), 7)
+            self.assertEqual(store.jobcount(), 7)
+        finally:
+            manager.shutdown()
+
+    def test_queue(self):
+        store = JobStore()
+        self.assertEqual(store.submit_or_queue("j1", 1, {"n": 1}, 2), RUNNING)
+        self.assertFalse(store.full(1, 2))
+        self.assertEqual(store.submit_or_queue("j2", 1, {"n": 2}, 2), QUEUED)
+        self.assertEqual(store.submit_or_queue("j3", 1, {"n": 3}, 2), QUEUED)
+        self.assertTrue(store.full(1, 2))
+        self.assertIsNone(store.submit_or_queue("j4", 1, {"n": 4}, 2))
+        self.assertEqual((store.jobcount(), store.queuedcount()), (1, 2))
+        self.assertEqual(store.job_state("j2"), {"finished": 0, "queued": 1})
+        self.assertEqual(store.done(["j1", "j2"], []), [])
+        self.assertEqual(store.admit(1), [])
+
+        store.deliver("output", "j1", {})
+        # A slot is free, but queued jobs go first
+        self.assertFalse(store.submit("j5", 1))
+        self.assertEqual(store.admit(1), [("j2", {"n": 2})])
+        self.assertEqual(store.job_state("j2"), {"finished": 0})
+        self.assertEqual(store.job_state("j3"), {"finished": 0, "queued": 1})
+        self.assertEqual((store.jobcount(), store.queuedcount()), (1, 1))
+        store.deliver("output", "j2", {})
+        self.assertEqual(store.admit(2), [("j3", {"n": 3})])
+        self.assertEqual(store.done(["j2", "j3"], []), ["j2"])
+
+    def test_queue_fair_share(self):
+        store = JobStore()
+        store.submit_or_queue("a1", 3, share="a")
+        store.submit_or_queue("a2", 3, share="a")
+        store.submit_or_queue("b1", 3, share="b")
+        for job_id, share, priority in [
+            ("a3", "a", 0), ("a4", "a", 5), ("b2", "b", 0), ("b3", "b", 1), ("c1", "c", 0),
+        ]:
+            self.assertEqual(store.submit_or_queue(job_id, 3, job_id, 10, share, priority), QUEUED)
+        # c has nothing running, then b has fewer running than a
+        store.deliver("output", "a1", {})
+        self.assertEqual(store.admit(3), [("c1", "c1")])
+        store.deliver("output", "a2", {})
+        store.deliver("output", "c1", {})
+        # a4 has the highest priority in a, which has fewest running. Then a and b are level,
+        # and b3 has the higher priority. Then b is behind
+        self.assertEqual(store.admit(4), [("a4", "a4"), ("b3", "b3"), ("a3", "a3")])
+        store.deliver("output", "b1", {})
+        self.assertEqual(store.admit(4), [("b2", "b2")])
+
+    def test_stats(self):
+        store = JobStore()
+        store.submit_or_queue("j1", 1)
+        store.submit_or_queue("j2", 1, maxqueued=1)
+        store.deliver("output", "j3", {"result": ["abc"]}, 17)
+        with tempfile.NamedTemporaryFile() as f:
+            store.deliver("output", "j4", SpilledOutput(f.name, 1000))
+        # Outputs aren't encoded to find their size
+        store.deliver("output", "j5", {"result": ["unknown size"]})
+        store.deliver("metrics", None, {"log": {"lines": 2}})
+        self.assertEqual(store.stats(), {
+            "running": 1,
+            "queued": 1,
+            "output_bytes": 17,
+            "spilled_output_bytes": 1000,
+            "runner": {"log": {"lines": 2}},
+        })
+
+    def test_retention(self):
+        store = JobStore(retention=60)
+        store.submit("j1", 5)
+        store.submit("j2", 5)
+        store.deliver("output", "j1", {"result": [1]})
+        store.deliver("output", "j2", {"result": [2]})
+        with patch("JobRunner.JobStore._time", return_value=1000):
+            self.assertEqual(store.job_state("j1"), {"result": [1], "finished": 1})
+        with patch("JobRunner.JobStore._time", return_value=1030):
+            # Still retained, and the retention period doesn't restart
+            self.assertEqual(store.job_state("j1"), {"result": [1], "finished": 1})
+        with patch("JobRunner.JobStore._time", return_value=1061):
+            state = store.job_state("j1")
+            self.assertEqual(state["finished"], 1)
+            self.assertIn("has been discarded", state["error"]["message"])
+            self.assertTrue(store.has_job("j1"))
+            self.assertEqual(store.unknown(["j1", "j2", "j3"]), ["j3"])
+            # Never returned, so never discarded
+            self.assertEqual(store.job_state("j2"), {"result": [2], "finished": 1})
+        with patch("JobRunner.JobStore._time", return_value=1122):
+            # Discarded jobs are forgotten after another retention period
+            self.assertIsNone(store.job_state("j1"))
+            self.assertEqual(store.unknown(["j1", "j2"]), ["j1"])
+
+    def test_spilled_output(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".json") as f:
+            json.dump({"result": ["big"]}, f)
+            f.flush()
+            store = JobStore()
+            store.submit("j1", 5)
+            store.deliver("output", "j1", SpilledOutput(f.name, 100))
+            state = store.job_state("j1")
+            self.assertIsInstance(state, SpilledOutput)
+            self.assertEqual(json.loads(state.state_bytes()), {"result": ["big"], "finished": 1})
+        self.assertEqual(json.loads(state.state_bytes())["error"]["name"], "Output not found")
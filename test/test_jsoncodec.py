@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+import json
+import math
+import unittest
+
+from clients import jsoncodec
+from clients.baseclient import RawJSON, _encode
+
+
+class JsonCodecTest(unittest.TestCase):
+
+    def setUp(self):
+        self.previous = jsoncodec.get_codec()
+
+    def tearDown(self):
+        jsoncodec.set_codec(self.previous)
+
+    def test_codecs(self):
+        obj = {"a": [1, 2.5, None, True, "é"], "b": {"c": {}}, "s": {3}, "f": frozenset([4])}
+        for codec in jsoncodec.available():
+            jsoncodec.set_codec(codec)
+            body = jsoncodec.dumps(obj)
+            self.assertIsInstance(body, bytes, codec)
+            self.assertEqual(
+                json.loads(body),
+                {"a": [1, 2.5, None, True, "é"], "b": {"c": {}}, "s": [3], "f": [4]},
+                codec,
+            )
+            self.assertEqual(jsoncodec.loads(body), json.loads(body), codec)
+            self.assertEqual(jsoncodec.loads(body.decode()), json.loads(body), codec)
+            # Integers too big for orjson fall back to json
+            self.assertEqual(jsoncodec.loads(jsoncodec.dumps([2 ** 70])), [2 ** 70], codec)
+            with self.assertRaises(TypeError, msg=codec):
+                jsoncodec.dumps({"a": object()})
+            with self.assertRaises(ValueError, msg=codec):
+                jsoncodec.loads(b'{"a": ')
+
+    def test_default(self):
+        for codec in jsoncodec.available():
+            jsoncodec.set_codec(codec)
+            body = jsoncodec.dumps({"a": object(), "s": {1}}, default=lambda o: "x")
+            self.assertEqual(json.loads(body), {"a": "x", "s": [1]}, codec)
+
+    def test_nan(self):
+        obj = {"nan": float("nan"), "inf": [float("inf"), float("-inf")], "none": None}
+        for codec in jsoncodec.available():
+            jsoncodec.set_codec(codec)
+            body = jsoncodec.dumps(obj)
+            self.assertEqual(body, json.dumps(obj).encode(), codec)
+            out = jsoncodec.loads(body)
+            self.assertTrue(math.isnan(out["nan"]), codec)
+            self.assertEqual(out["inf"], [float("inf"), float("-inf")], codec)
+            self.assertIsNone(out["none"], codec)
+
+    def test_set_codec(self):
+        self.assertIn("json", jsoncodec.available())
+        with self.assertRaisesRegex(ValueError, "JSON codec foo is not available"):
+            jsoncodec.set_codec("foo")
+
+    def test_raw_json(self):
+        for codec in jsoncodec.available():
+            jsoncodec.set_codec(codec)
+            body = _encode({"params": [{"job_output": RawJSON(b'{"result": [1]}')}, {2}]})
+            self.assertEqual(json.loads(body), {"params": [{"job_output": {"result": [1]}}, [2]]})
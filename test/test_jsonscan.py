@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import tempfile
+import unittest
+
+from JobRunner.jsonscan import scan_object, scan_object_file
+
+
+class JsonScanTest(unittest.TestCase):
+
+    def test_scan_object(self):
+        obj = {
+            "version": "1.1",
+            "id": "12345",
+            "result": [{"a": 'b}]\\"', "c": [1, 2.5e3, None, True, {"d": []}]}],
+            "error": {"code": -32000, "message": "oops"},
+        }
+        buf = json.dumps(obj).encode()
+        scan = scan_object(buf, parse_keys=["error"])
+        self.assertEqual(set(scan.spans), set(obj))
+        self.assertIn("result", scan)
+        self.assertNotIn("foo", scan)
+        for key, (start, end) in scan.spans.items():
+            self.assertEqual(json.loads(buf[start:end]), obj[key])
+        self.assertEqual(scan.values, {"error": obj["error"]})
+
+        scan = scan_object(json.dumps(obj).encode(), parse_keys=["error"], max_parse_bytes=10)
+        self.assertEqual(scan.values, {})
+        self.assertEqual(scan_object(b' { } \n').spans, {})
+
+    def test_scan_object_invalid(self):
+        for buf in [
+            b"",
+            b"[]",
+            b'{"a": 1',
+            b'{"a": [1, 2}',
+            b'{"a": {"b": "c}',
+            b'{"a": 1,}',
+            b'{"a" 1}',
+            b'{"a": 1} x',
+            b'{"a": }',
+        ]:
+            with self.assertRaises(ValueError, msg=buf):
+                scan_object(buf)
+
+    def test_scan_object_file(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "output.json")
+            with open(path, "w") as f:
+                json.dump({"result": [{"data": "x" * 100000}]}, f)
+            scan = scan_object_file(path)
+            self.assertEqual(list(scan.spans), ["result"])
+            open(path, "w").close()
+            with self.assertRaisesRegex(ValueError, "Empty file"):
+                scan_object_file(path)
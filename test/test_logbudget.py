@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import unittest
+from unittest.mock import patch
+
+from JobRunner.logbudget import LogBudget
+
+
+def _lines(texts, is_error=0):
+    return [{"line": t, "is_error": is_error} for t in texts]
+
+
+class LogBudgetTest(unittest.TestCase):
+
+    def test_disabled(self):
+        self.assertFalse(LogBudget().enabled)
+        lines = _lines(["a" * 1000] * 100)
+        self.assertEqual(LogBudget().apply(lines), lines)
+
+    def test_truncate(self):
+        lb = LogBudget(max_line_bytes=4)
+        out = lb.apply([{"line": "abcdefg", "is_error": 1, "ts": 1}, {"line": "abcd", "is_error": 0}])
+        self.assertEqual(out, [
+            {"line": "abcd [truncated 3 bytes]", "is_error": 1, "ts": 1},
+            {"line": "abcd", "is_error": 0},
+        ])
+
+    def test_job_max_bytes(self):
+        lb = LogBudget(max_bytes=5)
+        out = lb.apply(_lines(["ab", "cd", "ef", "gh"]), source="1")
+        # Once the limit is reached even lines that would fit are suppressed
+        out += lb.apply(_lines(["i"]), source="2")
+        self.assertEqual(out, _lines(["ab", "cd"]) + [
+            {"line": "[Job log limit of 5 bytes reached, further output will be suppressed]",
+             "is_error": 1},
+        ])
+        self.assertEqual(lb.flush(), [
+            {"line": "[2 lines / 4 bytes suppressed by the job log limits]", "is_error": 1},
+            {"line": "[1 lines / 1 bytes suppressed by the job log limits]", "is_error": 1},
+        ])
+        self.assertEqual(lb.flush(), [])
+
+    def test_container_max_bytes(self):
+        lb = LogBudget(source_max_bytes=2)
+        out = lb.apply(_lines(["ab", "cd"]), source="1")
+        out += lb.apply(_lines(["ef"]), source="2")
+        out += lb.apply(_lines([""]), source="1")
+        self.assertEqual(out, _lines(["ab"]) + [
+            {"line": "[Container log limit of 2 bytes reached, further output will be suppressed]",
+             "is_error": 1},
+        ] + _lines(["ef"]))
+
+    def test_end(self):
+        lb = LogBudget(source_max_bytes=2)
+        lb.apply(_lines(["ab", "cd"]), source="1")
+        lb.apply(_lines(["ef"]), source="2")
+        self.assertEqual(lb.end("1"), [
+            {"line": "[1 lines / 2 bytes suppressed by the job log limits]", "is_error": 1},
+        ])
+        self.assertEqual(lb.end("2"), [])
+        self.assertEqual(lb._sources, {})
+        self.assertEqual(lb.end("3"), [])
+
+    @patch("JobRunner.logbudget._time")
+    def test_lines_per_sec(self, mock_time):
+        lb = LogBudget(source_max_lines_per_sec=2)
+        mock_time.return_value = 100
+        out = lb.apply(_lines(["a", "b", "c", "dd"]), source="1")
+        self.assertEqual(out, _lines(["a", "b"]))
+        mock_time.return_value = 101
+        out = lb.apply(_lines(["e"]), source="1")
+        self.assertEqual(out, [
+            {"line": "[2 lines / 3 bytes suppressed by the job log limits]", "is_error": 1},
+        ] + _lines(["e"]))
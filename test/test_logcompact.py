@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from JobRunner.logcompact import LogCompactor
+
+
+def _lines(texts, is_error=0):
+    return [{"line": t, "is_error": is_error} for t in texts]
+
+
+class LogCompactorTest(unittest.TestCase):
+
+    def test_no_repeats(self):
+        lc = LogCompactor()
+        lines = _lines(["a", "b", "a"])
+        self.assertEqual(lc.compact(lines), lines)
+        self.assertEqual(lc.flush(), [])
+
+    def test_repeats(self):
+        lc = LogCompactor()
+        lines = _lines(["a", "b", "b", "c", "c", "c", "c"])
+        lines[6]["ts"] = 42
+        out = lc.compact(lines)
+        self.assertEqual(out, _lines(["a", "b", "b", "c"]))
+        out = lc.flush()
+        self.assertEqual(out, [{"line": "c [repeated 4 times, 2 omitted]", "is_error": 0, "ts": 42}])
+
+    def test_repeats_across_calls(self):
+        lc = LogCompactor()
+        self.assertEqual(lc.compact(_lines(["a", "a"])), _lines(["a"]))
+        self.assertEqual(lc.compact(_lines(["a", "b"])), _lines(["a [repeated 3 times, 1 omitted]", "b"]))
+
+    def test_stream_breaks_run(self):
+        lc = LogCompactor()
+        lines = [{"line": "a", "is_error": 0}, {"line": "a", "is_error": 1}]
+        self.assertEqual(lc.compact(lines), lines)
+
+    def test_sources(self):
+        lc = LogCompactor()
+        self.assertEqual(lc.compact(_lines(["a", "a"]), source="1"), _lines(["a"]))
+        self.assertEqual(lc.compact(_lines(["b", "b"]), source="2"), _lines(["b"]))
+        self.assertEqual(lc.compact(_lines(["a"]), source="1"), [])
+        self.assertEqual(lc.flush(source="2"), _lines(["b"]))
+        self.assertEqual(lc.flush(), _lines(["a [repeated 3 times, 1 omitted]"]))
+
+    def test_carriage_returns(self):
+        lc = LogCompactor()
+        out = lc.compact(_lines(["10%\r20%\r30%\r40%\r", "done\r\r", "x\ry"], is_error=1))
+        self.assertEqual(
+            out,
+            _lines(["10%", "40% [2 progress updates omitted]", "done", "x", "y"], is_error=1),
+        )
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+import tempfile
+import unittest
+from time import sleep as _sleep
+from unittest.mock import MagicMock
+
+from JobRunner.logger import Logger
+
+
+class LoggerTest(unittest.TestCase):
+
+    def _shipped(self, ee2):
+        lines = []
+        for call in ee2.add_job_logs.call_args_list:
+            lines.extend(call[0][1])
+        return lines
+
+    def test_unbuffered(self):
+        ee2 = MagicMock()
+        logger = Logger("1234", ee2=ee2)
+        logger.log("foo")
+        logger.error("bar", ts=1234)
+        self.assertEqual(ee2.add_job_logs.call_count, 2)
+        self.assertEqual(
+            self._shipped(ee2),
+            [{"line": "foo", "is_error": 0}, {"line": "bar", "is_error": 1, "ts": 1234}],
+        )
+        # no-ops when not buffered
+        self.assertTrue(logger.flush())
+        logger.close()
+
+    def test_buffered_batches(self):
+        ee2 = MagicMock()
+        logger = Logger("1234", ee2=ee2, buffered=True, batch_lines=10, flush_interval=60)
+        lines = [{"line": str(i), "is_error": 0} for i in range(25)]
+        logger.log_lines(lines)
+        self.assertTrue(logger.flush(timeout=5))
+        self.assertEqual(self._shipped(ee2), lines)
+        for call in ee2.add_job_logs.call_args_list:
+            self.assertEqual(call[0][0], {"job_id": "1234"})
+            self.assertLessEqual(len(call[0][1]), 10)
+        logger.close()
+        self.assertFalse(logger._flush_thread.is_alive())
+
+    def test_buffered_batch_bytes(self):
+        ee2 = MagicMock()
+        logger = Logger("1234", ee2=ee2, buffered=True, batch_bytes=10, flush_interval=60)
+        logger.log_lines([{"line": "x" * 6, "is_error": 0} for _ in range(4)])
+        logger.close()
+        self.assertEqual(ee2.add_job_logs.call_count, 4)
+        self.assertEqual(len(self._shipped(ee2)), 4)
+
+    def test_buffered_flush_interval(self):
+        ee2 = MagicMock()
+        logger = Logger("1234", ee2=ee2, buffered=True, flush_interval=0.1)
+        logger.log("foo")
+        for _ in range(50):
+            if ee2.add_job_logs.called:
+                break
+            _sleep(0.1)
+        self.assertEqual(self._shipped(ee2), [{"line": "foo", "is_error": 0}])
+        logger.close()
+
+    def test_log_after_close(self):
+        ee2 = MagicMock()
+        logger = Logger("1234", ee2=ee2, buffered=True, flush_interval=60)
+        logger.log("foo")
+        logger.close()
+        logger.log("bar")
+        self.assertEqual(
+            self._shipped(ee2),
+            [{"line": "foo", "is_error": 0}, {"line": "bar", "is_error": 0}],
+        )
+
+    def test_spill(self):
+        ee2 = MagicMock()
+        ee2.add_job_logs.side_effect = [ConnectionError(), None, None]
+        with tempfile.TemporaryDirectory() as spill_dir:
+            logger = Logger("1234", ee2=ee2, spill_dir=spill_dir)
+            logger.spill.initial_backoff = 0.01
+            logger.log("foo")
+            # goes to the journal behind foo rather than directly to ee2
+            logger.log("bar")
+            logger.close()
+            self.assertFalse(logger.spill.pending)
+        self.assertEqual(
+            self._shipped(ee2),
+            [{"line": "foo", "is_error": 0},
+             {"line": "foo", "is_error": 0},
+             {"line": "bar", "is_error": 0}],
+        )
+
+    def test_compact(self):
+        ee2 = MagicMock()
+        logger = Logger("1234", ee2=ee2, compact=True)
+        logger.log_lines([{"line": "a", "is_error": 0}] * 5, source="1")
+        self.assertEqual(self._shipped(ee2), [{"line": "a", "is_error": 0}])
+        logger.close()
+        self.assertEqual(
+            self._shipped(ee2),
+            [{"line": "a", "is_error": 0},
+             {"line": "a [repeated 5 times, 3 omitted]", "is_error": 0}],
+        )
+
+    def test_end_source(self):
+        ee2 = MagicMock()
+        logger = Logger("1234", ee2=ee2, compact=True, container_max_bytes=2)
+        logger.log_lines([{"line": "a", "is_error": 0}] * 2, source="1")
+        logger.log_lines([{"line": "bcd", "is_error": 0}], source="2")
+        ee2.add_job_logs.reset_mock()
+        # Nothing gets through, so nothing is shipped
+        logger.log_lines([{"line": "efg", "is_error": 0}], source="2")
+        ee2.add_job_logs.assert_not_called()
+        logger.end_source("1")
+        self.assertEqual(self._shipped(ee2), [{"line": "a", "is_error": 0}])
+        self.assertEqual(logger.compactor.sources(), ["2"])
+        self.assertNotIn("1", logger.budget._sources)
+        ee2.add_job_logs.reset_mock()
+        logger.end_source("2")
+        self.assertEqual(
+            [line["line"] for line in self._shipped(ee2)],
+            ["[2 lines / 6 bytes suppressed by the job log limits]"],
+        )
+        self.assertEqual(logger.compactor.sources(), [])
+        self.assertEqual(logger.budget._sources, {})
+
+    def test_limits(self):
+        ee2 = MagicMock()
+        logger = Logger("1234", ee2=ee2, max_bytes=3, max_line_bytes=2)
+        logger.log_lines([{"line": "abc", "is_error": 0}, {"line": "d", "is_error": 0},
+                          {"line": "e", "is_error": 0}])
+        # runner messages aren't limited
+        logger.log("fgh")
+        logger.close()
+        self.assertEqual(
+            [line["line"] for line in self._shipped(ee2)],
+            ["ab [truncated 1 bytes]",
+             "d",
+             "[Job log limit of 3 bytes reached, further output will be suppressed]",
+             "fgh",
+             "[1 lines / 1 bytes suppressed by the job log limits]"],
+        )
+
+    def test_stats(self):
+        ee2 = MagicMock()
+        logger = Logger("1234", ee2=ee2, compact=True)
+        logger.log_lines([{"line": "a", "is_error": 0}] * 3, source="1")
+        logger.log("bc")
+        logger.close()
+        snap = logger.stats.snapshot()
+        self.assertEqual(snap["lines"], 4)
+        self.assertEqual(snap["sources"]["1"]["lines"], 3)
+        # the compacted container output plus the runner message
+        self.assertEqual(snap["shipped_lines"], 3)
+        self.assertEqual(snap["ee2_calls"], 3)
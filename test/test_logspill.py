@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+from JobRunner.logspill import LogSpillJournal
+
+
+class LogSpillJournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "spill", "log.jsonl")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _sent(self, send):
+        lines = []
+        for call in send.call_args_list:
+            lines.extend(call[0][0])
+        return lines
+
+    def test_replay_in_order_with_backoff(self):
+        send = MagicMock(side_effect=[ConnectionError(), ConnectionError(), None, None])
+        journal = LogSpillJournal(
+            self.path, send, batch_lines=2, initial_backoff=0.01, max_backoff=0.02)
+        lines = [{"line": str(i), "is_error": 0} for i in range(3)]
+        journal.append(lines)
+        self.assertTrue(journal.pending)
+        self.assertTrue(journal.drain(timeout=5))
+        self.assertFalse(journal.pending)
+        self.assertEqual(send.call_count, 4)
+        # the failed attempts are retried with the same batch
+        self.assertEqual(self._sent(send)[4:], lines)
+        self.assertEqual(os.path.getsize(self.path), 0)
+
+    def test_drain_timeout(self):
+        send = MagicMock(side_effect=ConnectionError())
+        journal = LogSpillJournal(self.path, send, initial_backoff=60)
+        journal.append([{"line": "foo", "is_error": 0}])
+        self.assertFalse(journal.drain(timeout=0.2))
+        self.assertTrue(journal.pending)
+
+    def test_replay_existing_journal(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, "w") as f:
+            f.write('{"line": "foo", "is_error": 0}\n')
+            f.write('not json\n')
+            f.write('{"line": "bar", "is_error": 1}\n')
+        send = MagicMock()
+        journal = LogSpillJournal(self.path, send, batch_lines=1)
+        self.assertTrue(journal.drain(timeout=5))
+        self.assertEqual(
+            self._sent(send),
+            [{"line": "foo", "is_error": 0}, {"line": "bar", "is_error": 1}],
+        )
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from JobRunner.logstats import LatencyHistogram, LogStats
+
+
+class LogStatsTest(unittest.TestCase):
+
+    def test_histogram(self):
+        h = LatencyHistogram(buckets=(0.1, 1.0))
+        for s in (0.05, 0.1, 0.5, 2.0):
+            h.observe(s)
+        self.assertEqual(h.counts, [2, 1, 1])
+        self.assertEqual(h.count, 4)
+        self.assertAlmostEqual(h.sum, 2.65)
+        self.assertEqual(h.max, 2.0)
+        self.assertEqual(h.quantile(0.5), 0.1)
+        self.assertEqual(h.quantile(0.75), 1.0)
+        self.assertEqual(h.quantile(1.0), 2.0)
+        self.assertEqual(LatencyHistogram().quantile(0.5), 0.0)
+
+    def test_counters(self):
+        stats = LogStats()
+        stats.record_lines([{"line": "abc", "is_error": 0}], source="1", seconds=0.2)
+        stats.record_lines([{"line": "de", "is_error": 1}] * 2, source="2")
+        stats.record_lines([{"line": "f", "is_error": 0}])
+        stats.record_ee2_call([{"line": "abc", "is_error": 0}], 0.3, success=True)
+        stats.record_ee2_call([{"line": "de", "is_error": 0}], 5, success=False)
+        stats.record_retry()
+        stats.record_spill([{"line": "de", "is_error": 0}])
+        snap = stats.snapshot()
+        self.assertEqual(snap["lines"], 4)
+        self.assertEqual(snap["bytes"], 8)
+        self.assertEqual(snap["sources"]["1"]["lines"], 1)
+        self.assertEqual(snap["sources"]["1"]["blocked"]["sum"], 0.2)
+        self.assertEqual(snap["sources"]["2"]["bytes"], 4)
+        self.assertEqual(snap["shipped_lines"], 1)
+        self.assertEqual(snap["shipped_bytes"], 3)
+        self.assertEqual(snap["ee2_calls"], 2)
+        self.assertEqual(snap["ee2_failures"], 1)
+        self.assertEqual(snap["ee2_retries"], 1)
+        self.assertEqual(snap["spilled_lines"], 1)
+        self.assertEqual(snap["ee2_latency"]["count"], 2)
+        summary = stats.summary()
+        self.assertEqual(len(summary), 4)
+        self.assertIn("4 produced", summary[0])
+        self.assertIn("2 calls, 1 failures, 1 retries", summary[1])
+        self.assertTrue(summary[2].startswith("Container 1: 1 lines"))
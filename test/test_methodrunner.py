@@ -1,10 +1,14 @@
 # -*- coding: utf-8 -*-
+import json
 import os
+import shutil
 import unittest
 from copy import deepcopy
 from queue import Queue
 from pathlib import Path
+from unittest.mock import MagicMock
 
+from JobRunner.JobStore import SpilledOutput
 from JobRunner.MethodRunner import MethodRunner
 from JobRunner.config import Config
 from mock_data import (
@@ -19,7 +23,7 @@ class MockLogger(object):
         self.lines = []
         self.errors = []
 
-    def log_lines(self, lines):
+    def log_lines(self, lines, source=None):
         self.lines.append(lines)
 
     def log(self, line):
@@ -127,6 +131,24 @@ class MethodRunnerTest(unittest.TestCase):
         err = "Too much output from a method"
         self.assertEqual(result["error"]["name"], err)
 
+    def test_spilled_output(self):
+        mr = MethodRunner(self.cfg, logger=MockLogger())
+        module_info = deepcopy(CATALOG_GET_MODULE_VERSION)
+        module_info["docker_img_name"] = "mock_app:latest"
+        Path(f"{self.workdir}/workdir/output.json").unlink(missing_ok=True)
+        q = Queue()
+        action = mr.run(self.conf, module_info, EE2_JOB_PARAMS, self.job_id, fin_q=q)
+        self.assertIn("name", action)
+        out = q.get(timeout=10)
+        self.assertEqual(out[0], "finished")
+        result = mr.get_output(self.job_id, subjob=False, spill_size=10)
+        self.assertIsInstance(result, SpilledOutput)
+        self.assertEqual(result.path, f"{self.workdir}/workdir/output.json")
+        self.assertEqual(json.loads(result.state_bytes())["finished"], 1)
+        result, size = mr.read_output(self.job_id, subjob=False, spill_size=10 * 1024 * 1024)
+        self.assertNotIsInstance(result, SpilledOutput)
+        self.assertEqual(size, os.stat(f"{self.workdir}/workdir/output.json").st_size)
+
     def test_secure_params(self):
         mr = MethodRunner(self.cfg, logger=MockLogger())
         module_info = deepcopy(CATALOG_GET_MODULE_VERSION)
@@ -141,6 +163,35 @@ class MethodRunnerTest(unittest.TestCase):
         mr.run(self.conf, module_info, params, self.job_id, fin_q=q)
         self.assertIn("KBASE_SECURE_CONFIG_PARAM_param1", mockrunner.env)
 
+    def test_module_server(self):
+        mr = MethodRunner(self.cfg, logger=MockLogger())
+        mr.module_servers = MagicMock()
+        module_info = deepcopy(CATALOG_GET_MODULE_VERSION)
+        module_info["docker_img_name"] = "mock_app:latest"
+        shutil.rmtree(os.path.join(self.workdir, "module_servers"), ignore_errors=True)
+        q = Queue()
+        # The main job sets up the subjob directories
+        mr.runner = MockRunner()
+        mr.run(self.conf, module_info, EE2_JOB_PARAMS, self.job_id, fin_q=q)
+        for job_id in ["sub1", "sub2"]:
+            params = deepcopy(EE2_JOB_PARAMS)
+            params["params"] = [{"call": job_id}]
+            mr.run(self.conf, module_info, params, job_id, fin_q=q, subjob=True)
+        calls = mr.module_servers.call.call_args_list
+        self.assertEqual(len(calls), 2)
+        for job_id, call in zip(["sub1", "sub2"], calls):
+            # Each call gets its own work directory and input
+            job_dir = call[0][6]
+            self.assertEqual(job_dir, mr._get_job_dir(job_id, subjob=True))
+            with open(os.path.join(job_dir, "input.json")) as f:
+                self.assertEqual(json.load(f)["params"], [{"call": job_id}])
+        # and the server's work directory has no call's input
+        server_vols = calls[0][0][4]
+        server_dir = [k for k, v in server_vols.items() if v["bind"] == "/kb/module/work"][0]
+        self.assertNotIn(server_dir, [call[0][6] for call in calls])
+        self.assertTrue(os.path.exists(os.path.join(server_dir, "config.properties")))
+        self.assertFalse(os.path.exists(os.path.join(server_dir, "input.json")))
+
     def test_bad_method(self):
         mr = MethodRunner(self.cfg, logger=MockLogger())
         module_info = deepcopy(CATALOG_GET_MODULE_VERSION)
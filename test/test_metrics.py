@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from JobRunner.logstats import LatencyHistogram
+from JobRunner.metrics import ContainerStats, Metric, RPCStats, render
+
+
+class MetricsTest(unittest.TestCase):
+
+    def test_render(self):
+        hist = LatencyHistogram(buckets=(0.1, 1.0))
+        for seconds in [0.05, 0.5, 0.7, 3]:
+            hist.observe(seconds)
+        text = render([
+            Metric("jr_up", "gauge", "Up").add(1),
+            Metric("jr_calls_total", "counter", "Calls").add(2, method='a"b').add(3, method="c"),
+            Metric("jr_latency_seconds", "histogram", "Latency").add_histogram(
+                hist.to_dict(), method="a"),
+        ])
+        self.assertEqual(text, "\n".join([
+            "# HELP jr_up Up",
+            "# TYPE jr_up gauge",
+            "jr_up 1",
+            "# HELP jr_calls_total Calls",
+            "# TYPE jr_calls_total counter",
+            'jr_calls_total{method="a\\"b"} 2',
+            'jr_calls_total{method="c"} 3',
+            "# HELP jr_latency_seconds Latency",
+            "# TYPE jr_latency_seconds histogram",
+            'jr_latency_seconds_bucket{method="a",le="0.1"} 1',
+            'jr_latency_seconds_bucket{method="a",le="1.0"} 3',
+            'jr_latency_seconds_bucket{method="a",le="+Inf"} 4',
+            'jr_latency_seconds_sum{method="a"} 4.25',
+            'jr_latency_seconds_count{method="a"} 4',
+        ]) + "\n")
+
+    def test_stats(self):
+        rpc = RPCStats()
+        rpc.record("_submit", 0.2, False)
+        rpc.record("_submit", 0.3, True)
+        snap = rpc.snapshot()["_submit"]
+        self.assertEqual((snap["requests"], snap["errors"]), (2, 1))
+        self.assertEqual(snap["latency"]["count"], 2)
+
+        containers = ContainerStats()
+        containers.record_start()
+        containers.record_exit()
+        containers.record_pull(12)
+        snap = containers.snapshot()
+        self.assertEqual((snap["starts"], snap["exits"]), (1, 1))
+        self.assertEqual(snap["pulls"]["sum"], 12)
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from queue import Queue
+from threading import Thread
+from time import sleep as _sleep
+from unittest.mock import MagicMock
+
+from JobRunner.ModuleServers import ModuleServers, SERVER_PORT
+
+
+class SDKHandler(BaseHTTPRequestHandler):
+    calls = []
+    delay = 0
+
+    def do_GET(self):
+        self.send_response(200)
+        self.end_headers()
+
+    def do_POST(self):
+        req = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.calls.append((req, self.headers["Authorization"]))
+        _sleep(self.delay)
+        body = json.dumps({"version": "1.1", "id": req["id"], "result": [req["params"][0]]})
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, *args):
+        pass
+
+
+class ModuleServersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        SDKHandler.calls = []
+        SDKHandler.delay = 0
+        self.httpd = HTTPServer(("127.0.0.1", 0), SDKHandler)
+        Thread(target=self.httpd.serve_forever, daemon=True).start()
+        self.container = MagicMock()
+        self.container.status = "running"
+        self.runner = MagicMock()
+        self.runner.run_server.return_value = (
+            self.container, f"http://127.0.0.1:{self.httpd.server_port}")
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        shutil.rmtree(self.dir)
+
+    def _job_dir(self, job_id, params):
+        job_dir = os.path.join(self.dir, job_id)
+        os.mkdir(job_dir)
+        with open(os.path.join(job_dir, "input.json"), "w") as f:
+            json.dump({"id": job_id, "version": "1.1", "method": "mod.run", "params": params}, f)
+        return job_dir
+
+    def test_calls_share_server(self):
+        servers = ModuleServers(self.runner, "token", max_workers=2)
+        q = Queue()
+        for i in range(3):
+            job_dir = self._job_dir(f"job{i}", [{"i": i}])
+            servers.call("mod:abc", "mod-abc", "mod:1", {}, {}, {}, job_dir, f"job{i}", q)
+        finished = sorted(q.get(timeout=5)[1] for _ in range(3))
+        self.assertEqual(finished, ["job0", "job1", "job2"])
+        self.runner.run_server.assert_called_once_with(
+            "mod-abc", "mod:1", {}, {}, {}, SERVER_PORT, cgroup=None)
+        with open(os.path.join(self.dir, "job1", "output.json")) as f:
+            self.assertEqual(json.load(f)["result"], [{"i": 1}])
+        self.assertEqual(SDKHandler.calls[0][1], "token")
+        servers.close()
+        self.runner.remove.assert_called_once_with(self.container)
+
+    def test_failed_server_restarts(self):
+        self.runner.run_server.side_effect = [
+            (self.container, "http://127.0.0.1:1"),
+            (self.container, f"http://127.0.0.1:{self.httpd.server_port}"),
+        ]
+        self.container.status = "exited"
+        servers = ModuleServers(self.runner, "token")
+        q = Queue()
+        job_dir = self._job_dir("job0", [{}])
+        servers.call("mod:abc", "mod-abc", "mod:1", {}, {}, {}, job_dir, "job0", q)
+        self.assertEqual(q.get(timeout=5), ["finished", "job0", None])
+        with open(os.path.join(job_dir, "output.json")) as f:
+            self.assertEqual(json.load(f)["error"]["name"], "Module server error")
+        self.runner.remove.assert_called_once_with(self.container)
+
+        self.container.status = "running"
+        job_dir = self._job_dir("job1", [{}])
+        servers.call("mod:abc", "mod-abc", "mod:1", {}, {}, {}, job_dir, "job1", q)
+        self.assertEqual(q.get(timeout=5), ["finished", "job1", None])
+        with open(os.path.join(job_dir, "output.json")) as f:
+            self.assertIn("result", json.load(f))
+        self.assertEqual(self.runner.run_server.call_count, 2)
+
+    def test_call_timeout(self):
+        SDKHandler.delay = 1
+        servers = ModuleServers(self.runner, "token", call_timeout=0.2)
+        q = Queue()
+        job_dir = self._job_dir("job0", [{}])
+        servers.call("mod:abc", "mod-abc", "mod:1", {}, {}, {}, job_dir, "job0", q)
+        self.assertEqual(q.get(timeout=5), ["finished", "job0", None])
+        with open(os.path.join(job_dir, "output.json")) as f:
+            error = json.load(f)["error"]
+        self.assertEqual(error["name"], "Module server error")
+        self.assertEqual(error["message"], "The module server didn't respond within 0.2 sec")
+        self.runner.remove.assert_called_once_with(self.container)
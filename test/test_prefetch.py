@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+from JobRunner.prefetch import SubjobHistory
+
+
+class SubjobHistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "history", "subjobs.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_record_and_get(self):
+        history = SubjobHistory(self.path, max_modules=3)
+        self.assertEqual(history.get("app/run"), [])
+        history.record("app/run", [("mod1", "release"), ("mod2", "beta")])
+        history.record("other/run", [("mod9", "release")])
+        self.assertEqual(history.get("app/run"), [("mod2", "beta"), ("mod1", "release")])
+        history.record("app/run", [("mod3", "release"), ("mod1", "release"), ("mod4", "dev")])
+        self.assertEqual(
+            SubjobHistory(self.path).get("app/run"),
+            [("mod4", "dev"), ("mod1", "release"), ("mod3", "release")],
+        )
+        self.assertEqual(history.get("other/run"), [("mod9", "release")])
+
+    def test_corrupt_file(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, "w") as f:
+            f.write("{not json")
+        history = SubjobHistory(self.path)
+        self.assertEqual(history.get("app/run"), [])
+        history.record("app/run", [("mod1", "release")])
+        self.assertEqual(history.get("app/run"), [("mod1", "release")])
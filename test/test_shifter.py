@@ -11,7 +11,7 @@ class MockLogger(object):
         self.errors = []
         self.all = []
 
-    def log_lines(self, lines):
+    def log_lines(self, lines, source=None):
         self.all.extend(lines)
 
     def log(self, line):
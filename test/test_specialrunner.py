@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
 import os
+import sys
 import unittest
+from subprocess import Popen, PIPE
 
 from JobRunner.SpecialRunner import SpecialRunner
 from JobRunner.config import Config
+from JobRunner.supervisor import run_blocking
 from queue import Queue
 
 
@@ -17,7 +20,7 @@ class MockLogger(object):
         self.all = []
         self.ct = 0
 
-    def log_lines(self, lines):
+    def log_lines(self, lines, source=None):
         self.ct += 1
         self.all.extend(lines)
 
@@ -116,3 +119,32 @@ class SpecialRunnerTest(unittest.TestCase):
             print()
         self.assertTrue(count)
         self.assertLess(self.logger.ct, 10)
+
+    def test_readio_split_reads(self):
+        # A multibyte character and a line split across writes, and no final newline
+        script = (
+            "import sys, time\n"
+            "out = sys.stdout.buffer\n"
+            "out.write(b'caf\\xc3'); out.flush(); time.sleep(0.2)\n"
+            "out.write(b'\\xa9 au\\nla'); out.flush(); time.sleep(0.2)\n"
+            "out.write(b'it'); out.flush()\n"
+        )
+        logger = MockLogger()
+        sr = SpecialRunner(self.config, "123", logger=logger)
+        proc = Popen([sys.executable, "-c", script], bufsize=0, stdout=PIPE, stderr=PIPE)
+        q = Queue()
+        run_blocking(sr._readio(proc, "1234", [q]))
+        self.assertEqual(
+            logger.all, [{"line": "caf\u00e9 au", "is_error": 0}, {"line": "lait", "is_error": 0}])
+        self.assertEqual(q.get(timeout=1)[0], "finished_special")
+
+    def test_failed_monitor(self):
+        def bad():
+            yield 0
+            raise ValueError("oops")
+
+        q = Queue()
+        self.sr.supervisor.spawn(bad(), on_error=self.sr._on_error("1234", [q]))
+        result = q.get(timeout=5)
+        self.assertEqual(result[:2], ["finished_special", "1234"])
+        self.assertIn("oops", result[2]["error"]["message"])
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+import os
+import unittest
+from queue import Queue
+from threading import Event, current_thread
+from time import time as _time
+
+from JobRunner.supervisor import Offload, PipeReader, Supervisor, run_blocking
+
+
+class SupervisorTest(unittest.TestCase):
+
+    def test_timers(self):
+        sup = Supervisor()
+        q = Queue()
+
+        def monitor(name, interval, steps):
+            for i in range(steps):
+                yield interval
+            q.put(name)
+
+        sup.spawn(monitor("slow", 0.2, 2))
+        sup.spawn(monitor("fast", 0.01, 3))
+        thread = sup._thread
+        self.assertEqual(q.get(timeout=5), "fast")
+        self.assertEqual(q.get(timeout=5), "slow")
+        # The thread exits once there is nothing left to supervise
+        thread.join(5)
+        self.assertEqual(sup.active, 0)
+        self.assertIsNone(sup._thread)
+        # and is restarted when needed
+        sup.spawn(monitor("again", 0, 1))
+        self.assertEqual(q.get(timeout=5), "again")
+
+    def test_files(self):
+        sup = Supervisor()
+        r, w = os.pipe()
+        q = Queue()
+
+        def monitor():
+            ready = yield [r], 60
+            q.put((ready, os.read(r, 100)))
+
+        sup.spawn(monitor())
+        os.write(w, b"hello")
+        self.assertEqual(q.get(timeout=5), ([r], b"hello"))
+        os.close(r)
+        os.close(w)
+
+    def test_wake(self):
+        sup = Supervisor()
+        q = Queue()
+        done = Event()
+
+        def monitor():
+            while not done.is_set():
+                yield 60
+            q.put(_time())
+
+        task = sup.spawn(monitor())
+        done.set()
+        start = _time()
+        task.wake()
+        self.assertLess(q.get(timeout=5) - start, 5)
+
+    def test_failed_monitor(self):
+        sup = Supervisor()
+        q = Queue()
+
+        def bad():
+            yield 0
+            raise ValueError("oops")
+
+        def good():
+            yield 0.05
+            q.put("good")
+
+        sup.spawn(bad(), on_error=lambda e: q.put(str(e)))
+        sup.spawn(good())
+        self.assertEqual(q.get(timeout=5), "oops")
+        self.assertEqual(q.get(timeout=5), "good")
+
+    def test_run_blocking(self):
+        out = []
+
+        def monitor():
+            yield 0.01
+            out.append("done")
+
+        run_blocking(monitor())
+        self.assertEqual(out, ["done"])
+
+    def test_offload(self):
+        sup = Supervisor(name="offload-supervisor")
+        q = Queue()
+        release = Event()
+
+        def blocked():
+            release.wait(5)
+            return current_thread().name
+
+        def fail():
+            raise ValueError("oops")
+
+        def monitor():
+            name = yield Offload(blocked)
+            try:
+                yield Offload(fail)
+            except ValueError as e:
+                q.put((name, str(e)))
+
+        def other():
+            yield 0.01
+            q.put("other")
+
+        sup.spawn(monitor())
+        sup.spawn(other())
+        # The blocked call doesn't hold up other monitors
+        self.assertEqual(q.get(timeout=5), "other")
+        release.set()
+        name, error = q.get(timeout=5)
+        self.assertTrue(name.startswith("offload-supervisor"))
+        self.assertNotEqual(name, "offload-supervisor")
+        self.assertEqual(error, "oops")
+
+    def test_run_blocking_offload(self):
+        out = []
+
+        def fail():
+            raise ValueError("oops")
+
+        def monitor():
+            out.append((yield Offload(sum, [1, 2])))
+            try:
+                yield Offload(fail)
+            except ValueError as e:
+                out.append(str(e))
+
+        run_blocking(monitor())
+        self.assertEqual(out, [3, "oops"])
+
+    def test_pipe_reader(self):
+        r, w = os.pipe()
+        with open(r, "rb", buffering=0) as f:
+            reader = PipeReader(f, 1)
+            # Nothing to read doesn't block
+            self.assertEqual(reader.read(), [])
+            os.write(w, b"caf\xc3")
+            self.assertEqual(reader.read(), [])
+            os.write(w, b"\xa9\nau la")
+            self.assertEqual(reader.read(), [{"line": "caf\u00e9", "is_error": 1}])
+            os.write(w, b"it")
+            os.close(w)
+            self.assertEqual(reader.read(), [])
+            self.assertEqual(reader.read(), [{"line": "au lait", "is_error": 1}])
+            self.assertTrue(reader.eof)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+from time import sleep, time
+from unittest.mock import MagicMock
+
+from JobRunner.WarmPool import WarmPool
+
+
+class WarmPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.pool_dir = os.path.join(self.dir, "warm_pool")
+        self.client = MagicMock()
+        self.client.containers.create.side_effect = lambda *a, **k: MagicMock()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _wait_for(self, pool, n):
+        end = time() + 5
+        while time() < end:
+            if len(pool) == n and not pool._filling:
+                return
+            sleep(0.01)
+        self.fail(f"Pool has {len(pool)} containers, expected {n}")
+
+    def test_fill_and_acquire(self):
+        pool = WarmPool(self.client, self.pool_dir, size=2)
+        labels = {"runner_job_id": "1", "app_id": "mod/run", "parent_job_id": "p"}
+        key = WarmPool.key("mod:1", {"A": "B"}, {}, labels)
+        self.assertIsNone(pool.acquire(key, "/nonexistent"))
+        pool.fill(key, "mod:1", {"A": "B"}, {}, labels)
+        self._wait_for(pool, 2)
+        kwargs = self.client.containers.create.call_args[1]
+        self.assertEqual(
+            kwargs["labels"], {"app_id": "mod/run", "parent_job_id": "p", "warm_pool": "true"})
+        # Subjob specific labels don't change the key, the others do
+        self.assertEqual(key, WarmPool.key("mod:1", {"A": "B"}, {}, dict(labels, job_dir="x")))
+        self.assertNotEqual(key, WarmPool.key("mod:1", {"A": "B"}, {}, {"app_id": "mod/run"}))
+        self.assertEqual(
+            list(kwargs["volumes"].values()), [{"bind": "/kb/module/work", "mode": "rw"}])
+
+        job_dir = os.path.join(self.dir, "job1")
+        os.mkdir(job_dir)
+        with open(os.path.join(job_dir, "input.json"), "w") as f:
+            f.write("{}")
+        c = pool.acquire(key, job_dir)
+        self.assertIsNotNone(c)
+        self.assertTrue(os.path.islink(job_dir))
+        self.assertEqual(os.path.dirname(os.readlink(job_dir)), self.pool_dir)
+        self.assertTrue(os.path.exists(os.path.join(os.readlink(job_dir), "input.json")))
+        self.assertEqual(len(pool), 1)
+        # A different configuration doesn't match
+        self.assertIsNone(pool.acquire(WarmPool.key("mod:1", {}, {}, labels), job_dir))
+
+    def test_max_size_evicts_lru(self):
+        pool = WarmPool(self.client, self.pool_dir, size=2, max_size=2)
+        key1 = WarmPool.key("mod:1", {}, {}, {})
+        key2 = WarmPool.key("mod:2", {}, {}, {})
+        pool.fill(key1, "mod:1", {}, {}, {})
+        self._wait_for(pool, 2)
+        pool.fill(key2, "mod:2", {}, {}, {})
+        self._wait_for(pool, 2)
+        self.assertEqual(len(pool._idle[key1]), 0)
+        self.assertEqual(len(pool._idle[key2]), 2)
+        self.assertEqual(len(os.listdir(self.pool_dir)), 2)
+
+    def test_idle_eviction(self):
+        pool = WarmPool(self.client, self.pool_dir, size=1, idle_timeout=0.05)
+        key = WarmPool.key("mod:1", {}, {}, {})
+        pool.fill(key, "mod:1", {}, {}, {})
+        self._wait_for(pool, 1)
+        c = pool._idle[key][0].container
+        sleep(0.1)
+        pool.evict_idle()
+        self.assertEqual(len(pool), 0)
+        c.remove.assert_called_once_with(force=True)
+        self.assertEqual(os.listdir(self.pool_dir), [])
+
+    def test_create_failure(self):
+        self.client.containers.create.side_effect = ValueError("no")
+        pool = WarmPool(self.client, self.pool_dir)
+        key = WarmPool.key("mod:1", {}, {}, {})
+        pool.fill(key, "mod:1", {}, {}, {})
+        self._wait_for(pool, 0)
+        self.assertEqual(os.listdir(self.pool_dir), [])